@@ -0,0 +1,306 @@
+"""Micro-benchmarks for the bot's hot paths.
+
+Run ``python bench.py <name>`` against a scratch copy of the database, e.g.
+``python bench.py db --users 10000``. Every benchmark builds its own
+temporary database so the real ``teamfinder.db`` is never touched.
+"""
+import argparse
+import asyncio
+import os
+import sqlite3
+import tempfile
+import time
+from typing import Callable, Dict, List
+
+import db
+import migrations
+
+
+def make_db(users: int) -> str:
+    """Create a temporary database with ``users`` synthetic rows."""
+    fd, path = tempfile.mkstemp(suffix=".db", prefix="teamfinder-bench-")
+    os.close(fd)
+    conn = sqlite3.connect(path)
+    migrations.migrate(conn)
+    conn.executemany(
+        "INSERT INTO users (id, name, username, skills) VALUES (?, ?, ?, ?)",
+        ((i, f"user{i}", f"user{i}", "python, sql") for i in range(1, users + 1)),
+    )
+    conn.commit()
+    conn.close()
+    return path
+
+
+def timeit(fn: Callable[[int], None], n: int) -> float:
+    """Return the mean wall time of ``fn`` in microseconds."""
+    start = time.perf_counter()
+    for i in range(n):
+        fn(i)
+    return (time.perf_counter() - start) / n * 1e6
+
+
+def percentile(values: List[float], p: float) -> float:
+    """Nearest-rank percentile of ``values`` (0 < p <= 100)."""
+    ordered = sorted(values)
+    rank = max(0, min(len(ordered) - 1, int(round(p / 100 * len(ordered))) - 1))
+    return ordered[rank]
+
+
+def bench_db(args: argparse.Namespace) -> None:
+    """Per-update DB overhead: one read and one write, as most handlers do."""
+    path = make_db(args.users)
+
+    def per_call_connect(i: int) -> None:
+        user_id = i % args.users + 1
+        conn = sqlite3.connect(path, check_same_thread=False)
+        conn.execute("SELECT vip_until FROM users WHERE id = ?", (user_id,)).fetchone()
+        conn.close()
+        conn = sqlite3.connect(path, check_same_thread=False)
+        conn.execute("UPDATE users SET email = ? WHERE id = ?", (f"u{i}@example.com", user_id))
+        conn.commit()
+        conn.close()
+
+    def pooled(i: int) -> None:
+        user_id = i % args.users + 1
+        db.fetchone("SELECT vip_until FROM users WHERE id = ?", (user_id,))
+        db.execute("UPDATE users SET email = ? WHERE id = ?", (f"u{i}@example.com", user_id))
+
+    try:
+        before = timeit(per_call_connect, args.n)
+        db.configure(path)
+        after = timeit(pooled, args.n)
+        print(f"connect per call: {before:8.1f} us/update")
+        print(f"pooled:           {after:8.1f} us/update ({before / after:.1f}x)")
+    finally:
+        db.close()
+        os.remove(path)
+
+
+def bench_load(args: argparse.Namespace) -> None:
+    """Update latency for many concurrent users while a slow writer runs.
+
+    Compares handlers that call the DB inline on the event loop with handlers
+    that await ``db.run``. Latency is measured from each update's scheduled
+    arrival, so time spent waiting for a stalled loop is included.
+    """
+    import main
+
+    path = make_db(args.users)
+    db.configure(path)
+    interval = 1 / args.rate
+    slow_write = "UPDATE users SET preferences = ?"
+
+    async def scenario(inline: bool) -> List[float]:
+        latencies: List[float] = []
+        stop = asyncio.Event()
+
+        async def slow_writer() -> None:
+            i = 0
+            while not stop.is_set():
+                params = (f"bulk {i}",)
+                if inline:
+                    db.execute(slow_write, params)
+                else:
+                    await db.run(db.execute, slow_write, params)
+                i += 1
+                await asyncio.sleep(0.01)
+
+        async def handle(i: int, arrival: float) -> None:
+            user_id = i % args.users + 1
+            if inline:
+                main.get_user_profile(user_id)
+            else:
+                await db.run(main.get_user_profile, user_id)
+            latencies.append((time.perf_counter() - arrival) * 1000)
+
+        writer = asyncio.create_task(slow_writer())
+        tasks = []
+        start = time.perf_counter()
+        for i in range(args.n):
+            arrival = start + i * interval
+            delay = arrival - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            tasks.append(asyncio.create_task(handle(i, arrival)))
+        await asyncio.gather(*tasks)
+        stop.set()
+        await writer
+        return latencies
+
+    try:
+        for label, inline in (("inline sqlite", True), ("db.run executor", False)):
+            latencies = asyncio.run(scenario(inline))
+            print(
+                f"{label:16s} p50 {percentile(latencies, 50):7.2f} ms  "
+                f"p99 {percentile(latencies, 99):7.2f} ms  max {max(latencies):7.2f} ms"
+            )
+    finally:
+        db.close()
+        os.remove(path)
+
+
+def bench_summary(args: argparse.Namespace) -> None:
+    """Summary job throughput for a generator that takes ``--job-ms`` per call."""
+    from summary_jobs import SummaryJobs
+
+    jobs = SummaryJobs(max_workers=args.workers, queue_limit=args.n)
+
+    def fake_generate(i: int) -> int:
+        time.sleep(args.job_ms / 1000)
+        return i
+
+    async def scenario() -> None:
+        await asyncio.gather(*(jobs.run(fake_generate, i) for i in range(args.n)))
+
+    asyncio.run(scenario())
+    jobs.shutdown()
+    stats = jobs.stats()
+    print(
+        f"{args.workers} workers: {stats['completed']} jobs, "
+        f"{stats['jobs_per_second']:.1f} jobs/s, {stats['avg_job_seconds'] * 1000:.1f} ms/job"
+    )
+
+
+def bench_signup(args: argparse.Namespace) -> None:
+    """Sign-up throughput with per-step commits versus the write-behind queue."""
+    from write_behind import WriteBehind
+
+    steps = (("phone_number", "+15550000"), ("email", "user@example.com"),
+             ("skills", "python, sql"), ("preferences", "remote"))
+
+    async def sign_up(user_id: int, writes: "WriteBehind | None") -> None:
+        await db.run(db.execute, "INSERT INTO users (id, name, username) VALUES (?, ?, ?)",
+                     (user_id, f"new{user_id}", f"new{user_id}"))
+        for field, value in steps:
+            if writes is None:
+                await db.run(db.execute, f"UPDATE users SET {field} = ? WHERE id = ?", (value, user_id))
+            else:
+                writes.put(user_id, field, value)
+
+    async def scenario(batched: bool, first_id: int) -> float:
+        writes = WriteBehind() if batched else None
+        start = time.perf_counter()
+        for offset in range(0, args.n, args.concurrency):
+            ids = range(first_id + offset, first_id + min(offset + args.concurrency, args.n))
+            await asyncio.gather(*(sign_up(user_id, writes) for user_id in ids))
+        if writes is not None:
+            await writes.close()
+        return args.n / (time.perf_counter() - start)
+
+    path = make_db(args.users)
+    db.configure(path)
+    try:
+        unbatched = asyncio.run(scenario(False, args.users + 1))
+        batched = asyncio.run(scenario(True, args.users + args.n + 1))
+        print(f"per-step commits: {unbatched:8.0f} sign-ups/s")
+        print(f"write-behind:     {batched:8.0f} sign-ups/s ({batched / unbatched:.1f}x)")
+    finally:
+        db.close()
+        os.remove(path)
+
+
+def bench_match(args: argparse.Namespace) -> None:
+    """Skill scoring for one query: per-row scan, full sort, heap and NumPy top-k.
+
+    Runs in memory only; ``--users`` synthetic users get 1-5 skills from a
+    200-entry vocabulary and each query asks for 3 skills.
+    """
+    import random
+
+    from skill_index import SkillIndex, np
+
+    rnd = random.Random(1)
+    vocabulary = [f"skill{i:03d}" for i in range(200)]
+    user_skills = [(user_id, rnd.sample(range(len(vocabulary)), rnd.randint(1, 5))) for user_id in range(1, args.users + 1)]
+    rows = [(user_id, ", ".join(vocabulary[skill_id] for skill_id in skill_ids)) for user_id, skill_ids in user_skills]
+    queries = [rnd.sample(range(len(vocabulary)), 3) for _ in range(50)]
+
+    def scan(i: int) -> None:
+        # The original find_team_members loop over every row
+        skills_needed = [vocabulary[skill_id] for skill_id in queries[i % len(queries)]]
+        matches = []
+        for user_id, skills_text in rows:
+            other_skills = [s.strip().lower() for s in skills_text.split(',')]
+            score = sum(1 for skill in skills_needed if any(skill in other for other in other_skills))
+            if score:
+                matches.append((user_id, score))
+        matches.sort(key=lambda m: (-m[1], m[0]))
+
+    indexes = {"sets": SkillIndex(vectorized=False)}
+    if np is not None:
+        indexes["numpy"] = SkillIndex(vectorized=True)
+    for index in indexes.values():
+        index.load((user_id, skill_id) for user_id, skill_ids in user_skills for skill_id in skill_ids)
+    results = {
+        "per-row scan": timeit(scan, max(1, args.n // 100)),
+        "index, full sort": timeit(lambda i: indexes["sets"].match(queries[i % len(queries)]), args.n),
+    }
+    for label, index in indexes.items():
+        results[f"index, {label} top-5"] = timeit(lambda i: index.top(queries[i % len(queries)], 5), args.n)
+    if np is None:
+        print("numpy not installed, skipping the vectorized index")
+    for label, micros in results.items():
+        print(f"{label:20s} {micros / 1000:9.2f} ms/query")
+
+
+def bench_search(args: argparse.Namespace) -> None:
+    """Team-search latency: skill index plus BM25 over profiles with portfolios.
+
+    Skills come from a 40-entry list and portfolios from a 5000-word
+    vocabulary. BM25 cost grows with the number of matching profiles, so
+    broad queries over very common skills are the slow case.
+    """
+    import random
+
+    import main
+    import search_index
+
+    skills = [f"skill{i:02d}" for i in range(40)]
+    vocabulary = [f"word{i}" for i in range(5000)] + skills
+    rnd = random.Random(1)
+    path = make_db(args.users)
+    conn = sqlite3.connect(path)
+    with conn:
+        conn.executemany(
+            "UPDATE users SET skills = ? WHERE id = ?",
+            ((", ".join(rnd.sample(skills, 3)), user_id) for user_id in range(1, args.users + 1)),
+        )
+        conn.executemany(
+            "INSERT INTO projects (user_id, created_at, text) VALUES (?, 0, ?)",
+            ((user_id, " ".join(rnd.choices(vocabulary, k=200))) for user_id in range(1, args.users + 1, 2)),
+        )
+    conn.close()
+    db.configure(path)
+    queries = [rnd.sample(skills, 2) for _ in range(50)]
+    try:
+        main.get_skill_index()
+        fts = timeit(lambda i: search_index.search(queries[i % len(queries)]), args.n)
+        team = timeit(lambda i: main.find_team_members(1, " ".join(queries[i % len(queries)])), args.n)
+        print(f"bm25 search:       {fts / 1000:8.2f} ms/query")
+        print(f"find_team_members: {team / 1000:8.2f} ms/query")
+    finally:
+        db.close()
+        os.remove(path)
+
+
+BENCHMARKS: Dict[str, Callable[[argparse.Namespace], None]] = {
+    "db": bench_db,
+    "load": bench_load,
+    "match": bench_match,
+    "search": bench_search,
+    "signup": bench_signup,
+    "summary": bench_summary,
+}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("name", choices=sorted(BENCHMARKS))
+    parser.add_argument("--users", type=int, default=10000)
+    parser.add_argument("-n", type=int, default=2000, help="iterations")
+    parser.add_argument("--workers", type=int, default=4, help="summary workers")
+    parser.add_argument("--job-ms", type=float, default=50, help="simulated summary time")
+    parser.add_argument("--concurrency", type=int, default=50, help="concurrent users")
+    parser.add_argument("--rate", type=float, default=500, help="updates per second (load)")
+    args = parser.parse_args()
+    BENCHMARKS[args.name](args)
@@ -0,0 +1,254 @@
+"""Bulk import and export of user profiles as JSONL or CSV.
+
+One record per user holds the profile columns, the portfolio projects, the
+payments and the unspent feature credits:
+
+    {"id": 1, "name": "Ann", ..., "vip_until": 1790000000,
+     "projects": [{"text": "...", "created_at": 1700000000.0}],
+     "payments": [{"charge_id": "...", "item_id": "vip", "amount": 50, "created_at": ..., "refunded_at": null}],
+     "credits": {"find_team": 1}}
+
+CSV files have the same columns, with ``projects``, ``payments`` and
+``credits`` as JSON.
+Both directions stream in ``BULK_BATCH`` sized chunks, so memory stays flat
+whatever the table size. Run them with the bot stopped:
+
+    python main.py export backup.jsonl
+    python main.py import backup.jsonl --db teamfinder.db
+
+An import is one transaction: users are upserted by id, a record's projects
+and credits replace the user's existing ones, and payments go through the
+ledger, so a charge that is already recorded is skipped. Importing a payment
+does not grant its credit again; the record's credits are the balances. The search triggers are dropped
+for the load and the derived skill and full-text indexes are rebuilt once at
+the end, before the transaction commits. Stored recommendation lists are
+dropped in the same transaction, so the next start recomputes them.
+"""
+import argparse
+import csv
+import itertools
+import json
+import logging
+import sqlite3
+import sys
+import time
+from operator import itemgetter
+from typing import Any, Dict, Iterable, Iterator, List, Optional, TextIO, Tuple
+
+import db
+import ledger
+import migrations
+import skills
+
+BULK_BATCH = 10000
+
+USER_COLUMNS = ('id', 'name', 'username', 'phone_number', 'email', 'skills', 'preferences', 'about_user', 'vip_until')
+PROJECT_COLUMNS = ('text', 'created_at')
+PAYMENT_COLUMNS = ('charge_id', 'item_id', 'amount', 'created_at', 'refunded_at')
+CHILD_COLUMNS = ('projects', 'payments', 'credits')
+CSV_COLUMNS = USER_COLUMNS + CHILD_COLUMNS
+
+# Tables whose triggers keep profile_search current row by row
+TRIGGER_TABLES = ('users', 'projects')
+
+COMMANDS = ('import', 'export')
+
+logger = logging.getLogger(__name__)
+
+Record = Dict[str, Any]
+
+
+def _grouped(rows: Iterable[tuple]) -> Iterator[Tuple[int, List[tuple]]]:
+    """(user_id, rows) from rows ordered by user_id in their first column."""
+    for user_id, group in itertools.groupby(rows, key=itemgetter(0)):
+        yield user_id, list(group)
+
+
+class _Children:
+    """Walks grouped child rows alongside users ordered by id."""
+
+    def __init__(self, rows: Iterable[tuple]) -> None:
+        self._groups = _grouped(rows)
+        self._next = next(self._groups, None)
+
+    def of(self, user_id: int) -> List[tuple]:
+        # Rows of users that do not exist are skipped
+        while self._next is not None and self._next[0] < user_id:
+            self._next = next(self._groups, None)
+        if self._next is None or self._next[0] != user_id:
+            return []
+        rows = self._next[1]
+        self._next = next(self._groups, None)
+        return rows
+
+
+def export_records(conn: sqlite3.Connection) -> Iterator[Record]:
+    """Every user with projects, payments and credits, by id; merge-joins four ordered scans."""
+    users = conn.execute(f"SELECT {', '.join(USER_COLUMNS)} FROM users ORDER BY id")
+    projects = _Children(conn.execute("SELECT user_id, text, created_at FROM projects ORDER BY user_id, id"))
+    payments = _Children(conn.execute(
+        "SELECT user_id, charge_id, item_id, amount, created_at, refunded_at FROM payments ORDER BY user_id, charge_id"
+    ))
+    credits = _Children(conn.execute(
+        "SELECT user_id, feature, balance FROM user_credits WHERE balance > 0 ORDER BY user_id, feature"
+    ))
+    for row in users:
+        record = dict(zip(USER_COLUMNS, row))
+        record['projects'] = [dict(zip(PROJECT_COLUMNS, project[1:])) for project in projects.of(row[0])]
+        record['payments'] = [dict(zip(PAYMENT_COLUMNS, payment[1:])) for payment in payments.of(row[0])]
+        record['credits'] = {feature: balance for _, feature, balance in credits.of(row[0])}
+        yield record
+
+
+def write_records(records: Iterable[Record], out: TextIO, fmt: str) -> int:
+    count = 0
+    if fmt == 'csv':
+        writer = csv.DictWriter(out, CSV_COLUMNS)
+        writer.writeheader()
+        for record in records:
+            writer.writerow(dict(
+                record, **{column: json.dumps(record[column], ensure_ascii=False) for column in CHILD_COLUMNS}
+            ))
+            count += 1
+    else:
+        for record in records:
+            out.write(json.dumps(record, ensure_ascii=False))
+            out.write("\n")
+            count += 1
+    return count
+
+
+def read_records(source: TextIO, fmt: str) -> Iterator[Record]:
+    if fmt == 'csv':
+        for row in csv.DictReader(source):
+            # CSV has no null: empty cells are missing values
+            record: Record = {column: value or None for column, value in row.items() if column in USER_COLUMNS}
+            record['id'] = int(row['id'])
+            if record.get('vip_until') is not None:
+                record['vip_until'] = int(record['vip_until'])
+            for column in CHILD_COLUMNS:
+                if row.get(column):
+                    record[column] = json.loads(row[column])
+            yield record
+    else:
+        for line in source:
+            if line.strip():
+                yield json.loads(line)
+
+
+def _drop_triggers(conn: sqlite3.Connection) -> List[str]:
+    """Drop the row-by-row search triggers; returns their SQL to recreate them."""
+    rows = conn.execute(
+        f"SELECT name, sql FROM sqlite_master WHERE type = 'trigger' "
+        f"AND tbl_name IN ({', '.join('?' * len(TRIGGER_TABLES))})",
+        TRIGGER_TABLES,
+    ).fetchall()
+    for name, _ in rows:
+        conn.execute(f"DROP TRIGGER {name}")
+    return [sql for _, sql in rows]
+
+
+def _load_batch(conn: sqlite3.Connection, batch: List[Record], now: float) -> int:
+    conn.executemany(
+        f"INSERT INTO users ({', '.join(USER_COLUMNS)}) VALUES ({', '.join('?' * len(USER_COLUMNS))}) "
+        f"ON CONFLICT(id) DO UPDATE SET {', '.join(f'{c} = excluded.{c}' for c in USER_COLUMNS[1:])}",
+        (tuple(record.get(column) for column in USER_COLUMNS) for record in batch),
+    )
+    with_projects = [record for record in batch if record.get('projects') is not None]
+    conn.executemany("DELETE FROM projects WHERE user_id = ?", ((record['id'],) for record in with_projects))
+    conn.executemany(
+        "INSERT INTO projects (user_id, created_at, text) VALUES (?, ?, ?)",
+        (
+            (record['id'], project.get('created_at') or now, project['text'])
+            for record in with_projects for project in record['projects']
+        ),
+    )
+    with_credits = [record for record in batch if record.get('credits') is not None]
+    conn.executemany("DELETE FROM user_credits WHERE user_id = ?", ((record['id'],) for record in with_credits))
+    conn.executemany(
+        "INSERT INTO user_credits (user_id, feature, balance) VALUES (?, ?, ?)",
+        (
+            (record['id'], feature, balance)
+            for record in with_credits for feature, balance in record['credits'].items() if balance
+        ),
+    )
+    payments = 0
+    for record in batch:
+        for payment in record.get('payments') or ():
+            payments += ledger.record_purchase(
+                payment['charge_id'], record['id'], payment['item_id'], payment['amount'], conn, payment.get('created_at')
+            )
+            if payment.get('refunded_at') is not None:
+                ledger.record_refund(payment['charge_id'], record['id'], conn, payment['refunded_at'])
+    return payments
+
+
+def import_records(records: Iterable[Record], batch_size: int = BULK_BATCH) -> Tuple[int, int]:
+    """Load records in one transaction; returns (users, new payments)."""
+    users = payments = 0
+    now = time.time()
+    try:
+        with db.transaction() as conn:
+            # sqlite3 does not open a transaction for DDL, so start it here
+            conn.execute("BEGIN IMMEDIATE")
+            triggers = _drop_triggers(conn)
+            it = iter(records)
+            while True:
+                batch = list(itertools.islice(it, batch_size))
+                if not batch:
+                    break
+                payments += _load_batch(conn, batch, now)
+                users += len(batch)
+                if users % (batch_size * 10) == 0:
+                    logger.info(f"Loaded {users} users")
+            for sql in triggers:
+                conn.execute(sql)
+            skills.rebuild_user_skills(conn)
+            migrations.build_search_index(conn, force=True)
+            # Any stored list may rank an imported user; Recommender.bootstrap recomputes them
+            conn.execute("DELETE FROM recommendations")
+    except Exception:
+        # Skill ids added by the rolled back transaction are gone
+        skills.catalog.invalidate()
+        raise
+    return users, payments
+
+
+def _format(path: str, fmt: Optional[str]) -> str:
+    return fmt or ('csv' if path.lower().endswith('.csv') else 'jsonl')
+
+
+def main(argv: List[str]) -> int:
+    parser = argparse.ArgumentParser(prog="main.py", description=__doc__.splitlines()[0])
+    parser.add_argument("command", choices=COMMANDS)
+    parser.add_argument("path", help="JSONL or CSV file, - for stdin/stdout")
+    parser.add_argument("--format", choices=("jsonl", "csv"), help="default: from the file extension, else jsonl")
+    parser.add_argument("--db", help="database file (default: TEAMFINDER_DB or teamfinder.db)")
+    parser.add_argument("--batch", type=int, default=BULK_BATCH, help="records per executemany batch")
+    args = parser.parse_args(argv)
+    fmt = _format(args.path, args.format)
+    if args.db:
+        db.configure(args.db)
+
+    start = time.perf_counter()
+    if args.command == 'export':
+        out = sys.stdout if args.path == '-' else open(args.path, 'w', encoding='utf-8', newline='')
+        try:
+            with db.transaction() as conn:
+                # One read transaction, so the three scans see the same snapshot
+                conn.execute("BEGIN")
+                count = write_records(export_records(conn), out, fmt)
+        finally:
+            if out is not sys.stdout:
+                out.close()
+        logger.info(f"Exported {count} users in {time.perf_counter() - start:.1f} s")
+    else:
+        source = sys.stdin if args.path == '-' else open(args.path, encoding='utf-8', newline='')
+        try:
+            users, payments = import_records(read_records(source, fmt), args.batch)
+        finally:
+            if source is not sys.stdin:
+                source.close()
+        logger.info(f"Imported {users} users and {payments} new payments in {time.perf_counter() - start:.1f} s")
+    db.close()
+    return 0
@@ -0,0 +1,109 @@
+"""Purchased feature credits: a per-user balance that purchases add to and uses spend.
+
+Balances live in ``user_credits`` and change only through single conditional
+statements, so two concurrent uses can never spend the same credit. ``cache``
+remembers the last balance seen per user and feature, which lets entitlement
+checks skip the database for users known to have nothing left. Purchases and
+refunds invalidate it, and like ``ProfileCache`` it refuses a balance read
+before an invalidation, so a stale zero cannot hide a purchase.
+"""
+import sqlite3
+import threading
+from collections import OrderedDict
+from typing import Dict, Optional
+
+CREDIT_CACHE_MAX_ENTRIES = 100000
+# Invalidations remembered to reject balances that raced with them
+CREDIT_CACHE_MAX_CHANGES = 10000
+
+FIND_TEAM = 'find_team'
+ABOUT_ME = 'about_me'
+
+# Items whose purchase adds a credit, used later through the command
+CREDIT_ITEMS = {'find_team': FIND_TEAM}
+# Items fulfilled right away; the buyer gets a credit instead if that fails for good
+FALLBACK_CREDITS = {'about_user_dict': ABOUT_ME}
+
+# How a user may use a paid feature: free as a VIP, or with a purchased credit
+VIP = 'vip'
+CREDIT = 'credit'
+
+
+def grant(conn: sqlite3.Connection, user_id: int, feature: str, amount: int = 1) -> None:
+    """Add credits in the caller's transaction; invalidate ``cache`` after it commits."""
+    conn.execute(
+        "INSERT INTO user_credits (user_id, feature, balance) VALUES (?, ?, ?) "
+        "ON CONFLICT(user_id, feature) DO UPDATE SET balance = balance + excluded.balance",
+        (user_id, feature, amount),
+    )
+
+
+def balance(conn: sqlite3.Connection, user_id: int, feature: str) -> int:
+    row = conn.execute(
+        "SELECT balance FROM user_credits WHERE user_id = ? AND feature = ?", (user_id, feature)
+    ).fetchone()
+    return row[0] if row else 0
+
+
+def spend(conn: sqlite3.Connection, user_id: int, feature: str) -> Optional[int]:
+    """Use one credit; returns the remaining balance, or None when there was none."""
+    row = conn.execute(
+        "UPDATE user_credits SET balance = balance - 1 WHERE user_id = ? AND feature = ? AND balance > 0 "
+        "RETURNING balance",
+        (user_id, feature),
+    ).fetchone()
+    return row[0] if row else None
+
+
+class CreditCache:
+    """Last known credit balance per (user, feature); a missing entry means unknown."""
+
+    def __init__(self, max_entries: int = CREDIT_CACHE_MAX_ENTRIES) -> None:
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[int, Dict[str, int]]" = OrderedDict()
+        self._changes: "OrderedDict[int, int]" = OrderedDict()
+        self._version = 0
+        self._forgotten = 0
+        self._lock = threading.Lock()
+
+    def version(self) -> int:
+        """Take before reading a balance from the database, pass to ``set``."""
+        with self._lock:
+            return self._version
+
+    def balance(self, user_id: int, feature: str) -> Optional[int]:
+        with self._lock:
+            balances = self._entries.get(user_id)
+            if balances is None or feature not in balances:
+                return None
+            self._entries.move_to_end(user_id)
+            return balances[feature]
+
+    def set(self, user_id: int, feature: str, balance: int, since: int) -> None:
+        """Remember ``balance`` unless the user was invalidated after ``version()`` returned ``since``."""
+        with self._lock:
+            if self._changes.get(user_id, self._forgotten) > since:
+                return
+            self._entries.setdefault(user_id, {})[feature] = balance
+            self._entries.move_to_end(user_id)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, user_id: int) -> None:
+        with self._lock:
+            self._version += 1
+            self._changes[user_id] = self._version
+            self._changes.move_to_end(user_id)
+            while len(self._changes) > CREDIT_CACHE_MAX_CHANGES:
+                _, self._forgotten = self._changes.popitem(last=False)
+            self._entries.pop(user_id, None)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._version += 1
+            self._forgotten = self._version
+            self._changes.clear()
+            self._entries.clear()
+
+
+cache = CreditCache()
@@ -0,0 +1,182 @@
+"""Shared SQLite access for the bot.
+
+All queries go through a small pool of long-lived connections instead of
+opening a new connection per statement. Every pooled connection runs in WAL
+mode with ``synchronous=NORMAL`` and a busy timeout, and keeps sqlite3's
+per-connection statement cache warm across updates.
+
+Coroutines must not call the blocking helpers directly; they ``await
+db.run(func, *args)``, which executes ``func`` on a dedicated DB thread pool
+so a slow query or lock wait never stalls the event loop.
+"""
+import asyncio
+import functools
+import logging
+import os
+import queue
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from typing import Any, Callable, Iterable, Iterator, List, Optional, Sequence, TypeVar
+
+import migrations
+from metrics import DB_STATEMENT_SECONDS, statement_label
+
+# Database file
+DB_FILE = os.getenv("TEAMFINDER_DB", "teamfinder.db")
+
+POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "4"))
+BUSY_TIMEOUT_MS = 5000
+STATEMENT_CACHE_SIZE = 256
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+class TimedConnection(sqlite3.Connection):
+    """Connection that records the execution time of every statement."""
+
+    def execute(self, sql: str, parameters: Any = (), /) -> sqlite3.Cursor:
+        start = time.perf_counter()
+        try:
+            return super().execute(sql, parameters)
+        finally:
+            DB_STATEMENT_SECONDS.observe(time.perf_counter() - start, statement=statement_label(sql))
+
+    def executemany(self, sql: str, parameters: Iterable[Any], /) -> sqlite3.Cursor:
+        start = time.perf_counter()
+        try:
+            return super().executemany(sql, parameters)
+        finally:
+            DB_STATEMENT_SECONDS.observe(time.perf_counter() - start, statement=statement_label(sql))
+
+
+class ConnectionPool:
+    """A fixed-size pool of persistent SQLite connections."""
+
+    def __init__(self, path: str, size: int = POOL_SIZE) -> None:
+        self.path = path
+        self.size = size
+        self._idle: "queue.LifoQueue[sqlite3.Connection]" = queue.LifoQueue()
+        self._all: List[sqlite3.Connection] = []
+        self._lock = threading.Lock()
+
+    def _open(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(
+            self.path,
+            timeout=BUSY_TIMEOUT_MS / 1000,
+            check_same_thread=False,
+            cached_statements=STATEMENT_CACHE_SIZE,
+            factory=TimedConnection,
+        )
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute(f"PRAGMA busy_timeout={BUSY_TIMEOUT_MS}")
+        if not self._all:
+            # Bring the schema up to date before anything else can use it
+            migrations.migrate(conn)
+        return conn
+
+    def acquire(self) -> sqlite3.Connection:
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+        with self._lock:
+            if len(self._all) < self.size:
+                conn = self._open()
+                self._all.append(conn)
+                return conn
+        return self._idle.get()
+
+    def release(self, conn: sqlite3.Connection) -> None:
+        self._idle.put(conn)
+
+    @contextmanager
+    def connection(self) -> Iterator[sqlite3.Connection]:
+        """Check out a connection; commit on success, roll back on error."""
+        conn = self.acquire()
+        try:
+            yield conn
+            conn.commit()
+        except BaseException:
+            conn.rollback()
+            raise
+        finally:
+            self.release(conn)
+
+    def close(self) -> None:
+        with self._lock:
+            for conn in self._all:
+                conn.close()
+            self._all.clear()
+            self._idle = queue.LifoQueue()
+
+
+_pool: Optional[ConnectionPool] = None
+_pool_lock = threading.Lock()
+
+
+def get_pool() -> ConnectionPool:
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = ConnectionPool(DB_FILE)
+    return _pool
+
+
+def configure(path: str, size: int = POOL_SIZE) -> None:
+    """Point the pool at another database file (used by tools and benchmarks)."""
+    global _pool, DB_FILE
+    with _pool_lock:
+        if _pool is not None:
+            _pool.close()
+        DB_FILE = path
+        _pool = ConnectionPool(path, size)
+
+
+def close() -> None:
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.close()
+            _pool = None
+
+
+# One worker per pooled connection, so a worker never waits for a connection
+_executor = ThreadPoolExecutor(max_workers=POOL_SIZE, thread_name_prefix="db")
+
+
+async def run(func: Callable[..., T], *args: Any) -> T:
+    """Run a blocking DB function on the DB thread pool and await its result."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_executor, functools.partial(func, *args))
+
+
+def schema_version() -> int:
+    """The schema version; the first call opens the pool, which applies pending migrations."""
+    return fetchone("PRAGMA user_version")[0]
+
+
+def transaction():
+    """Context manager yielding a pooled connection inside one transaction."""
+    return get_pool().connection()
+
+
+def fetchone(sql: str, params: Sequence[Any] = ()) -> Optional[tuple]:
+    with get_pool().connection() as conn:
+        return conn.execute(sql, params).fetchone()
+
+
+def fetchall(sql: str, params: Sequence[Any] = ()) -> List[tuple]:
+    with get_pool().connection() as conn:
+        return conn.execute(sql, params).fetchall()
+
+
+def execute(sql: str, params: Sequence[Any] = ()) -> int:
+    """Run one write statement in its own transaction and return the row count."""
+    with get_pool().connection() as conn:
+        return conn.execute(sql, params).rowcount
@@ -0,0 +1,277 @@
+"""Outgoing Bot API scheduler that keeps the bot under Telegram's flood limits.
+
+Every request that targets a chat waits for a token from its chat's bucket
+(about one message per second in private chats, 20 per minute in groups)
+and then from one global bucket (30 per second). Waiters are served by
+priority lane first, so payment messages overtake queued notifications, and
+a ``RetryAfter`` from Telegram pauses the global bucket before retrying.
+
+Bulk messages (``rate_limit_args=BULK``) that are still queued for the same
+chat are coalesced into one ``sendMessage``.
+"""
+import asyncio
+import heapq
+import itertools
+import logging
+import os
+from datetime import timedelta
+from typing import Any, Callable, Coroutine, Dict, List, Optional, Tuple
+
+from telegram.constants import MessageLimit
+from telegram.error import RetryAfter
+from telegram.ext import BaseRateLimiter
+
+FLOOD_GLOBAL_RATE = float(os.getenv("FLOOD_GLOBAL_RATE", "30"))
+FLOOD_CHAT_RATE = float(os.getenv("FLOOD_CHAT_RATE", "1"))
+FLOOD_CHAT_BURST = int(os.getenv("FLOOD_CHAT_BURST", "3"))
+FLOOD_GROUP_PER_MINUTE = float(os.getenv("FLOOD_GROUP_PER_MINUTE", "20"))
+FLOOD_MAX_RETRIES = int(os.getenv("FLOOD_MAX_RETRIES", "3"))
+# Idle chat buckets are dropped once there are more than this many
+FLOOD_MAX_CHAT_BUCKETS = 10000
+
+# Priority lanes, lower is served first
+PRIORITY_PAYMENT = 0
+PRIORITY_INTERACTIVE = 1
+PRIORITY_BULK = 2
+
+# rate_limit_args for the bot methods
+PAYMENT = {'priority': PRIORITY_PAYMENT}
+BULK = {'priority': PRIORITY_BULK}
+
+logger = logging.getLogger(__name__)
+
+
+class TokenBucket:
+    """Token bucket whose waiters get tokens by (priority, arrival).
+
+    ``rate`` tokens per second up to ``burst``; a rate of 0 never limits.
+    """
+
+    def __init__(self, rate: float, burst: float) -> None:
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self._updated: Optional[float] = None
+        self._waiters: List[Tuple[int, int, asyncio.Future]] = []
+        self._order = itertools.count()
+        self._timer: Optional[asyncio.TimerHandle] = None
+
+    def _refill(self, now: float) -> None:
+        if self._updated is not None:
+            self.tokens = min(self.burst, self.tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    async def acquire(self, priority: int = PRIORITY_INTERACTIVE) -> None:
+        if not self.rate:
+            return
+        loop = asyncio.get_running_loop()
+        self._refill(loop.time())
+        if not self._waiters and self.tokens >= 1:
+            self.tokens -= 1
+            return
+        future = loop.create_future()
+        heapq.heappush(self._waiters, (priority, next(self._order), future))
+        self._schedule(loop)
+        # A cancelled waiter is skipped when tokens are handed out
+        await future
+
+    def pause(self, seconds: float) -> None:
+        """Hand out nothing for ``seconds``, e.g. after a RetryAfter."""
+        if not self.rate:
+            return
+        loop = asyncio.get_running_loop()
+        self._refill(loop.time())
+        self.tokens = min(self.tokens, 0) - seconds * self.rate
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        self._schedule(loop)
+
+    def idle(self, now: float) -> bool:
+        self._refill(now)
+        return not self._waiters and self.tokens >= self.burst
+
+    @property
+    def waiting(self) -> int:
+        return len(self._waiters)
+
+    def _schedule(self, loop: asyncio.AbstractEventLoop) -> None:
+        if self._timer is None and self._waiters:
+            self._timer = loop.call_later(max(0.0, (1 - self.tokens) / self.rate), self._release, loop)
+
+    def _release(self, loop: asyncio.AbstractEventLoop) -> None:
+        self._timer = None
+        self._refill(loop.time())
+        while self._waiters:
+            future = self._waiters[0][2]
+            if future.done():
+                heapq.heappop(self._waiters)
+                continue
+            if self.tokens < 1:
+                break
+            self.tokens -= 1
+            heapq.heappop(self._waiters)
+            future.set_result(None)
+        self._schedule(loop)
+
+
+class _Coalesced:
+    """A queued bulk sendMessage that later bulk messages to the chat join."""
+
+    __slots__ = ("data", "future", "parts")
+
+    def __init__(self, data: Dict[str, Any]) -> None:
+        self.data = data
+        self.future: asyncio.Future = asyncio.get_running_loop().create_future()
+        self.parts = 1
+
+    def join(self, data: Dict[str, Any]) -> bool:
+        text = f"{self.data['text']}\n\n{data['text']}"
+        if len(text) > MessageLimit.MAX_TEXT_LENGTH or _without_text(data) != _without_text(self.data):
+            return False
+        self.data['text'] = text
+        self.parts += 1
+        return True
+
+
+def _without_text(data: Dict[str, Any]) -> Dict[str, Any]:
+    return {key: value for key, value in data.items() if key != 'text'}
+
+
+class FloodLimiter(BaseRateLimiter[Dict[str, Any]]):
+    """Per-chat and global token buckets with priority lanes.
+
+    ``rate_limit_args`` may set ``priority`` (see ``PAYMENT`` and ``BULK``)
+    and ``max_retries``. Requests without a ``chat_id`` (callback and
+    pre-checkout answers) are never delayed.
+    """
+
+    def __init__(
+        self,
+        global_rate: float = FLOOD_GLOBAL_RATE,
+        chat_rate: float = FLOOD_CHAT_RATE,
+        chat_burst: int = FLOOD_CHAT_BURST,
+        group_per_minute: float = FLOOD_GROUP_PER_MINUTE,
+        max_retries: int = FLOOD_MAX_RETRIES,
+    ) -> None:
+        self.global_bucket = TokenBucket(global_rate, max(1.0, global_rate))
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.group_rate = group_per_minute / 60
+        self.max_retries = max_retries
+        self._chats: Dict[Any, TokenBucket] = {}
+        self._coalescing: Dict[Any, _Coalesced] = {}
+        self.sent = 0
+        self.retries = 0
+        self.coalesced = 0
+
+    async def initialize(self) -> None:
+        pass
+
+    async def shutdown(self) -> None:
+        pass
+
+    def stats(self) -> Dict[str, float]:
+        return {
+            'sent': self.sent,
+            'retries': self.retries,
+            'coalesced': self.coalesced,
+            'waiting': self.global_bucket.waiting + sum(bucket.waiting for bucket in self._chats.values()),
+            'chats': len(self._chats),
+        }
+
+    def _chat_bucket(self, chat_id: Any) -> TokenBucket:
+        bucket = self._chats.get(chat_id)
+        if bucket is None:
+            if len(self._chats) >= FLOOD_MAX_CHAT_BUCKETS:
+                now = asyncio.get_running_loop().time()
+                self._chats = {key: b for key, b in self._chats.items() if not b.idle(now)}
+            # String ids are channel usernames; negative ids are groups and channels
+            group = isinstance(chat_id, str) or (isinstance(chat_id, int) and chat_id < 0)
+            if group:
+                bucket = TokenBucket(self.group_rate, 1)
+            else:
+                bucket = TokenBucket(self.chat_rate, self.chat_burst)
+            self._chats[chat_id] = bucket
+        return bucket
+
+    async def process_request(
+        self,
+        callback: Callable[..., Coroutine[Any, Any, Any]],
+        args: Any,
+        kwargs: Dict[str, Any],
+        endpoint: str,
+        data: Dict[str, Any],
+        rate_limit_args: Optional[Dict[str, Any]],
+    ) -> Any:
+        rate_limit_args = rate_limit_args or {}
+        priority = rate_limit_args.get('priority', PRIORITY_INTERACTIVE)
+        max_retries = rate_limit_args.get('max_retries', self.max_retries)
+        chat_id = data.get('chat_id')
+        if chat_id is None:
+            return await callback(*args, **kwargs)
+        try:
+            chat_id = int(chat_id)
+        except (TypeError, ValueError):
+            pass
+
+        batch = None
+        if priority == PRIORITY_BULK and endpoint == 'sendMessage' and isinstance(data.get('text'), str):
+            queued = self._coalescing.get(chat_id)
+            if queued is not None and queued.join(data):
+                self.coalesced += 1
+                return await asyncio.shield(queued.future)
+            batch = self._coalescing[chat_id] = _Coalesced(data)
+
+        try:
+            result = await self._send(callback, args, kwargs, chat_id, priority, max_retries, batch)
+        except BaseException as e:
+            if batch is not None:
+                self._stop_coalescing(chat_id, batch)
+                # Messages that joined the batch fail with it
+                if isinstance(e, Exception) and batch.parts > 1:
+                    batch.future.set_exception(e)
+                else:
+                    batch.future.cancel()
+            raise
+        if batch is not None:
+            batch.future.set_result(result)
+        return result
+
+    async def _send(
+        self,
+        callback: Callable[..., Coroutine[Any, Any, Any]],
+        args: Any,
+        kwargs: Dict[str, Any],
+        chat_id: Any,
+        priority: int,
+        max_retries: int,
+        batch: Optional[_Coalesced],
+    ) -> Any:
+        for attempt in itertools.count():
+            await self._chat_bucket(chat_id).acquire(priority)
+            await self.global_bucket.acquire(priority)
+            if batch is not None:
+                # The text is final once the request goes out
+                self._stop_coalescing(chat_id, batch)
+            try:
+                result = await callback(*args, **kwargs)
+            except RetryAfter as e:
+                if attempt >= max_retries:
+                    logger.error(f"Flood limit still hit for chat {chat_id} after {attempt} retries")
+                    raise
+                # An int, or a timedelta with PTB_TIMEDELTA set
+                retry_after = e.retry_after
+                if isinstance(retry_after, timedelta):
+                    retry_after = retry_after.total_seconds()
+                delay = retry_after + 0.1
+                logger.warning(f"Flood limit hit for chat {chat_id}, retrying in {delay:.1f} s")
+                self.retries += 1
+                self.global_bucket.pause(delay)
+                continue
+            self.sent += 1
+            return result
+
+    def _stop_coalescing(self, chat_id: Any, batch: _Coalesced) -> None:
+        if self._coalescing.get(chat_id) is batch:
+            del self._coalescing[chat_id]
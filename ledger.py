@@ -0,0 +1,105 @@
+"""Persistent payment ledger and purchase/refund counters.
+
+Every successful payment is stored once, keyed by its
+``telegram_payment_charge_id``. Per-item and per-user totals are kept in
+small aggregate tables that are updated in the same transaction, so reports
+never have to scan the ledger.
+"""
+import time
+from typing import Any, Dict, List, Optional
+
+import db
+
+
+def record_purchase(
+    charge_id: str, user_id: int, item_id: str, amount: int, conn=None, created_at: Optional[float] = None
+) -> bool:
+    """Store a payment and bump the totals; False if it was already recorded.
+
+    ``created_at`` defaults to now; imports pass the original time.
+    """
+    if conn is None:
+        with db.transaction() as conn:
+            return record_purchase(charge_id, user_id, item_id, amount, conn, created_at)
+    inserted = conn.execute(
+        "INSERT OR IGNORE INTO payments (charge_id, user_id, item_id, amount, created_at) VALUES (?, ?, ?, ?, ?)",
+        (charge_id, user_id, item_id, amount, time.time() if created_at is None else created_at),
+    ).rowcount
+    if not inserted:
+        return False
+    conn.execute(
+        "INSERT INTO item_totals (item_id, purchases, revenue) VALUES (?, 1, ?) "
+        "ON CONFLICT(item_id) DO UPDATE SET purchases = purchases + 1, revenue = revenue + excluded.revenue",
+        (item_id, amount),
+    )
+    conn.execute(
+        "INSERT INTO user_totals (user_id, purchases, spent) VALUES (?, 1, ?) "
+        "ON CONFLICT(user_id) DO UPDATE SET purchases = purchases + 1, spent = spent + excluded.spent",
+        (user_id, amount),
+    )
+    return True
+
+
+def record_refund(charge_id: str, user_id: int, conn=None, refunded_at: Optional[float] = None) -> bool:
+    """Mark a payment refunded and bump the refund totals once."""
+    if conn is None:
+        with db.transaction() as conn:
+            return record_refund(charge_id, user_id, conn, refunded_at)
+    row = conn.execute(
+        "SELECT item_id, amount FROM payments WHERE charge_id = ? AND refunded_at IS NULL", (charge_id,)
+    ).fetchone()
+    if row is None:
+        # Unknown or already refunded; payments made before the ledger existed land here
+        if conn.execute("SELECT 1 FROM payments WHERE charge_id = ?", (charge_id,)).fetchone():
+            return False
+        item_id, amount = "unknown", 0
+    else:
+        item_id, amount = row
+        conn.execute(
+            "UPDATE payments SET refunded_at = ? WHERE charge_id = ?",
+            (time.time() if refunded_at is None else refunded_at, charge_id),
+        )
+    conn.execute(
+        "INSERT INTO item_totals (item_id, refunds, refunded_amount) VALUES (?, 1, ?) "
+        "ON CONFLICT(item_id) DO UPDATE SET refunds = refunds + 1, refunded_amount = refunded_amount + excluded.refunded_amount",
+        (item_id, amount),
+    )
+    conn.execute(
+        "INSERT INTO user_totals (user_id, refunds, refunded) VALUES (?, 1, ?) "
+        "ON CONFLICT(user_id) DO UPDATE SET refunds = refunds + 1, refunded = refunded + excluded.refunded",
+        (user_id, amount),
+    )
+    return True
+
+
+def item_summary() -> List[Dict[str, Any]]:
+    """Purchases, refunds, revenue and refund rate per item."""
+    rows = db.fetchall(
+        "SELECT item_id, purchases, refunds, revenue, refunded_amount FROM item_totals ORDER BY revenue DESC"
+    )
+    return [
+        {
+            'item_id': item_id,
+            'purchases': purchases,
+            'refunds': refunds,
+            'revenue': revenue - refunded_amount,
+            'refund_rate': refunds / purchases if purchases else 0.0,
+        }
+        for item_id, purchases, refunds, revenue, refunded_amount in rows
+    ]
+
+
+def top_buyers(limit: int = 10) -> List[Dict[str, Any]]:
+    rows = db.fetchall(
+        "SELECT user_id, purchases, refunds, spent - refunded FROM user_totals ORDER BY spent - refunded DESC LIMIT ?",
+        (limit,),
+    )
+    return [
+        {'user_id': user_id, 'purchases': purchases, 'refunds': refunds, 'spent': spent}
+        for user_id, purchases, refunds, spent in rows
+    ]
+
+
+def user_counts(user_id: int) -> Optional[Dict[str, int]]:
+    row = db.fetchone("SELECT purchases, refunds FROM user_totals WHERE user_id = ?", (user_id,))
+    return {'purchases': row[0], 'refunds': row[1]} if row else None
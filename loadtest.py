@@ -0,0 +1,456 @@
+"""Replay synthetic Telegram traffic against the real handlers.
+
+The harness builds the same Application as ``main()`` but gives it a
+``RecordingRequest`` instead of an HTTP client, so every outgoing Bot API call
+(``sendMessage`` for ``reply_text``, ``sendInvoice``, ``refundStarPayment``, ...)
+is recorded and answered locally. Sessions of updates (sign-up, /find_team,
+/add_project, payments, ...) are replayed at a configurable concurrency
+against a generated SQLite database and latency is reported per handler step.
+
+    python loadtest.py --users 100000 --sessions 5000 --concurrency 100
+
+By default outgoing messages are not rate limited. With ``--flood-limits`` the
+transport rejects sends beyond Telegram's flood limits with HTTP 429, like the
+Bot API does, and the bot's own ``FloodLimiter`` schedules and retries them.
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import os
+import random
+import sqlite3
+import tempfile
+import time
+from collections import Counter, defaultdict
+from datetime import datetime, timedelta
+from typing import Any, Callable, DefaultDict, Dict, Iterator, List, Optional, Tuple
+
+from telegram import Update
+from telegram.ext import Application
+from telegram.request import BaseRequest, RequestData
+
+import db
+import migrations
+import skills
+from bench import percentile
+from flood_limiter import (
+    FLOOD_CHAT_BURST, FLOOD_CHAT_RATE, FLOOD_GLOBAL_RATE, FLOOD_GROUP_PER_MINUTE, FloodLimiter,
+)
+from payments import VIP_DAYS, VIP_ITEM
+
+FAKE_TOKEN = "123456:LOADTEST"
+BOT_ID = 123456
+
+SKILLS = [
+    "python", "javascript", "typescript", "react", "node.js", "django", "flask", "go",
+    "rust", "java", "kotlin", "swift", "c++", "c#", "sql", "postgresql", "docker",
+    "kubernetes", "aws", "figma", "ui/ux", "ml", "pytorch", "data analysis", "marketing",
+]
+PREFERENCES = ["remote only", "startups", "agile teams", "part-time", "open source", "fintech", "hackathons"]
+
+
+class FloodLimits:
+    """Telegram's flood limits as token buckets: global, per private chat and per group."""
+
+    def __init__(
+        self,
+        global_rate: float = FLOOD_GLOBAL_RATE,
+        chat_rate: float = FLOOD_CHAT_RATE,
+        chat_burst: int = FLOOD_CHAT_BURST,
+        group_per_minute: float = FLOOD_GROUP_PER_MINUTE,
+    ) -> None:
+        self.global_rate = global_rate
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.group_rate = group_per_minute / 60
+        # key -> [tokens, last refill]
+        self._buckets: Dict[Any, List[float]] = {}
+
+    def _wait(self, key: Any, rate: float, burst: float, now: float) -> float:
+        bucket = self._buckets.setdefault(key, [burst, now])
+        bucket[0] = min(burst, bucket[0] + (now - bucket[1]) * rate)
+        bucket[1] = now
+        return 0.0 if bucket[0] >= 1 else (1 - bucket[0]) / rate
+
+    def check(self, chat_id: int) -> int:
+        """Take a send for ``chat_id``; returns the retry_after seconds when over the limit."""
+        now = time.monotonic()
+        if chat_id < 0:
+            chat = (chat_id, self.group_rate, 1)
+        else:
+            chat = (chat_id, self.chat_rate, self.chat_burst)
+        wait = max(self._wait(*chat, now), self._wait(None, self.global_rate, max(1.0, self.global_rate), now))
+        if wait:
+            return max(1, int(wait + 0.999))
+        self._buckets[chat_id][0] -= 1
+        self._buckets[None][0] -= 1
+        return 0
+
+
+class RecordingRequest(BaseRequest):
+    """A Bot API transport that records calls and never touches the network.
+
+    With ``limits`` set, sends over the flood limits are answered with 429.
+    """
+
+    def __init__(self, limits: Optional[FloodLimits] = None) -> None:
+        self.calls: List[Tuple[str, Dict[str, Any]]] = []
+        self.counts: Counter = Counter()
+        self.limits = limits
+        self.rejected = 0
+        self._message_ids = itertools.count(1)
+
+    @property
+    def read_timeout(self) -> Optional[float]:
+        return None
+
+    async def initialize(self) -> None:
+        pass
+
+    async def shutdown(self) -> None:
+        pass
+
+    def calls_to(self, endpoint: str) -> List[Dict[str, Any]]:
+        return [params for name, params in self.calls if name == endpoint]
+
+    async def do_request(
+        self,
+        url: str,
+        method: str,
+        request_data: Optional[RequestData] = None,
+        read_timeout: Any = None,
+        write_timeout: Any = None,
+        connect_timeout: Any = None,
+        pool_timeout: Any = None,
+    ) -> Tuple[int, bytes]:
+        endpoint = url.rsplit("/", 1)[-1]
+        params = request_data.parameters if request_data else {}
+        if self.limits is not None and "chat_id" in params:
+            retry_after = self.limits.check(int(params["chat_id"]))
+            if retry_after:
+                self.rejected += 1
+                return 429, json.dumps({
+                    "ok": False, "error_code": 429, "description": f"Too Many Requests: retry after {retry_after}",
+                    "parameters": {"retry_after": retry_after},
+                }).encode()
+        self.calls.append((endpoint, params))
+        self.counts[endpoint] += 1
+        return 200, json.dumps({"ok": True, "result": self._result(endpoint, params)}).encode()
+
+    def _result(self, endpoint: str, params: Dict[str, Any]) -> Any:
+        if endpoint == "getMe":
+            return {"id": BOT_ID, "is_bot": True, "first_name": "TeamFinder", "username": "teamfinder_bot"}
+        if endpoint in ("sendMessage", "sendInvoice", "editMessageText"):
+            return {
+                "message_id": next(self._message_ids),
+                "date": int(time.time()),
+                "chat": {"id": int(params.get("chat_id", 0)), "type": "private"},
+                "text": params.get("text", params.get("title", "")),
+            }
+        return True
+
+
+def generate_db(path: str, users: int, seed: int = 1, batch: int = 50000) -> None:
+    """Create ``path`` with ``users`` synthetic users, projects and VIPs.
+
+    Every fifth user is VIP so /find_team sessions can enter the conversation.
+    """
+    rnd = random.Random(seed)
+    conn = sqlite3.connect(path)
+    migrations.migrate(conn)
+    vip_until = int((datetime.now() + timedelta(days=30)).timestamp())
+
+    def rows() -> Iterator[tuple]:
+        for user_id in range(1, users + 1):
+            yield (
+                user_id, f"User {user_id}", f"user{user_id}", f"+1555{user_id:07d}", f"user{user_id}@example.com",
+                ", ".join(rnd.sample(SKILLS, rnd.randint(1, 5))), rnd.choice(PREFERENCES),
+                vip_until if user_id % 5 == 0 else None,
+            )
+
+    insert = ("INSERT INTO users (id, name, username, phone_number, email, skills, preferences, vip_until) "
+              "VALUES (?, ?, ?, ?, ?, ?, ?, ?)")
+    it = rows()
+    with conn:
+        while True:
+            chunk = list(itertools.islice(it, batch))
+            if not chunk:
+                break
+            conn.executemany(insert, chunk)
+        now = time.time()
+        conn.executemany(
+            "INSERT INTO projects (user_id, created_at, text) VALUES (?, ?, ?)",
+            ((user_id, now, f"Project {n} of user {user_id}") for user_id in range(1, users + 1, 3) for n in range(2)),
+        )
+        skills.rebuild_user_skills(conn)
+    conn.close()
+
+
+class Traffic:
+    """Builds update JSON for synthetic users."""
+
+    def __init__(self, users: int, seed: int = 1) -> None:
+        self.users = users
+        self.rnd = random.Random(seed)
+        self._update_ids = itertools.count(1)
+        self._new_user_ids = itertools.count(users + 1)
+
+    def _user(self, user_id: int) -> Dict[str, Any]:
+        return {"id": user_id, "is_bot": False, "first_name": f"User {user_id}", "username": f"user{user_id}"}
+
+    def message(self, user_id: int, text: str) -> Dict[str, Any]:
+        message = {
+            "message_id": next(self._update_ids),
+            "date": int(time.time()),
+            "chat": {"id": user_id, "type": "private"},
+            "from": self._user(user_id),
+            "text": text,
+        }
+        if text.startswith("/"):
+            message["entities"] = [{"type": "bot_command", "offset": 0, "length": len(text.split()[0])}]
+        return {"update_id": next(self._update_ids), "message": message}
+
+    def callback(self, user_id: int, data: str) -> Dict[str, Any]:
+        return {
+            "update_id": next(self._update_ids),
+            "callback_query": {
+                "id": str(next(self._update_ids)),
+                "from": self._user(user_id),
+                "chat_instance": str(user_id),
+                "data": data,
+                "message": {
+                    "message_id": next(self._update_ids), "date": int(time.time()),
+                    "chat": {"id": user_id, "type": "private"}, "text": "menu",
+                },
+            },
+        }
+
+    def payment(self, user_id: int, item_id: str, amount: int, charge_id: Optional[str] = None) -> List[Dict[str, Any]]:
+        charge_id = charge_id or f"charge-{next(self._update_ids)}"
+        return [
+            {
+                "update_id": next(self._update_ids),
+                "pre_checkout_query": {
+                    "id": str(next(self._update_ids)), "from": self._user(user_id),
+                    "currency": "XTR", "total_amount": amount, "invoice_payload": item_id,
+                },
+            },
+            {
+                "update_id": next(self._update_ids),
+                "message": {
+                    "message_id": next(self._update_ids), "date": int(time.time()),
+                    "chat": {"id": user_id, "type": "private"}, "from": self._user(user_id),
+                    "successful_payment": {
+                        "currency": "XTR", "total_amount": amount, "invoice_payload": item_id,
+                        "telegram_payment_charge_id": charge_id, "provider_payment_charge_id": charge_id,
+                    },
+                },
+            },
+        ]
+
+    def existing_user(self) -> int:
+        return self.rnd.randint(1, self.users)
+
+    def vip_user(self) -> int:
+        return self.rnd.randint(1, max(1, self.users // 5)) * 5
+
+    # Sessions are lists of (step label, update) replayed in order for one user
+
+    def signup(self) -> List[Tuple[str, Dict[str, Any]]]:
+        user_id = next(self._new_user_ids)
+        return [
+            ("sign_up", self.message(user_id, "/sign_up")),
+            ("get_phone", self.message(user_id, f"+1666{user_id:07d}")),
+            ("get_email", self.message(user_id, f"new{user_id}@example.com")),
+            ("ask_skills", self.message(user_id, "/set_skills")),
+            ("handle_skills", self.message(user_id, ", ".join(self.rnd.sample(SKILLS, 3)))),
+            ("set_preferences", self.message(user_id, "/set_preferences")),
+            ("handle_preferences", self.message(user_id, self.rnd.choice(PREFERENCES))),
+        ]
+
+    def find_team(self) -> List[Tuple[str, Dict[str, Any]]]:
+        user_id = self.vip_user()
+        wanted = " ".join(self.rnd.sample([s for s in SKILLS if " " not in s], 2))
+        return [
+            ("find_team_command", self.message(user_id, "/find_team")),
+            ("handle_team_requirements", self.message(user_id, f"looking for {wanted}")),
+        ]
+
+    def add_project(self) -> List[Tuple[str, Dict[str, Any]]]:
+        user_id = self.existing_user()
+        return [
+            ("add_project", self.message(user_id, "/add_project")),
+            ("receive_project", self.message(user_id, f"Shipped project {next(self._update_ids)}")),
+            ("portfolio", self.message(user_id, "/portfolio")),
+        ]
+
+    def profile(self) -> List[Tuple[str, Dict[str, Any]]]:
+        return [("profile_command", self.message(self.existing_user(), "/profile"))]
+
+    def purchase(self) -> List[Tuple[str, Dict[str, Any]]]:
+        from main import ITEMS
+
+        user_id = self.existing_user()
+        item_id = self.rnd.choice(list(ITEMS))
+        precheckout, paid = self.payment(user_id, item_id, ITEMS[item_id]["price"])
+        return [
+            ("shop_command", self.message(user_id, "/shop")),
+            ("button_handler", self.callback(user_id, item_id)),
+            ("precheckout_callback", precheckout),
+            ("successful_payment_callback", paid),
+        ]
+
+    def duplicate_payment(self) -> List[Tuple[str, Dict[str, Any]]]:
+        """A successful payment that Telegram delivers more than once."""
+        from main import ITEMS
+
+        user_id = self.existing_user()
+        item_id = self.rnd.choice(list(ITEMS))
+        _, paid = self.payment(user_id, item_id, ITEMS[item_id]["price"])
+        return [("successful_payment_callback", paid)] * PAYMENT_DELIVERIES
+
+
+SCENARIOS: Dict[str, Callable[[Traffic], List[Tuple[str, Dict[str, Any]]]]] = {
+    "signup": Traffic.signup,
+    "find_team": Traffic.find_team,
+    "add_project": Traffic.add_project,
+    "profile": Traffic.profile,
+    "purchase": Traffic.purchase,
+    "duplicate_payment": Traffic.duplicate_payment,
+}
+
+# Deliveries of the same update in the duplicate_payment scenario
+PAYMENT_DELIVERIES = 3
+
+
+def check_payments() -> str:
+    """Compare recorded payments with their fulfilment jobs and VIP grants."""
+    payments, jobs, pending = db.fetchone(
+        "SELECT (SELECT count(*) FROM payments), count(*), count(*) FILTER (WHERE status = 'pending') "
+        "FROM fulfilment_jobs"
+    )
+    # Every generated VIP starts at a whole number of days from now, so a
+    # double grant shows up as a vip_until more than VIP_DAYS per purchase out
+    overgranted = db.fetchone(
+        "SELECT count(*) FROM users u WHERE vip_until > ? + 86400 * ? * "
+        "(1 + (SELECT count(*) FROM payments p WHERE p.user_id = u.id AND p.item_id = ?))",
+        (int(time.time()), VIP_DAYS, VIP_ITEM),
+    )[0]
+    return (f"payments: {payments} recorded, {jobs} fulfilment jobs ({pending} pending), "
+            f"{overgranted} users granted VIP twice")
+
+
+def build_test_application(request: RecordingRequest, rate_limiter: Optional[FloodLimiter] = None) -> Application:
+    """The Application from main(), wired to a recording transport."""
+    import main
+
+    builder = Application.builder().token(FAKE_TOKEN).request(request).get_updates_request(request)
+    return main.build_application(builder, rate_limiter)
+
+
+class Replay:
+    """Replays sessions against an Application and records step latencies."""
+
+    def __init__(self, application: Application) -> None:
+        self.application = application
+        self.latencies: DefaultDict[str, List[float]] = defaultdict(list)
+        self.errors: Counter = Counter()
+
+    async def run_session(self, steps: List[Tuple[str, Dict[str, Any]]]) -> None:
+        for label, data in steps:
+            update = Update.de_json(data, self.application.bot)
+            start = time.perf_counter()
+            try:
+                await self.application.process_update(update)
+            except Exception:
+                self.errors[label] += 1
+            self.latencies[label].append((time.perf_counter() - start) * 1000)
+
+    async def run(self, sessions: List[List[Tuple[str, Dict[str, Any]]]], concurrency: int) -> float:
+        """Replay ``sessions`` with at most ``concurrency`` in flight; returns seconds."""
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def bounded(steps: List[Tuple[str, Dict[str, Any]]]) -> None:
+            async with semaphore:
+                await self.run_session(steps)
+
+        start = time.perf_counter()
+        await asyncio.gather(*(bounded(steps) for steps in sessions))
+        return time.perf_counter() - start
+
+    def report(self, elapsed: float) -> str:
+        lines = [f"{'step':30s} {'count':>7s} {'p50 ms':>8s} {'p90 ms':>8s} {'p99 ms':>8s} {'max ms':>8s} {'errors':>6s}"]
+        total = 0
+        for label in sorted(self.latencies):
+            values = self.latencies[label]
+            total += len(values)
+            lines.append(
+                f"{label:30s} {len(values):7d} {percentile(values, 50):8.2f} {percentile(values, 90):8.2f} "
+                f"{percentile(values, 99):8.2f} {max(values):8.2f} {self.errors[label]:6d}"
+            )
+        lines.append(f"{total} updates in {elapsed:.2f} s = {total / elapsed:.0f} updates/s")
+        return "\n".join(lines)
+
+
+async def replay(args: argparse.Namespace) -> None:
+    import main
+
+    if args.flood_limits:
+        request = RecordingRequest(FloodLimits())
+        rate_limiter = main.flood_limiter
+    else:
+        request = RecordingRequest()
+        rate_limiter = FloodLimiter(global_rate=0, chat_rate=0, group_per_minute=0)
+    application = build_test_application(request, rate_limiter)
+    traffic = Traffic(args.users, seed=args.seed)
+    weights = dict(item.split("=") for item in args.mix.split(","))
+    names = list(weights)
+    choices = random.Random(args.seed).choices(names, weights=[float(weights[n]) for n in names], k=args.sessions)
+    sessions = [SCENARIOS[name](traffic) for name in choices]
+
+    replayer = Replay(application)
+    async with application:
+        main.fulfilment.start(application.bot)
+        main.user_writes.start()
+        elapsed = await replayer.run(sessions, args.concurrency)
+        # Let background work (fulfilment, queued writes) finish
+        await main.fulfilment.wait_idle()
+        await main.fulfilment.close()
+        await main.user_writes.close()
+    print(replayer.report(elapsed))
+    print("bot calls: " + ", ".join(f"{name}={count}" for name, count in sorted(request.counts.items())))
+    print(check_payments())
+    if args.flood_limits:
+        stats = rate_limiter.stats()
+        print(f"flood limits: {request.rejected} sends rejected with 429, {stats['retries']} retries, "
+              f"{stats['coalesced']} messages coalesced")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--db", help="existing database to use (default: generate a temporary one)")
+    parser.add_argument("--users", type=int, default=10000, help="users to generate")
+    parser.add_argument("--sessions", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--mix", default="signup=2,find_team=3,add_project=2,profile=3,purchase=1,duplicate_payment=1",
+                        help="scenario weights, e.g. find_team=1,profile=4")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--flood-limits", action="store_true",
+                        help="enforce Telegram's flood limits in the fake transport")
+    args = parser.parse_args()
+
+    path = args.db
+    if path is None:
+        fd, path = tempfile.mkstemp(suffix=".db", prefix="teamfinder-load-")
+        os.close(fd)
+        start = time.perf_counter()
+        generate_db(path, args.users, seed=args.seed)
+        print(f"generated {args.users} users in {time.perf_counter() - start:.1f} s")
+    db.configure(path)
+    try:
+        asyncio.run(replay(args))
+    finally:
+        db.close()
+        if args.db is None:
+            os.remove(path)
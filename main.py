@@ -1,15 +1,41 @@
 import os
+import sys
 import logging
-import sqlite3
 import asyncio
 import nest_asyncio
 import traceback
 from collections import defaultdict
 from typing import DefaultDict, Dict, List, Any, Optional
 import re
+import time
+from bisect import bisect_left, bisect_right
 from dotenv import load_dotenv
 from about_user_ai import generate_summary
+import bulk
+import credits
+import db
+import ledger
+import metrics
+import migrations
+import notifications
+import payments
+import search_index
+import summary_cache
+from skill_index import SkillIndex
+from skills import catalog as skill_catalog, find_skills, store_user_skills
+from summary_jobs import QueueFull, SummaryJobs
+from vip_cache import VipCache
+from write_behind import WriteBehind
+from flood_limiter import BULK, PAYMENT, FloodLimiter
+from notifications import Notifier
+from payments import FulfilmentQueue
+from persistence import SQLitePersistence
+from profile_cache import ProfileCache
+from recommender import Recommender
+from result_cursors import CursorStore
+from webhook import run_webhook
 from telegram import Update, LabeledPrice, InlineKeyboardButton, InlineKeyboardMarkup, Message
+from telegram.constants import MessageLimit
 from telegram.ext import (
     Application, CommandHandler, MessageHandler, filters,
     CallbackContext, ContextTypes, ConversationHandler,
@@ -57,21 +83,88 @@ load_dotenv()
 API_TOKEN = os.getenv("TELEGRAM_BOT_TOKEN")
 your_provider_token = os.getenv("TEST_TOKEN")
 
+# "polling" (default, for development) or "webhook" (see webhook.py for its settings)
+BOT_MODE = os.getenv("BOT_MODE", "polling")
+# How many updates may be processed at the same time
+CONCURRENT_UPDATES = int(os.getenv("CONCURRENT_UPDATES", "1"))
+# How often the ledger totals exported as metrics are re-read, in seconds
+LEDGER_METRICS_INTERVAL = float(os.getenv("LEDGER_METRICS_INTERVAL", "60"))
+
 # Set up logging
 logging.basicConfig(format="%(asctime)s - %(levelname)s - %(message)s", level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-# Store statistics
+# Process-local statistics; purchases and refunds live in the payment ledger (ledger.py)
 STATS: Dict[str, DefaultDict[str, int]] = {
-    'purchases': defaultdict(int),
-    'refunds': defaultdict(int)
+    'summary_cache': defaultdict(int)
 }
-# Database file
-DB_FILE = "teamfinder.db"
+# Last ledger.item_summary(), refreshed off the event loop for the metrics gauges
+ledger_totals: List[Dict[str, Any]] = []
+# Metrics endpoint and loop lag sampler, closed again in post_shutdown
+metrics_server: Optional[asyncio.AbstractServer] = None
+loop_lag_task: Optional[asyncio.Task] = None
+
+# Users allowed to run /stats
+ADMIN_IDS = {int(admin_id) for admin_id in os.getenv("ADMIN_IDS", "").split(",") if admin_id.strip()}
+# Inverted skill index used by team search, loaded lazily from user_skills
+skill_index = SkillIndex()
+
+# VIP entitlements, kept in memory until they expire
+vip_cache = VipCache(lambda user_id: load_vip_until(user_id))
+
+# Batched profile field writes (phone, email, skills, preferences)
+user_writes = WriteBehind()
+
+# Rendered /profile messages, patched on every profile field write
+profile_cache = ProfileCache(lambda fields: render_profile(fields))
+
+# Outgoing Bot API calls, scheduled under Telegram's flood limits
+flood_limiter = FloodLimiter()
+
+# VIP expiry reminders and new-match alerts, run by the job queue
+notifier = Notifier(lambda user_ids: format_members(user_ids))
+
+# Worker pool for AI profile summaries
+summary_jobs = SummaryJobs()
+
+# Durable queue that fulfils recorded payments, see successful_payment_callback
+fulfilment = FulfilmentQueue(
+    {
+        'about_user_dict': lambda bot, job: fulfil_about_user(bot, job),
+        'vip': lambda bot, job: fulfil_vip(bot, job),
+        'find_team': lambda bot, job: fulfil_find_team(bot, job),
+    },
+    lambda bot, job: fulfil_purchase(bot, job),
+)
+
+# Precomputed teammate suggestions, refreshed in the background
+recommender = Recommender(lambda user_ids: load_recommendation_profiles(user_ids))
+
+# Open /find_team result pages, see team_page_callback
+team_cursors = CursorStore()
+
+# Team search results per page
+TEAM_PAGE_SIZE = 5
+
+# Portfolio paging: projects per query and the Telegram message size limit
+PORTFOLIO_PAGE_SIZE = 50
+MAX_MESSAGE_LENGTH = MessageLimit.MAX_TEXT_LENGTH
 
 # States
 PHONE, EMAIL, SELECTING_SKILLS, WAITING_FOR_PORTFOLIO, WAITING_FOR_EDIT, WAITING_FOR_PREFERENCES, TEAM_FINDING = range(7)
 
+# Cached VIP status and profile are stale once a refund changed vip_until
+def forget_vip(user_id, revocation):
+    if revocation.vip_seconds:
+        vip_cache.invalidate(user_id)
+        profile_cache.invalidate(user_id)
+
+# Give back what a refund took when Telegram did not refund the payment
+async def restore_refunded(user_id, revocation):
+    await db.run(payments.restore_payment, user_id, revocation)
+    forget_vip(user_id, revocation)
+
+@metrics.timed("refund_command")
 async def refund_command(update: Update, context: CallbackContext) -> None:
     """Handle /refund command - process refund requests."""
     if not context.args:
@@ -84,18 +177,29 @@ async def refund_command(update: Update, context: CallbackContext) -> None:
         charge_id = context.args[0]
         user_id = update.effective_user.id
 
-        # Call the refund API, adjust for the Stars payment system
-        success = await context.bot.refund_star_payment(
-            user_id=user_id,
-            telegram_payment_charge_id=charge_id
-        )
+        # Take back the VIP time or credit first, so it cannot be used during the refund
+        revocation = await db.run(payments.revoke_payment, charge_id, user_id)
+        forget_vip(user_id, revocation)
+        try:
+            # Call the refund API, adjust for the Stars payment system
+            success = await context.bot.refund_star_payment(
+                user_id=user_id,
+                telegram_payment_charge_id=charge_id
+            )
+        except Exception:
+            await restore_refunded(user_id, revocation)
+            raise
 
         if success:
-            STATS['refunds'][str(user_id)] += 1
+            await db.run(ledger.record_refund, charge_id, user_id)
             await update.message.reply_text(MESSAGES['refund_success'])
         else:
+            await restore_refunded(user_id, revocation)
             await update.message.reply_text(MESSAGES['refund_failed'])
 
+    except payments.RefundRefused as e:
+        await update.message.reply_text(f"❌ {e}")
+
     except Exception as e:
         error_text = f"Error type: {type(e).__name__}\n"
         error_text += f"Error message: {str(e)}\n"
@@ -109,6 +213,7 @@ async def refund_command(update: Update, context: CallbackContext) -> None:
         )
 
 
+@metrics.timed("button_handler")
 async def button_handler(update: Update, context: CallbackContext) -> None:
     """Handle button clicks for item selection."""
     query = update.callback_query
@@ -134,7 +239,8 @@ async def button_handler(update: Update, context: CallbackContext) -> None:
             provider_token= your_provider_token,  # This should be your valid token if using an external payment system
             currency="XTR",  # Telegram Stars
             prices=[LabeledPrice(item['name'], int(item['price']))],
-            start_parameter="start_parameter"
+            start_parameter="start_parameter",
+            rate_limit_args=PAYMENT
         )
 
     except Exception as e:
@@ -145,6 +251,7 @@ async def button_handler(update: Update, context: CallbackContext) -> None:
             )
 
 
+@metrics.timed("precheckout_callback")
 async def precheckout_callback(update: Update, context: CallbackContext) -> None:
     """Handle pre-checkout queries."""
     query = update.pre_checkout_query
@@ -154,282 +261,491 @@ async def precheckout_callback(update: Update, context: CallbackContext) -> None
         await query.answer(ok=False, error_message="Something went wrong...")
 
 
+@metrics.timed("successful_payment_callback")
 async def successful_payment_callback(update: Update, context: CallbackContext) -> None:
-    """Handle successful payments."""
+    """Handle successful payments.
+
+    The charge, its entitlement and a fulfilment job are recorded in one
+    transaction; the fulfilment queue sends the confirmation. A re-delivered
+    update finds the charge already recorded and does nothing.
+    """
     payment = update.message.successful_payment
     item_id = payment.invoice_payload
-    item = ITEMS[item_id]
     user_id = update.effective_user.id
 
-    # Update statistics
-    STATS['purchases'][str(user_id)] += 1
+    recorded = await db.run(
+        payments.record_payment, payment.telegram_payment_charge_id, user_id, update.effective_chat.id,
+        item_id, payment.total_amount
+    )
+    if not recorded:
+        logger.info(f"Ignoring repeated payment update (charge_id: {payment.telegram_payment_charge_id})")
+        return
 
     logger.info(
         f"Successful payment from user {user_id} "
         f"for item {item_id} (charge_id: {payment.telegram_payment_charge_id})"
     )
     
-    # Trigger the appropriate function based on the purchased item
-    if item_id == 'about_user_dict':
-        # For non-VIP users who purchased the about_user function directly
-        set_about_user(user_id)
-        await update.message.reply_text(
+    if item_id == payments.VIP_ITEM:
+        # vip_until was extended in the database
+        vip_cache.invalidate(user_id)
+        profile_cache.invalidate(user_id)
+    # Purchased credits are already spendable; the queue only confirms them
+    fulfilment.notify()
+
+
+# Fulfilment of each purchased item, run by the fulfilment queue. A handler
+# that raises is retried later, so it must be safe to run again.
+
+async def fulfil_about_user(bot, job):
+    # For non-VIP users who purchased the about_user function directly
+    if await db.run(set_about_user, job.user_id, True):
+        await bot.send_message(
+            job.chat_id,
             "Thank you for your purchase! 🎉\n\n"
             "Your AI-generated profile summary has been created. Use /profile to view it.",
-            parse_mode='Markdown'
+            rate_limit_args=PAYMENT
         )
-    elif item_id == 'vip':
-        # Set VIP status for 1 month
-        await set_vip_status(user_id)
-        await update.message.reply_text(
-            "Thank you for your purchase! 🎉\n\n"
-            "You now have VIP status for 1 month with access to all premium features!\n"
-            "You can use /about_me and /find_team commands for free during your subscription period.",
-            parse_mode='Markdown'
-        )
-    elif item_id == 'find_team':
-        # For non-VIP users who purchased the find_team function directly
-        await update.message.reply_text(
+        return
+    if job.attempts == 0:
+        await bot.send_message(
+            job.chat_id,
             "Thank you for your purchase! 🎉\n\n"
-            "Let's find you a team! Please tell me what kind of team you're looking for.",
-            parse_mode='Markdown'
+            "Generating your AI profile summary… I'll message you when it's ready.",
+            rate_limit_args=PAYMENT
         )
-        return TEAM_FINDING
-    else:
-        await update.message.reply_text(
-            f"Thank you for your purchase! 🎉\n\n",
-            parse_mode='Markdown'
-        )
-
-
-async def error_handler(update: Update, context: CallbackContext) -> None:
-    """Handle errors caused by Updates."""
-    logger.error(f"Update {update} caused error {context.error}")
-
-
-# Connect to DB
-
-def connect_db():
+    # A full summary queue raises QueueFull and the job is retried
+    await summary_jobs.run(set_about_user, job.user_id)
+    await bot.send_message(
+        job.chat_id, "Your AI-generated profile summary is ready. Use /profile to view it.", rate_limit_args=PAYMENT
+    )
 
-    try:
+async def fulfil_vip(bot, job):
+    vip_until = await db.run(vip_cache.active_until, job.user_id)
+    until = f" until {vip_until.strftime('%Y-%m-%d')}" if vip_until else " for 1 month"
+    await bot.send_message(
+        job.chat_id,
+        "Thank you for your purchase! 🎉\n\n"
+        f"You now have VIP status{until} with access to all premium features!\n"
+        "You can use /about_me and /find_team commands for free during your subscription period.",
+        parse_mode='Markdown',
+        rate_limit_args=PAYMENT
+    )
 
-        return sqlite3.connect(DB_FILE, check_same_thread=False)
+async def fulfil_find_team(bot, job):
+    # For non-VIP users who purchased the find_team function directly; the
+    # purchase added a credit that /find_team spends
+    await bot.send_message(
+        job.chat_id,
+        "Thank you for your purchase! 🎉\n\n"
+        "Use /find_team to find your team. Your purchase covers one search.",
+        rate_limit_args=PAYMENT
+    )
 
-    except sqlite3.Error as e:
+async def fulfil_purchase(bot, job):
+    await bot.send_message(job.chat_id, "Thank you for your purchase! 🎉\n\n", parse_mode='Markdown', rate_limit_args=PAYMENT)
 
-        logging.error(f"DB Error: {e}")
 
-        return None
+async def stats_command(update: Update, context: CallbackContext) -> None:
+    """Handle /stats - payment aggregates for admins."""
+    if update.effective_user.id not in ADMIN_IDS:
+        return
 
+    items = await db.run(ledger.item_summary)
+    buyers = await db.run(ledger.top_buyers, 5)
 
-# Update 'about_user' field using AI
+    text = "📊 Payments by item:\n"
+    for item in items:
+        text += (
+            f"- {item['item_id']}: {item['purchases']} purchases, {item['refunds']} refunds "
+            f"({item['refund_rate']:.1%}), {item['revenue']} Stars net\n"
+        )
+    text += "\n🏆 Top buyers:\n"
+    for buyer in buyers:
+        text += f"- {buyer['user_id']}: {buyer['spent']} Stars, {buyer['purchases']} purchases\n"
 
-def set_about_user(user_id):
+    await update.message.reply_text(text)
 
-    conn = connect_db()
 
-    cursor = conn.cursor()
+async def refresh_ledger_totals(context: Optional[CallbackContext] = None) -> None:
+    # Scrapes read this snapshot; querying the ledger from a gauge would block the event loop
+    global ledger_totals
+    try:
+        ledger_totals = await db.run(ledger.item_summary)
+    except Exception as e:
+        logger.error(f"Could not refresh ledger totals: {e}")
 
-    cursor.execute("SELECT name, email, username, phone_number, skills, preferences, portfolio FROM users WHERE id = ?", (user_id,))
 
-    user = cursor.fetchone()
+async def error_handler(update: Update, context: CallbackContext) -> None:
+    """Handle errors caused by Updates."""
+    logger.error(f"Update {update} caused error {context.error}")
 
-    if user:
 
+# Apply queued profile writes on top of a users row read from the database
+def with_pending(user_id, columns, row):
+    pending = user_writes.pending(user_id)
+    if not pending:
+        return row
+    return tuple(pending.get(column, value) for column, value in zip(columns, row))
+
+# Queue a profile field write and patch the cached /profile message
+def put_profile_field(user_id, field, value):
+    user_writes.put(user_id, field, value)
+    profile_cache.update(user_id, field, value)
+
+SUMMARY_COLUMNS = ('name', 'email', 'username', 'phone_number', 'skills', 'preferences', 'portfolio')
+PROFILE_COLUMNS = ('name', 'username', 'phone_number', 'email', 'skills', 'preferences', 'about_user', 'vip_until')
+
+# Update 'about_user' field using AI, reusing the cached summary of an unchanged profile.
+# With cached_only=True nothing is generated; returns True when about_user was written.
+@metrics.timed("set_about_user")
+def set_about_user(user_id, cached_only=False):
+    user = db.fetchone(
+        "SELECT name, email, username, phone_number, skills, preferences, "
+        "(SELECT group_concat(text, '\n\n') FROM (SELECT text FROM projects WHERE user_id = users.id ORDER BY id)) "
+        "FROM users WHERE id = ?",
+        (user_id,)
+    )
+    if not user:
+        return False
+    user = with_pending(user_id, SUMMARY_COLUMNS, user)
+    key = summary_cache.make_key(user)
+    about_user_summary = summary_cache.get(key)
+    if about_user_summary is not None:
+        STATS['summary_cache']['hits'] += 1
+    elif cached_only:
+        return False
+    else:
+        STATS['summary_cache']['misses'] += 1
         about_user_summary = generate_summary(user)
+        if about_user_summary is not None:
+            summary_cache.put(key, about_user_summary)
+    db.execute("UPDATE users SET about_user = ? WHERE id = ?", (about_user_summary, user_id))
+    profile_cache.update(user_id, 'about_user', about_user_summary)
+    return True
+
+# Generate the summary in the background and tell the user when it is done;
+# a credit spent on it (refund) is given back if that fails
+async def generate_about_user(context: CallbackContext, user_id, chat_id, refund=None):
+    try:
+        await summary_jobs.run(set_about_user, user_id)
+    except QueueFull:
+        logger.warning(f"Summary queue full, dropping job for user {user_id}")
+        if refund:
+            await db.run(refund_feature, user_id, refund)
+        await context.bot.send_message(
+            chat_id, "Too many summaries are being generated right now. Please try /about_me again in a minute.",
+            rate_limit_args=BULK
+        )
+        return
+    except Exception as e:
+        logger.error(f"Summary generation failed for user {user_id}: {e}")
+        if refund:
+            await db.run(refund_feature, user_id, refund)
+        await context.bot.send_message(
+            chat_id, "Sorry, generating your profile summary failed. Please try again later.", rate_limit_args=BULK
+        )
+        return
+    await context.bot.send_message(
+        chat_id, "Your AI-generated profile summary is ready. Use /profile to view it.", rate_limit_args=BULK
+    )
 
-        cursor.execute("UPDATE users SET about_user = ? WHERE id = ?", (about_user_summary, user_id))
-
-        conn.commit()
-
-    conn.close()
-
-
-# Update portfolio
-
-def update_portfolio(user_id, portfolio_text):
-
-    conn = connect_db()
-
-    cursor = conn.cursor()
-
-    cursor.execute("UPDATE users SET portfolio = ? WHERE id = ?", (portfolio_text, user_id))
-
-    conn.commit()
-
-    conn.close()
-
-
-# Get portfolio
-
-def get_portfolio(user_id):
-
-    conn = connect_db()
-
-    cursor = conn.cursor()
-
-    cursor.execute("SELECT portfolio FROM users WHERE id = ?", (user_id,))
+def schedule_about_user(context: CallbackContext, user_id, chat_id, refund=None):
+    context.application.create_task(generate_about_user(context, user_id, chat_id, refund))
 
-    row = cursor.fetchone()
+# Serve the summary from cache right away, otherwise queue it for generation
+async def request_about_user(update: Update, context: CallbackContext, user_id, prefix="", rate_limit_args=None, refund=None):
+    try:
+        cached = await db.run(set_about_user, user_id, True)
+    except Exception:
+        if refund:
+            await db.run(refund_feature, user_id, refund)
+        raise
+    if cached:
+        await context.bot.send_message(
+            update.effective_chat.id,
+            prefix + "Your AI-generated profile summary has been created. Use /profile to view it.",
+            rate_limit_args=rate_limit_args
+        )
+    else:
+        await context.bot.send_message(
+            update.effective_chat.id,
+            prefix + "Generating your AI profile summary… I'll message you when it's ready.",
+            rate_limit_args=rate_limit_args
+        )
+        schedule_about_user(context, user_id, update.effective_chat.id, refund)
 
-    conn.close()
+# Load the stored vip_until of a user for the VIP cache
+def load_vip_until(user_id):
+    result = db.fetchone("SELECT vip_until FROM users WHERE id = ?", (user_id,))
+    return result[0] if result else None
 
-    return row[0] if row else None
+# Check if user is VIP
+def is_vip(user_id):
+    return vip_cache.is_vip(user_id)
 
+# How a user may use a paid feature (credits.VIP, credits.CREDIT or None), without spending anything
+def feature_access(user_id, feature):
+    if is_vip(user_id):
+        return credits.VIP
+    since = credits.cache.version()
+    with db.transaction() as conn:
+        balance = credits.balance(conn, user_id, feature)
+    credits.cache.set(user_id, feature, balance, since)
+    return credits.CREDIT if balance else None
+
+# VIPs may use a paid feature for free; everyone else spends one purchased credit
+def use_feature(user_id, feature):
+    if is_vip(user_id):
+        return credits.VIP
+    since = credits.cache.version()
+    with db.transaction() as conn:
+        remaining = credits.spend(conn, user_id, feature)
+    credits.cache.set(user_id, feature, remaining or 0, since)
+    return credits.CREDIT if remaining is not None else None
+
+# Give back a credit spent on a use that then failed
+def refund_feature(user_id, feature):
+    with db.transaction() as conn:
+        credits.grant(conn, user_id, feature)
+    credits.cache.invalidate(user_id)
+
+# Entitlement check for a paid feature, answered from memory for VIPs and for
+# users known to have no credits left; otherwise one DB call, which spends a
+# credit unless spend is False
+async def check_access(user_id, feature, spend=True):
+    vip = vip_cache.cached(user_id)
+    if vip:
+        return credits.VIP
+    if vip is False and credits.cache.balance(user_id, feature) == 0:
+        return None
+    return await db.run(use_feature if spend else feature_access, user_id, feature)
 
+# Append a project to the portfolio
+def append_project(user_id, new_project):
+    db.execute("INSERT INTO projects (user_id, created_at, text) VALUES (?, ?, ?)", (user_id, time.time(), new_project.strip()))
+    recommender.touch(user_id)
 
-# Update 'about_user' field using AI
-def set_about_user(user_id):
-    conn = connect_db()
-    cursor = conn.cursor()
-    cursor.execute("SELECT name, email, username, phone_number, skills, preferences, portfolio FROM users WHERE id = ?", (user_id,))
-    user = cursor.fetchone()
-    if user:
-        about_user_summary = generate_summary(user)
-        cursor.execute("UPDATE users SET about_user = ? WHERE id = ?", (about_user_summary, user_id))
-        conn.commit()
-    conn.close()
-
-# Set VIP status
-async def set_vip_status(user_id):
-    from datetime import datetime, timedelta
-    vip_until = (datetime.now() + timedelta(days=30)).isoformat()
-    
-    conn = connect_db()
-    cursor = conn.cursor()
-    cursor.execute("UPDATE users SET vip_until = ? WHERE id = ?", (vip_until, user_id))
-    conn.commit()
-    conn.close()
+# Update portfolio, replacing all projects
+def update_portfolio(user_id, portfolio_text):
+    with db.transaction() as conn:
+        conn.execute("DELETE FROM projects WHERE user_id = ?", (user_id,))
+        conn.executemany(
+            "INSERT INTO projects (user_id, created_at, text) VALUES (?, ?, ?)",
+            ((user_id, time.time(), project) for project in migrations.split_portfolio(portfolio_text))
+        )
+    recommender.touch(user_id)
 
-# Check if user is VIP
-def is_vip(user_id):
-    from datetime import datetime
-    
-    conn = connect_db()
-    cursor = conn.cursor()
-    cursor.execute("SELECT vip_until FROM users WHERE id = ?", (user_id,))
-    result = cursor.fetchone()
-    conn.close()
-    
-    if not result or not result[0]:
-        return False
-    
-    vip_until = datetime.fromisoformat(result[0])
-    return datetime.now() < vip_until
+# Get one page of the portfolio as (project_id, text) rows, oldest first
+def get_portfolio(user_id, after_id=0, limit=PORTFOLIO_PAGE_SIZE):
+    return db.fetchall(
+        "SELECT id, text FROM projects WHERE user_id = ? AND id > ? ORDER BY id LIMIT ?",
+        (user_id, after_id, limit)
+    )
 
-# Update portfolio
-def update_portfolio(user_id, portfolio_text):
-    conn = connect_db()
-    cursor = conn.cursor()
-    cursor.execute("UPDATE users SET portfolio = ? WHERE id = ?", (portfolio_text, user_id))
-    conn.commit()
-    conn.close()
-
-# Get portfolio
-def get_portfolio(user_id):
-    conn = connect_db()
-    cursor = conn.cursor()
-    cursor.execute("SELECT portfolio FROM users WHERE id = ?", (user_id,))
-    row = cursor.fetchone()
-    conn.close()
-    return row[0] if row else None
-
-# Get user profile
+# Load and render a user profile after a profile_cache miss, caching the result;
+# callers look the cache up first so each miss is counted once
+@metrics.timed("get_user_profile")
 def get_user_profile(user_id):
-    conn = connect_db()
-    cursor = conn.cursor()
-    cursor.execute("SELECT name, username, phone_number, email, skills, preferences, about_user, vip_until FROM users WHERE id = ?", (user_id,))
-    user = cursor.fetchone()
-    conn.close()
+    since = profile_cache.version()
+    vip_since = vip_cache.version()
+    user = db.fetchone("SELECT name, username, phone_number, email, skills, preferences, about_user, vip_until FROM users WHERE id = ?", (user_id,))
     
     if not user:
         return None
     
-    name, username, phone, email, skills, preferences, about_user, vip_until = user
-    
-    profile = f"👤 *{name}* (@{username})\n\n"
-    
-    if phone:
-        profile += f"📱 Phone: {phone}\n"
-    if email:
-        profile += f"✉️ Email: {email}\n"
-    if skills:
-        profile += f"\n🔧 *Skills*:\n{skills}\n"
-    if preferences:
-        profile += f"\n🌟 *Preferences*:\n{preferences}\n"
-    if about_user:
-        profile += f"\n📝 *About*:\n{about_user}\n"
+    fields = dict(zip(PROFILE_COLUMNS, with_pending(user_id, PROFILE_COLUMNS, user)))
+    fields['vip_until'] = vip_cache.remember(user_id, fields['vip_until'], vip_since)
+    return profile_cache.put(user_id, fields, since)
+
+# Render the /profile message; vip_until is an active datetime or None
+def render_profile(fields):
+    parts = [f"👤 *{fields['name']}* (@{fields['username']})\n\n"]
     
-    if vip_until:
-        from datetime import datetime
-        vip_date = datetime.fromisoformat(vip_until)
-        if datetime.now() < vip_date:
-            profile += f"\n👑 *VIP until*: {vip_date.strftime('%Y-%m-%d')}\n"
+    if fields['phone_number']:
+        parts.append(f"📱 Phone: {fields['phone_number']}\n")
+    if fields['email']:
+        parts.append(f"✉️ Email: {fields['email']}\n")
+    if fields['skills']:
+        parts.append(f"\n🔧 *Skills*:\n{fields['skills']}\n")
+    if fields['preferences']:
+        parts.append(f"\n🌟 *Preferences*:\n{fields['preferences']}\n")
+    if fields['about_user']:
+        parts.append(f"\n📝 *About*:\n{fields['about_user']}\n")
+    if fields['vip_until']:
+        parts.append(f"\n👑 *VIP until*: {fields['vip_until'].strftime('%Y-%m-%d')}\n")
     
-    return profile
+    return "".join(parts)
+
+# Queue the raw skills text, store its canonical skill ids and keep the skill index in sync
+def set_skills(user_id, skills_text):
+    put_profile_field(user_id, 'skills', skills_text)
+    try:
+        with db.transaction() as conn:
+            skill_ids = store_user_skills(conn, skill_catalog, user_id, skills_text)
+            notifications.record_profile_change(conn, user_id)
+    except Exception:
+        skill_catalog.invalidate()
+        raise
+    if skill_index.loaded:
+        skill_index.update(user_id, skill_ids)
+    recommender.touch(user_id)
+
+# Load the skill catalog and index on first use
+def get_skill_catalog():
+    if not skill_catalog.loaded:
+        with db.transaction() as conn:
+            skill_catalog.load(conn)
+    return skill_catalog
+
+def get_skill_index():
+    if not skill_index.loaded:
+        skill_index.load(db.fetchall("SELECT user_id, skill_id FROM user_skills"))
+    return skill_index
+
+# List users as "1. Name (@username)" with their skills; only these rows are read back
+def format_members(user_ids, start=1):
+    if not user_ids:
+        return ""
+    placeholders = ", ".join("?" * len(user_ids))
+    rows = {row[0]: row for row in db.fetchall(f"SELECT id, name, username, skills FROM users WHERE id IN ({placeholders})", user_ids)}
+    result = ""
+    for i, other_id in enumerate(user_ids, start):
+        if other_id not in rows:
+            continue
+        other_name, other_username, other_skills = with_pending(other_id, ('name', 'username', 'skills'), rows[other_id][1:])
+        result += f"{i}. {other_name}"
+        if other_username:
+            result += f" (@{other_username})"
+        result += f"\n   Skills: {other_skills or 'not set'}\n\n"
+    return result
+
+# Profiles for the recommender as (user_id, skill ids, preferences, number of projects)
+def load_recommendation_profiles(user_ids=None):
+    query = (
+        "SELECT u.id, (SELECT group_concat(skill_id) FROM user_skills s WHERE s.user_id = u.id), u.preferences, "
+        "(SELECT count(*) FROM projects p WHERE p.user_id = u.id) FROM users u"
+    )
+    if user_ids is None:
+        rows = db.fetchall(query)
+    else:
+        rows = db.fetchall(f"{query} WHERE u.id IN ({', '.join('?' * len(user_ids))})", list(user_ids))
+    profiles = []
+    for user_id, skill_ids, preferences, projects in rows:
+        (preferences,) = with_pending(user_id, ('preferences',), (preferences,))
+        profiles.append((user_id, [int(skill_id) for skill_id in skill_ids.split(',')] if skill_ids else [], preferences, projects))
+    return profiles
+
+# Precomputed suggestions shown by /find_team, None while the recommender has none
+def get_suggestions(user_id):
+    candidates = recommender.recommendations(user_id)
+    if not candidates:
+        return None
+    return "✨ Suggested teammates for you:\n\n" + format_members([other_id for other_id, _ in candidates[:5]])
 
 # Find team members based on skills
-def find_team_members(user_id, requirements):
-    conn = connect_db()
-    cursor = conn.cursor()
-    
+@metrics.timed("find_team_members")
+def find_team_members(user_id, requirements, feature=None):
     # Get user's own skills
-    cursor.execute("SELECT skills FROM users WHERE id = ?", (user_id,))
-    user_skills_row = cursor.fetchone()
+    user_skills_row = db.fetchone("SELECT skills FROM users WHERE id = ?", (user_id,))
+    if user_skills_row:
+        user_skills_row = with_pending(user_id, ('skills',), user_skills_row)
     if not user_skills_row or not user_skills_row[0]:
-        conn.close()
-        return "You need to set your skills first using /set_skills"
+        return "You need to set your skills first using /set_skills", None
     
-    # Parse requirements to find needed skills
-    skills_needed = []
-    for word in requirements.lower().split():
-        if re.match(r'^[a-z0-9\+\#\.]+$', word) and len(word) > 2:
-            skills_needed.append(word)
+    # Parse requirements into canonical skills; other words only go to full-text search
+    skills_needed, other_words = find_skills(requirements, get_skill_catalog())
     
-    if not skills_needed:
-        conn.close()
-        return "Please specify some skills you're looking for in your team"
+    if not skills_needed and not other_words:
+        return "Please specify some skills you're looking for in your team", None
     
-    # Find users with matching skills
-    matches = []
-    cursor.execute("SELECT id, name, username, skills FROM users WHERE id != ?", (user_id,))
-    for row in cursor.fetchall():
-        other_id, other_name, other_username, other_skills = row
-        if not other_skills:
-            continue
-        
-        other_skills_list = [s.strip().lower() for s in other_skills.split(',')]
-        match_score = sum(1 for skill in skills_needed if any(skill in other_skill for other_skill in other_skills_list))
-        
-        if match_score > 0:
-            matches.append({
-                'id': other_id,
-                'name': other_name,
-                'username': other_username,
-                'skills': other_skills,
-                'score': match_score
-            })
+    skill_ids = [skill_id for skill_id in map(skill_catalog.lookup, skills_needed) if skill_id is not None]
+    
+    # Remember the skills asked for to alert the user about new matches later
+    if skill_ids:
+        with db.transaction() as conn:
+            notifications.save_search(conn, user_id, skill_ids)
     
-    conn.close()
+    # BM25 over skills, preferences, summary and portfolio breaks ties between
+    # equal skill matches and adds profiles that only mention the skills in text
+    text_ranks = {other_id: rank for rank, (other_id, _) in enumerate(search_index.search(skills_needed + other_words, exclude_id=user_id))}
+    unranked = len(text_ranks)
     
-    # Sort matches by score
-    matches.sort(key=lambda x: x['score'], reverse=True)
+    # Score every user with matching skills, but only rank the best few
+    skill_matches, best, text_scores = get_skill_index().top(skill_ids, TEAM_PAGE_SIZE, exclude_id=user_id, include=list(text_ranks))
+    candidates = dict(best)
+    candidates.update((other_id, score) for other_id, score in text_scores.items() if score)
+    ranked_ids = [other_id for other_id, _ in sorted(candidates.items(), key=lambda m: (-m[1], text_ranks.get(m[0], unranked), m[0]))]
+    text_only = [other_id for other_id in text_ranks if not text_scores[other_id]]
+    ranked_ids += text_only
+    found = skill_matches + len(text_only)
     
     # Format response
-    if not matches:
-        return "No team members found with the required skills. Try different requirements."
+    if not ranked_ids:
+        return "No team members found with the required skills. Try different requirements.", None
     
-    result = f"🔍 Found {len(matches)} potential team members:\n\n"
-    for i, match in enumerate(matches[:5], 1):
-        result += f"{i}. {match['name']}"
-        if match['username']:
-            result += f" (@{match['username']})"
-        result += f"\n   Skills: {match['skills']}\n\n"
+    # A paid search (feature) costs its credit only when it found someone
+    if feature is not None and not use_feature(user_id, feature):
+        return "Your team search credit has already been used. Use /find_team to purchase another search.", None
     
-    if len(matches) > 5:
-        result += f"...and {len(matches) - 5} more matches."
+    # Later pages are served from this cursor without searching again
+    search = {'user_id': user_id, 'skill_ids': skill_ids, 'text_ranks': text_ranks, 'found': found, 'keys': None}
+    page = [(-candidates.get(other_id, 0), text_ranks.get(other_id, unranked), other_id) for other_id in ranked_ids[:TEAM_PAGE_SIZE]]
+    return render_team_page(team_cursors.put(search), search, page, 0)
+
+# All results of a team search as sorted (-skill score, text rank, user id) keys, built on the first page turn
+def team_search_keys(search):
+    if search['keys'] is None:
+        text_ranks = search['text_ranks']
+        unranked = len(text_ranks)
+        scores = dict(get_skill_index().match(search['skill_ids'], exclude_id=search['user_id']))
+        for other_id in text_ranks:
+            scores.setdefault(other_id, 0)
+        search['keys'] = sorted((-score, text_ranks.get(other_id, unranked), other_id) for other_id, score in scores.items())
+        search['found'] = len(search['keys'])
+    return search['keys']
+
+# The page after the key `after`, or before the key `before`, and its offset
+def team_page(search, after=None, before=None):
+    keys = team_search_keys(search)
+    if before is not None:
+        end = bisect_left(keys, before)
+        start = max(0, end - TEAM_PAGE_SIZE)
+        end = min(len(keys), start + TEAM_PAGE_SIZE)
+    else:
+        start = bisect_right(keys, after) if after is not None else 0
+        end = start + TEAM_PAGE_SIZE
+    return keys[start:end], start
+
+# Team search message for one page, with prev/next buttons carrying the page boundary keys
+def render_team_page(token, search, page, start):
+    result = f"🔍 Found {search['found']} potential team members:\n\n"
+    result += format_members([key[2] for key in page], start=start + 1)
     
-    return result
+    buttons = []
+    if start > 0:
+        buttons.append(InlineKeyboardButton("⬅️ Prev", callback_data=f"team:{token}:prev:{encode_team_key(page[0])}"))
+    if start + len(page) < search['found']:
+        buttons.append(InlineKeyboardButton("Next ➡️", callback_data=f"team:{token}:next:{encode_team_key(page[-1])}"))
+    
+    return result, InlineKeyboardMarkup([buttons]) if buttons else None
+
+def encode_team_key(key):
+    return ",".join(str(part) for part in key)
+
+def decode_team_key(text):
+    return tuple(int(part) for part in text.split(","))
+
+# Render the requested page of an open team search; None once its cursor expired
+def get_team_page(token, user_id, direction, key):
+    search = team_cursors.get(token)
+    if search is None or search['user_id'] != user_id:
+        return None
+    if direction == 'prev':
+        page, start = team_page(search, before=key)
+    else:
+        page, start = team_page(search, after=key)
+    return render_team_page(token, search, page, start)
 
 # --- BOT HANDLERS ---
 
@@ -492,7 +808,7 @@ async def shop_command(update: Update, context: CallbackContext):
 # /profile command
 async def profile_command(update: Update, context: CallbackContext):
     user_id = update.message.from_user.id
-    profile = get_user_profile(user_id)
+    profile = profile_cache.get(user_id) or await db.run(get_user_profile, user_id)
     
     if profile:
         await update.message.reply_text(profile, parse_mode="Markdown")
@@ -505,12 +821,11 @@ async def profile_command(update: Update, context: CallbackContext):
 async def about_me_command(update: Update, context: CallbackContext):
     user_id = update.message.from_user.id
     
-    # Check if user is VIP
-    if is_vip(user_id):
-        set_about_user(user_id)
-        await update.message.reply_text(
-            "Your AI-generated profile summary has been created. Use /profile to view it."
-        )
+    # VIP or a purchased summary credit, given back if the summary fails
+    access = await check_access(user_id, credits.ABOUT_ME)
+    if access:
+        refund = credits.ABOUT_ME if access == credits.CREDIT else None
+        await request_about_user(update, context, user_id, refund=refund)
     else:
         # Offer to purchase
         keyboard = [
@@ -536,8 +851,11 @@ async def about_me_command(update: Update, context: CallbackContext):
 async def find_team_command(update: Update, context: CallbackContext):
     user_id = update.message.from_user.id
     
-    # Check if user is VIP
-    if is_vip(user_id):
+    # VIP or a purchased team search credit, spent once the search finds someone
+    if await check_access(user_id, credits.FIND_TEAM, spend=False):
+        suggestions = await db.run(get_suggestions, user_id)
+        if suggestions:
+            await update.message.reply_text(suggestions)
         await update.message.reply_text(
             "Please describe what kind of team members you're looking for. "
             "Include skills and any other requirements."
@@ -570,10 +888,25 @@ async def handle_team_requirements(update: Update, context: CallbackContext):
     user_id = update.message.from_user.id
     requirements = update.message.text
     
-    result = find_team_members(user_id, requirements)
-    await update.message.reply_text(result)
+    result, reply_markup = await db.run(find_team_members, user_id, requirements, credits.FIND_TEAM)
+    await update.message.reply_text(result, reply_markup=reply_markup)
     return ConversationHandler.END
 
+# Prev/next buttons under team search results
+@metrics.timed("team_page_callback")
+async def team_page_callback(update: Update, context: CallbackContext) -> None:
+    query = update.callback_query
+    _, token, direction, key = query.data.split(":", 3)
+    
+    page = await db.run(get_team_page, token, query.from_user.id, direction, decode_team_key(key))
+    if page is None:
+        await query.answer("These results have expired. Use /find_team to search again.", show_alert=True)
+        return
+    
+    await query.answer()
+    result, reply_markup = page
+    await query.edit_message_text(result, reply_markup=reply_markup)
+
 # Add project to portfolio
 
 async def add_project(update: Update, context: CallbackContext):
@@ -590,49 +923,55 @@ async def receive_project(update: Update, context: CallbackContext):
     new_project = update.message.text
 
 
-    conn = connect_db()
+    await db.run(append_project, user_id, new_project)
 
-    cursor = conn.cursor()
 
-    
+    await update.message.reply_text("? Project added to your portfolio!")
 
-    # Get current portfolio
+    return ConversationHandler.END
 
-    cursor.execute("SELECT portfolio FROM users WHERE id = ?", (user_id,))
 
-    result = cursor.fetchone()
+# /portfolio
 
-    current_portfolio = result[0] if result else ""
+async def portfolio(update: Update, context: CallbackContext):
 
-    
+    user_id = update.message.from_user.id
 
-    # Append new project
+    # Stream the portfolio page by page, sending each message once it is full
 
-    updated_portfolio = (current_portfolio + "\n\n " + new_project).strip()
+    chunk = " Your Completed Projects:\n"
 
-    cursor.execute("UPDATE users SET portfolio = ? WHERE id = ?", (updated_portfolio, user_id))
+    after_id = 0
 
-    conn.commit()
+    while True:
 
-    conn.close()
+        page = await db.run(get_portfolio, user_id, after_id)
 
+        for after_id, text in page:
 
-    await update.message.reply_text("? Project added to your portfolio!")
+            piece = text + "\n\n"
 
-    return ConversationHandler.END
+            if len(chunk) + len(piece) > MAX_MESSAGE_LENGTH:
 
+                await update.message.reply_text(chunk.strip())
 
-# /portfolio
+                chunk = ""
 
-async def portfolio(update: Update, context: CallbackContext):
+            while len(piece) > MAX_MESSAGE_LENGTH:
 
-    user_id = update.message.from_user.id
+                await update.message.reply_text(piece[:MAX_MESSAGE_LENGTH])
+
+                piece = piece[MAX_MESSAGE_LENGTH:]
+
+            chunk += piece
 
-    portfolio_text = get_portfolio(user_id)
+        if len(page) < PORTFOLIO_PAGE_SIZE:
 
-    if portfolio_text:
+            break
 
-        await update.message.reply_text(f" Your Completed Projects:\n{portfolio_text}")
+    if after_id:
+
+        await update.message.reply_text(chunk.strip())
 
     else:
 
@@ -654,15 +993,7 @@ async def handle_skills(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
     skills = update.message.text
 
-    conn = connect_db()
-
-    cursor = conn.cursor()
-
-    cursor.execute("UPDATE users SET skills = ? WHERE id = ?", (skills, user_id))
-
-    conn.commit()
-
-    conn.close()
+    await db.run(set_skills, user_id, skills)
 
     await update.message.reply_text("? Skills updated.")
 
@@ -691,29 +1022,11 @@ async def handle_preferences(update: Update, context: CallbackContext):
 
     preferences = update.message.text
 
-    conn = connect_db()
-
-    if conn:
-
-        try:
-
-            cursor = conn.cursor()
-
-            cursor.execute("UPDATE users SET preferences = ? WHERE id = ?", (preferences, user_id))
-
-            conn.commit()
-
-            await update.message.reply_text("? Preferences updated.")
-
-        except sqlite3.Error as e:
+    put_profile_field(user_id, 'preferences', preferences)
 
-            logging.error(f"DB error: {e}")
+    recommender.touch(user_id)
 
-            await update.message.reply_text("? Failed to update preferences.")
-
-        finally:
-
-            conn.close()
+    await update.message.reply_text("? Preferences updated.")
 
     return ConversationHandler.END
 
@@ -724,23 +1037,15 @@ async def sign_up(update: Update, context: CallbackContext):
 
     user = update.message.from_user
 
-    conn = connect_db()
-
-    cursor = conn.cursor()
-
-    cursor.execute("SELECT id FROM users WHERE id = ?", (user.id,))
-
-    if cursor.fetchone():
+    if await db.run(db.fetchone, "SELECT id FROM users WHERE id = ?", (user.id,)):
 
         await update.message.reply_text("You're already registered. Use /modify to change your info.")
 
         return ConversationHandler.END
 
-    cursor.execute("INSERT INTO users (id, name, username) VALUES (?, ?, ?)", (user.id, user.first_name, user.username))
-
-    conn.commit()
+    await db.run(db.execute, "INSERT INTO users (id, name, username) VALUES (?, ?, ?)", (user.id, user.first_name, user.username))
 
-    conn.close()
+    profile_cache.invalidate(user.id)
 
     await update.message.reply_text(" Enter your phone number:")
 
@@ -775,15 +1080,7 @@ async def get_phone(update: Update, context: CallbackContext):
 
     if re.match(r"^\+?[1-9]\d{1,14}$", phone):
 
-        conn = connect_db()
-
-        cursor = conn.cursor()
-
-        cursor.execute("UPDATE users SET phone_number = ? WHERE id = ?", (phone, user_id))
-
-        conn.commit()
-
-        conn.close()
+        put_profile_field(user_id, 'phone_number', phone)
 
         await update.message.reply_text(" Now enter your email:")
 
@@ -804,15 +1101,7 @@ async def get_email(update: Update, context: CallbackContext):
 
     if re.match(r"^[a-zA-Z0-9_.+-]+@[a-zA-Z0-9-]+\.[a-zA-Z0-9-.]+$", email):
 
-        conn = connect_db()
-
-        cursor = conn.cursor()
-
-        cursor.execute("UPDATE users SET email = ? WHERE id = ?", (email, user_id))
-
-        conn.commit()
-
-        conn.close()
+        put_profile_field(user_id, 'email', email)
 
         await update.message.reply_text(" Registration complete!")
 
@@ -825,8 +1114,107 @@ async def get_email(update: Update, context: CallbackContext):
 
 
 # --- MAIN APP ---
-async def main():
-    application = Application.builder().token(API_TOKEN).build()
+def register_metrics():
+    metrics.REGISTRY.register(metrics.Gauge(
+        "teamfinder_purchases", "Purchases per item from the payment ledger totals.",
+        lambda: {(('item', item['item_id']),): item['purchases'] for item in ledger_totals}
+    ))
+    metrics.REGISTRY.register(metrics.Gauge(
+        "teamfinder_refunds", "Refunds per item from the payment ledger totals.",
+        lambda: {(('item', item['item_id']),): item['refunds'] for item in ledger_totals}
+    ))
+    metrics.REGISTRY.register(metrics.Gauge(
+        "teamfinder_summary_cache", "Summary cache hits and misses.",
+        lambda: {(('result', result),): count for result, count in STATS['summary_cache'].items()}
+    ))
+    metrics.REGISTRY.register(metrics.Gauge(
+        "teamfinder_summary_jobs", "Summary worker pool counters and throughput.",
+        lambda: {(('field', field),): value for field, value in summary_jobs.stats().items()}
+    ))
+    metrics.REGISTRY.register(metrics.Gauge(
+        "teamfinder_write_behind", "Write-behind flushes and flushed writes.",
+        lambda: {(('field', 'flushes'),): user_writes.flushes, (('field', 'flushed_writes'),): user_writes.flushed_writes}
+    ))
+    metrics.REGISTRY.register(metrics.Gauge(
+        "teamfinder_recommender", "Recommendation lists, queue sizes and refresh work.",
+        lambda: {(('field', field),): value for field, value in recommender.stats().items()}
+    ))
+    metrics.REGISTRY.register(metrics.Gauge(
+        "teamfinder_profile_cache", "Rendered profile cache hits, misses, hit rate, entries and approximate bytes.",
+        lambda: {(('field', field),): value for field, value in profile_cache.stats().items()}
+    ))
+    metrics.REGISTRY.register(metrics.Gauge(
+        "teamfinder_flood_limiter", "Outgoing messages sent, retried after flood waits, coalesced and waiting.",
+        lambda: {(('field', field),): value for field, value in flood_limiter.stats().items()}
+    ))
+    metrics.REGISTRY.register(metrics.Gauge(
+        "teamfinder_notifications", "Notification job runs and messages sent, failed, deferred and given up.",
+        lambda: {(('field', field),): value for field, value in notifier.stats().items()}
+    ))
+    metrics.REGISTRY.register(metrics.Gauge(
+        "teamfinder_fulfilment", "Payment fulfilment jobs completed, retried, failed and running.",
+        lambda: {(('field', field),): value for field, value in fulfilment.stats().items()}
+    ))
+
+register_metrics()
+
+
+async def post_init(application: Application):
+    global metrics_server, loop_lag_task
+    # Metrics endpoint and event-loop lag sampling. A plain asyncio task: the
+    # Application is not running yet, and it is cancelled in post_shutdown
+    metrics_server = await metrics.start_server()
+    loop_lag_task = asyncio.get_running_loop().create_task(metrics.monitor_loop_lag())
+    await refresh_ledger_totals()
+    # Profile field writes queued from handlers and db.run worker threads
+    user_writes.start()
+    # Teammate suggestions are refreshed in the background
+    recommender.start()
+    # Payments recorded but not yet fulfilled, including any left by a restart
+    fulfilment.start(application.bot)
+    if application.job_queue is not None:
+        # Payment totals for the metrics endpoint
+        application.job_queue.run_repeating(
+            refresh_ledger_totals, interval=LEDGER_METRICS_INTERVAL, first=LEDGER_METRICS_INTERVAL,
+            name="ledger_totals", job_kwargs={'max_instances': 1, 'coalesce': True}
+        )
+        # VIP expiry reminders and new-match alerts
+        application.job_queue.run_repeating(
+            notifier.run, interval=notifications.NOTIFY_INTERVAL, first=notifications.NOTIFY_INTERVAL,
+            name="notifications", job_kwargs={'max_instances': 1, 'coalesce': True}
+        )
+    else:
+        logger.warning("JobQueue is not available, install python-telegram-bot[job-queue] to send notifications and refresh payment metrics")
+
+
+async def post_shutdown(application: Application):
+    global metrics_server, loop_lag_task
+    # Durably write queued profile updates before exiting
+    await user_writes.close()
+    await recommender.close()
+    await fulfilment.close()
+    if loop_lag_task is not None:
+        loop_lag_task.cancel()
+        await asyncio.gather(loop_lag_task, return_exceptions=True)
+        loop_lag_task = None
+    if metrics_server is not None:
+        metrics_server.close()
+        await metrics_server.wait_closed()
+        metrics_server = None
+
+
+def build_application(builder=None, rate_limiter=None) -> Application:
+    """Create the Application and register every handler."""
+    if builder is None:
+        builder = Application.builder().token(API_TOKEN)
+    application = (
+        builder.concurrent_updates(CONCURRENT_UPDATES)
+        .rate_limiter(rate_limiter or flood_limiter)
+        .persistence(SQLitePersistence())
+        .post_init(post_init)
+        .post_shutdown(post_shutdown)
+        .build()
+    )
 
     # Register handlers
     application.add_handler(CommandHandler("start", start))
@@ -836,19 +1224,24 @@ async def main():
     application.add_handler(CommandHandler("profile", profile_command))
     application.add_handler(CommandHandler("about_me", about_me_command))
     application.add_handler(CommandHandler("refund", refund_command))
+    application.add_handler(CommandHandler("stats", stats_command))
 
     # Portfolio project adder
     application.add_handler(ConversationHandler(
         entry_points=[CommandHandler("add_project", add_project)],
         states={WAITING_FOR_PORTFOLIO: [MessageHandler(filters.TEXT & ~filters.COMMAND, receive_project)]},
-        fallbacks=[CommandHandler("cancel", lambda u, c: ConversationHandler.END)]
+        fallbacks=[CommandHandler("cancel", lambda u, c: ConversationHandler.END)],
+        name="add_project",
+        persistent=True
     ))
 
     # Team finder handler
     application.add_handler(ConversationHandler(
         entry_points=[CommandHandler("find_team", find_team_command)],
         states={TEAM_FINDING: [MessageHandler(filters.TEXT & ~filters.COMMAND, handle_team_requirements)]},
-        fallbacks=[CommandHandler("cancel", lambda u, c: ConversationHandler.END)]
+        fallbacks=[CommandHandler("cancel", lambda u, c: ConversationHandler.END)],
+        name="find_team",
+        persistent=True
     ))
 
     # Sign up handler
@@ -858,7 +1251,9 @@ async def main():
             PHONE: [MessageHandler(filters.TEXT & ~filters.COMMAND, get_phone)],
             EMAIL: [MessageHandler(filters.TEXT & ~filters.COMMAND, get_email)]
         },
-        fallbacks=[CommandHandler("cancel", lambda u, c: ConversationHandler.END)]
+        fallbacks=[CommandHandler("cancel", lambda u, c: ConversationHandler.END)],
+        name="sign_up",
+        persistent=True
     ))
 
     # Modify handler
@@ -868,23 +1263,32 @@ async def main():
             PHONE: [MessageHandler(filters.TEXT & ~filters.COMMAND, get_phone)],
             EMAIL: [MessageHandler(filters.TEXT & ~filters.COMMAND, get_email)]
         },
-        fallbacks=[CommandHandler("cancel", lambda u, c: ConversationHandler.END)]
+        fallbacks=[CommandHandler("cancel", lambda u, c: ConversationHandler.END)],
+        name="modify",
+        persistent=True
     ))
 
     # Skills handler
     application.add_handler(ConversationHandler(
         entry_points=[CommandHandler("set_skills", ask_skills)],
         states={SELECTING_SKILLS: [MessageHandler(filters.TEXT & ~filters.COMMAND, handle_skills)]},
-        fallbacks=[CommandHandler("cancel", cancel_skills)]
+        fallbacks=[CommandHandler("cancel", cancel_skills)],
+        name="set_skills",
+        persistent=True
     ))
 
     # Preferences handler
     application.add_handler(ConversationHandler(
         entry_points=[CommandHandler("set_preferences", set_preferences)],
         states={WAITING_FOR_PREFERENCES: [MessageHandler(filters.TEXT & ~filters.COMMAND, handle_preferences)]},
-        fallbacks=[CommandHandler("cancel", lambda u, c: ConversationHandler.END)]
+        fallbacks=[CommandHandler("cancel", lambda u, c: ConversationHandler.END)],
+        name="set_preferences",
+        persistent=True
     ))
 
+    # Team search pages, before the catch-all payment buttons
+    application.add_handler(CallbackQueryHandler(team_page_callback, pattern='^team:'))
+
     # Payment handlers
     application.add_handler(CallbackQueryHandler(button_handler))
     application.add_handler(PreCheckoutQueryHandler(precheckout_callback))
@@ -893,8 +1297,24 @@ async def main():
     # Error handler
     application.add_error_handler(error_handler)
 
+    return application
+
+
+async def main():
+    # Apply pending schema migrations before taking any update
+    version = await db.run(db.schema_version)
+    logger.info(f"Database schema at version {version}")
+    
+    application = build_application()
+
     # Run the bot
-    await application.run_polling()
+    if BOT_MODE == "webhook":
+        await run_webhook(application)
+    else:
+        await application.run_polling()
 
 if __name__ == '__main__':
+    # python main.py import|export FILE: bulk profile transfer, see bulk.py
+    if len(sys.argv) > 1 and sys.argv[1] in bulk.COMMANDS:
+        sys.exit(bulk.main(sys.argv[1:]))
     asyncio.run(main())
\ No newline at end of file
@@ -0,0 +1,215 @@
+"""Lightweight in-process metrics exported in Prometheus text format.
+
+Handlers and helpers are timed with ``@timed("name")``, every SQL statement is
+timed by the connection factory in ``db``, and ``monitor_loop_lag`` samples how
+late the event loop wakes up. Recording is a lock plus a bisect, cheap enough
+to leave on in production. ``start_server`` serves ``GET /metrics`` on a local
+port for Prometheus to scrape.
+"""
+import asyncio
+import bisect
+import functools
+import inspect
+import logging
+import os
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+
+METRICS_LISTEN = os.getenv("METRICS_LISTEN", "127.0.0.1")
+# Set METRICS_PORT to an empty string to disable the endpoint, or to 0 for a
+# free port per process (several bots on one host); the bound port is logged
+METRICS_PORT = os.getenv("METRICS_PORT", "9464")
+LOOP_LAG_INTERVAL = 0.5
+
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+logger = logging.getLogger(__name__)
+
+Labels = Tuple[Tuple[str, str], ...]
+
+
+def _format_labels(labels: Labels, extra: str = "") -> str:
+    parts = [f'{name}="{_escape(value)}"' for name, value in labels]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+class Counter:
+    def __init__(self, name: str, documentation: str) -> None:
+        self.name = name
+        self.documentation = documentation
+        self._values: Dict[Labels, float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1, **labels: str) -> None:
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for labels, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_format_labels(labels)} {value}")
+        return lines
+
+
+class Gauge:
+    """A value read from a callback at scrape time."""
+
+    def __init__(self, name: str, documentation: str, callback: Callable[[], Dict[Labels, float]]) -> None:
+        self.name = name
+        self.documentation = documentation
+        self.callback = callback
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} gauge"]
+        for labels, value in sorted(self.callback().items()):
+            lines.append(f"{self.name}{_format_labels(labels)} {value}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name: str, documentation: str, buckets: Sequence[float] = DEFAULT_BUCKETS) -> None:
+        self.name = name
+        self.documentation = documentation
+        self.buckets = tuple(buckets)
+        # labels -> [per-bucket counts..., +Inf count, sum]
+        self._series: Dict[Labels, List[float]] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels: str) -> None:
+        key = tuple(sorted(labels.items()))
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [0] * (len(self.buckets) + 2)
+            series[index] += 1
+            series[-1] += value
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            snapshot = {labels: list(series) for labels, series in self._series.items()}
+        for labels, series in sorted(snapshot.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets, series):
+                cumulative += count
+                bucket_labels = _format_labels(labels, 'le="%s"' % bound)
+                lines.append(f"{self.name}_bucket{bucket_labels} {cumulative}")
+            cumulative += series[len(self.buckets)]
+            bucket_labels = _format_labels(labels, 'le="+Inf"')
+            lines.append(f"{self.name}_bucket{bucket_labels} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(labels)} {series[-1]}")
+            lines.append(f"{self.name}_count{_format_labels(labels)} {cumulative}")
+        return lines
+
+
+class Registry:
+    def __init__(self) -> None:
+        self._metrics: List[Any] = []
+
+    def register(self, metric: Any) -> Any:
+        self._metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        lines: List[str] = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+HANDLER_SECONDS = REGISTRY.register(Histogram("teamfinder_handler_seconds", "Wall time per handler or helper."))
+HANDLER_ERRORS = REGISTRY.register(Counter("teamfinder_handler_errors_total", "Exceptions raised per handler."))
+DB_STATEMENT_SECONDS = REGISTRY.register(Histogram("teamfinder_db_statement_seconds", "Wall time per SQL statement."))
+LOOP_LAG_SECONDS = REGISTRY.register(Histogram(
+    "teamfinder_event_loop_lag_seconds", "How late the event loop ran a scheduled wake-up.",
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5),
+))
+
+
+def timed(name: str) -> Callable[[Callable], Callable]:
+    """Record the wall time of a sync or async function under ``handler=name``."""
+    def decorator(func: Callable) -> Callable:
+        if inspect.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def async_wrapper(*args: Any, **kwargs: Any) -> Any:
+                start = time.perf_counter()
+                try:
+                    return await func(*args, **kwargs)
+                except Exception:
+                    HANDLER_ERRORS.inc(handler=name)
+                    raise
+                finally:
+                    HANDLER_SECONDS.observe(time.perf_counter() - start, handler=name)
+            return async_wrapper
+
+        @functools.wraps(func)
+        def wrapper(*args: Any, **kwargs: Any) -> Any:
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            except Exception:
+                HANDLER_ERRORS.inc(handler=name)
+                raise
+            finally:
+                HANDLER_SECONDS.observe(time.perf_counter() - start, handler=name)
+        return wrapper
+    return decorator
+
+
+@functools.lru_cache(maxsize=1024)
+def statement_label(sql: str) -> str:
+    """Collapse whitespace so each distinct statement is one label value."""
+    label = " ".join(sql.split())
+    return label if len(label) <= 120 else label[:117] + "..."
+
+
+async def monitor_loop_lag(interval: float = LOOP_LAG_INTERVAL) -> None:
+    """Sample event-loop lag forever; run it as a background task."""
+    while True:
+        start = time.perf_counter()
+        await asyncio.sleep(interval)
+        LOOP_LAG_SECONDS.observe(max(0.0, time.perf_counter() - start - interval))
+
+
+async def _serve(reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+    try:
+        request_line = await reader.readline()
+        while (await reader.readline()) not in (b"\r\n", b"\n", b""):
+            pass
+        parts = request_line.decode("latin-1").split()
+        if len(parts) >= 2 and parts[0] == "GET" and parts[1].split("?", 1)[0] == "/metrics":
+            body = REGISTRY.render().encode()
+            status = "200 OK"
+        else:
+            body = b"not found\n"
+            status = "404 Not Found"
+        writer.write(
+            f"HTTP/1.1 {status}\r\nContent-Type: text/plain; version=0.0.4\r\n"
+            f"Content-Length: {len(body)}\r\nConnection: close\r\n\r\n".encode() + body
+        )
+        await writer.drain()
+    except ConnectionError:
+        pass
+    finally:
+        writer.close()
+
+
+async def start_server(listen: str = METRICS_LISTEN, port: Optional[str] = METRICS_PORT) -> Optional[asyncio.AbstractServer]:
+    """Serve ``/metrics`` on ``listen:port``; returns None when disabled."""
+    if not port:
+        return None
+    server = await asyncio.start_server(_serve, listen, int(port))
+    logger.info(f"Metrics available at http://{listen}:{server.sockets[0].getsockname()[1]}/metrics")
+    return server
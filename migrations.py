@@ -0,0 +1,481 @@
+"""Versioned schema migrations, tracked in ``PRAGMA user_version``.
+
+``migrate`` runs on the first pooled connection (see ``db.py``), so the bot
+applies pending migrations at startup before it polls for updates. Every
+migration runs in its own ``BEGIN IMMEDIATE`` transaction, which also
+serializes processes starting at the same time. Migrations are append-only:
+never edit one that has shipped, add a new one instead.
+
+Each migration lists the queries it exists for together with the index
+their plan must use; ``check_plans`` runs them through ``EXPLAIN QUERY PLAN``
+after migrating and ``python migrations.py`` fails when one does not.
+
+    python migrations.py --db teamfinder.db
+"""
+import argparse
+import logging
+import sqlite3
+import sys
+import time
+from datetime import datetime
+from typing import Any, Callable, List, NamedTuple, Optional, Sequence, Tuple
+
+import skills
+
+logger = logging.getLogger(__name__)
+
+
+class Plan(NamedTuple):
+    """A query and the index (or key) EXPLAIN QUERY PLAN must show for it."""
+    sql: str
+    params: Sequence[Any]
+    uses: str
+
+
+class Migration(NamedTuple):
+    version: int
+    description: str
+    apply: Callable[[sqlite3.Connection], None]
+    plans: Tuple[Plan, ...] = ()
+
+
+def execute_script(conn: sqlite3.Connection, script: str) -> None:
+    """Run ``script`` statement by statement inside the current transaction.
+
+    Unlike ``executescript`` this does not commit first.
+    """
+    statement = ""
+    for line in script.splitlines(keepends=True):
+        statement += line
+        if sqlite3.complete_statement(statement):
+            conn.execute(statement)
+            statement = ""
+    if statement.strip():
+        raise ValueError(f"Incomplete SQL statement: {statement.strip()[:80]}")
+
+
+def split_portfolio(portfolio: str) -> List[str]:
+    """Split a legacy portfolio blob back into the projects appended to it."""
+    return [project.strip() for project in portfolio.split("\n\n") if project.strip()]
+
+
+def migrate_portfolios(conn: sqlite3.Connection) -> None:
+    """Move legacy ``users.portfolio`` blobs into ``projects`` rows."""
+    rows = conn.execute("SELECT id, portfolio FROM users WHERE portfolio IS NOT NULL").fetchall()
+    if not rows:
+        return
+    now = time.time()
+    for user_id, portfolio in rows:
+        conn.executemany(
+            "INSERT INTO projects (user_id, created_at, text) VALUES (?, ?, ?)",
+            ((user_id, now, project) for project in split_portfolio(portfolio)),
+        )
+    conn.execute("UPDATE users SET portfolio = NULL WHERE portfolio IS NOT NULL")
+    logger.info(f"Migrated portfolios of {len(rows)} users into projects")
+
+
+def build_search_index(conn: sqlite3.Connection, force: bool = False) -> None:
+    """Fill ``profile_search`` from users and projects.
+
+    Triggers keep the index current afterwards, so this only runs when the
+    table is empty (a database from before the index existed) or ``force`` is
+    set after a bulk load that bypassed them.
+    """
+    if not force and conn.execute("SELECT 1 FROM profile_search LIMIT 1").fetchone():
+        return
+    conn.execute("DELETE FROM profile_search")
+    indexed = conn.execute(
+        "INSERT INTO profile_search (rowid, skills, preferences, about_user, portfolio) "
+        "SELECT u.id, u.skills, u.preferences, u.about_user, "
+        "(SELECT group_concat(p.text, ' ') FROM projects p WHERE p.user_id = u.id) FROM users u"
+    ).rowcount
+    if indexed:
+        logger.info(f"Indexed {indexed} profiles for full-text search")
+
+
+# 1: the schema as it was created from code before versioning; databases
+# that already have it only get the missing tables and derived data
+BASELINE = """
+CREATE TABLE IF NOT EXISTS users (
+    id INTEGER PRIMARY KEY,
+    name TEXT,
+    username TEXT,
+    phone_number TEXT,
+    email TEXT,
+    skills TEXT,
+    preferences TEXT,
+    portfolio TEXT,
+    about_user TEXT,
+    vip_until TEXT
+);
+
+CREATE TABLE IF NOT EXISTS summary_cache (
+    key TEXT PRIMARY KEY,
+    summary TEXT NOT NULL,
+    created_at REAL NOT NULL,
+    last_used_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_summary_cache_last_used ON summary_cache(last_used_at);
+
+CREATE TABLE IF NOT EXISTS projects (
+    id INTEGER PRIMARY KEY,
+    user_id INTEGER NOT NULL,
+    created_at REAL NOT NULL,
+    text TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_projects_user ON projects(user_id, id);
+
+CREATE TABLE IF NOT EXISTS payments (
+    charge_id TEXT PRIMARY KEY,
+    user_id INTEGER NOT NULL,
+    item_id TEXT NOT NULL,
+    amount INTEGER NOT NULL,
+    created_at REAL NOT NULL,
+    refunded_at REAL
+);
+CREATE INDEX IF NOT EXISTS idx_payments_user ON payments(user_id);
+
+CREATE TABLE IF NOT EXISTS item_totals (
+    item_id TEXT PRIMARY KEY,
+    purchases INTEGER NOT NULL DEFAULT 0,
+    refunds INTEGER NOT NULL DEFAULT 0,
+    revenue INTEGER NOT NULL DEFAULT 0,
+    refunded_amount INTEGER NOT NULL DEFAULT 0
+);
+
+CREATE TABLE IF NOT EXISTS user_totals (
+    user_id INTEGER PRIMARY KEY,
+    purchases INTEGER NOT NULL DEFAULT 0,
+    refunds INTEGER NOT NULL DEFAULT 0,
+    spent INTEGER NOT NULL DEFAULT 0,
+    refunded INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS idx_user_totals_spent ON user_totals(spent);
+
+-- ConversationHandler states, one row per handler and conversation key
+CREATE TABLE IF NOT EXISTS conversations (
+    name TEXT NOT NULL,
+    key TEXT NOT NULL,
+    state TEXT NOT NULL,
+    updated_at REAL NOT NULL,
+    PRIMARY KEY (name, key)
+);
+
+-- user_data / chat_data / bot_data as JSON, kind is 'user', 'chat' or 'bot'
+CREATE TABLE IF NOT EXISTS persisted_data (
+    kind TEXT NOT NULL,
+    id INTEGER NOT NULL,
+    data TEXT NOT NULL,
+    updated_at REAL NOT NULL,
+    PRIMARY KEY (kind, id)
+);
+
+-- Canonical skills (see skills.py) and the ones each user has
+CREATE TABLE IF NOT EXISTS skills (
+    id INTEGER PRIMARY KEY,
+    name TEXT NOT NULL UNIQUE
+);
+
+CREATE TABLE IF NOT EXISTS user_skills (
+    user_id INTEGER NOT NULL,
+    skill_id INTEGER NOT NULL,
+    PRIMARY KEY (user_id, skill_id)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS idx_user_skills_skill ON user_skills(skill_id);
+
+-- Precomputed teammate suggestions (see recommender.py), JSON [[user_id, score], ...]
+CREATE TABLE IF NOT EXISTS recommendations (
+    user_id INTEGER PRIMARY KEY,
+    candidates TEXT NOT NULL,
+    computed_at REAL NOT NULL
+);
+
+-- VIP expiry reminders page through upcoming vip_until values
+CREATE INDEX IF NOT EXISTS idx_users_vip_until ON users(vip_until);
+
+-- Delivered notifications (see notifications.py); key tells repeats apart,
+-- e.g. the vip_until a reminder was for or the user a match alert was about
+CREATE TABLE IF NOT EXISTS notifications_sent (
+    kind TEXT NOT NULL,
+    user_id INTEGER NOT NULL,
+    key TEXT NOT NULL,
+    status TEXT NOT NULL,
+    sent_at REAL NOT NULL,
+    PRIMARY KEY (kind, user_id, key)
+) WITHOUT ROWID;
+
+-- Latest /find_team skills per user, for new-match alerts
+CREATE TABLE IF NOT EXISTS saved_searches (
+    user_id INTEGER PRIMARY KEY,
+    min_match INTEGER NOT NULL,
+    created_at REAL NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS saved_search_skills (
+    skill_id INTEGER NOT NULL,
+    user_id INTEGER NOT NULL,
+    PRIMARY KEY (skill_id, user_id)
+) WITHOUT ROWID;
+
+-- Users whose skills changed since the last new-match alert run
+CREATE TABLE IF NOT EXISTS profile_events (
+    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+    user_id INTEGER NOT NULL,
+    created_at REAL NOT NULL
+);
+
+-- Full-text search over profiles, rowid = users.id, kept in sync by triggers
+CREATE VIRTUAL TABLE IF NOT EXISTS profile_search USING fts5(
+    skills, preferences, about_user, portfolio,
+    tokenize = "unicode61 tokenchars '+#.'"
+);
+
+CREATE TRIGGER IF NOT EXISTS users_search_insert AFTER INSERT ON users BEGIN
+    INSERT INTO profile_search (rowid, skills, preferences, about_user, portfolio)
+    VALUES (new.id, new.skills, new.preferences, new.about_user,
+            (SELECT group_concat(text, ' ') FROM projects WHERE user_id = new.id));
+END;
+
+CREATE TRIGGER IF NOT EXISTS users_search_update AFTER UPDATE OF skills, preferences, about_user ON users BEGIN
+    UPDATE profile_search SET skills = new.skills, preferences = new.preferences, about_user = new.about_user
+    WHERE rowid = new.id;
+END;
+
+CREATE TRIGGER IF NOT EXISTS users_search_delete AFTER DELETE ON users BEGIN
+    DELETE FROM profile_search WHERE rowid = old.id;
+END;
+
+CREATE TRIGGER IF NOT EXISTS projects_search_insert AFTER INSERT ON projects BEGIN
+    UPDATE profile_search SET portfolio = (SELECT group_concat(text, ' ') FROM projects WHERE user_id = new.user_id)
+    WHERE rowid = new.user_id;
+END;
+
+CREATE TRIGGER IF NOT EXISTS projects_search_delete AFTER DELETE ON projects BEGIN
+    UPDATE profile_search SET portfolio = (SELECT group_concat(text, ' ') FROM projects WHERE user_id = old.user_id)
+    WHERE rowid = old.user_id;
+END;
+"""
+
+
+def baseline(conn: sqlite3.Connection) -> None:
+    execute_script(conn, BASELINE)
+    # Index first so the migrated projects reach it through the triggers
+    build_search_index(conn)
+    migrate_portfolios(conn)
+    if not conn.execute("SELECT 1 FROM user_skills LIMIT 1").fetchone():
+        indexed = skills.rebuild_user_skills(conn)
+        if indexed:
+            logger.info(f"Derived canonical skills of {indexed} users")
+
+
+# 2: idx_users_id duplicates the primary key, idx_users_skills covers a free
+# text list no query can seek on and idx_users_username is never queried;
+# saved searches are replaced by user id
+def index_query_paths(conn: sqlite3.Connection) -> None:
+    execute_script(conn, """
+DROP INDEX IF EXISTS idx_users_id;
+DROP INDEX IF EXISTS idx_users_skills;
+DROP INDEX IF EXISTS idx_users_username;
+CREATE INDEX IF NOT EXISTS idx_saved_search_skills_user ON saved_search_skills(user_id);
+""")
+
+
+def iso_to_epoch(value: Any) -> Optional[int]:
+    """A stored ISO ``vip_until`` (local time) as Unix seconds."""
+    if value is None or isinstance(value, int):
+        return value
+    try:
+        return int(datetime.fromisoformat(value).timestamp())
+    except ValueError:
+        logger.warning(f"Dropping unreadable vip_until {value!r}")
+        return None
+
+
+# 3: vip_until becomes INTEGER Unix seconds. SQLite cannot change a column
+# type in place, so users is rebuilt and its index and triggers recreated.
+def vip_until_epoch(conn: sqlite3.Connection) -> None:
+    conn.create_function("iso_to_epoch", 1, iso_to_epoch, deterministic=True)
+    execute_script(conn, """
+CREATE TABLE users_new (
+    id INTEGER PRIMARY KEY,
+    name TEXT,
+    username TEXT,
+    phone_number TEXT,
+    email TEXT,
+    skills TEXT,
+    preferences TEXT,
+    portfolio TEXT,
+    about_user TEXT,
+    vip_until INTEGER
+);
+INSERT INTO users_new (id, name, username, phone_number, email, skills, preferences, portfolio, about_user, vip_until)
+SELECT id, name, username, phone_number, email, skills, preferences, portfolio, about_user, iso_to_epoch(vip_until)
+FROM users;
+DROP TABLE users;
+ALTER TABLE users_new RENAME TO users;
+
+CREATE INDEX idx_users_vip_until ON users(vip_until);
+
+CREATE TRIGGER users_search_insert AFTER INSERT ON users BEGIN
+    INSERT INTO profile_search (rowid, skills, preferences, about_user, portfolio)
+    VALUES (new.id, new.skills, new.preferences, new.about_user,
+            (SELECT group_concat(text, ' ') FROM projects WHERE user_id = new.id));
+END;
+
+CREATE TRIGGER users_search_update AFTER UPDATE OF skills, preferences, about_user ON users BEGIN
+    UPDATE profile_search SET skills = new.skills, preferences = new.preferences, about_user = new.about_user
+    WHERE rowid = new.id;
+END;
+
+CREATE TRIGGER users_search_delete AFTER DELETE ON users BEGIN
+    DELETE FROM profile_search WHERE rowid = old.id;
+END;
+
+-- Reminder keys are the vip_until they were sent for
+UPDATE notifications_sent SET key = CAST(iso_to_epoch(key) AS TEXT) WHERE kind = 'vip_expiry';
+""")
+
+
+# 4: durable queue of payment fulfilments (see payments.py); only pending
+# jobs are indexed, finished ones are kept as a record
+def fulfilment_jobs(conn: sqlite3.Connection) -> None:
+    execute_script(conn, """
+CREATE TABLE fulfilment_jobs (
+    charge_id TEXT PRIMARY KEY,
+    user_id INTEGER NOT NULL,
+    chat_id INTEGER NOT NULL,
+    item_id TEXT NOT NULL,
+    status TEXT NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    next_attempt_at REAL NOT NULL,
+    created_at REAL NOT NULL,
+    done_at REAL
+) WITHOUT ROWID;
+
+CREATE INDEX idx_fulfilment_jobs_due ON fulfilment_jobs(next_attempt_at) WHERE status = 'pending';
+""")
+
+
+# 5: purchased feature credits (see credits.py)
+def user_credits(conn: sqlite3.Connection) -> None:
+    execute_script(conn, """
+CREATE TABLE user_credits (
+    user_id INTEGER NOT NULL,
+    feature TEXT NOT NULL,
+    balance INTEGER NOT NULL CHECK (balance >= 0),
+    PRIMARY KEY (user_id, feature)
+) WITHOUT ROWID;
+""")
+
+
+# 6: top buyers are ranked by what they spent net of refunds
+def net_spent_index(conn: sqlite3.Connection) -> None:
+    execute_script(conn, """
+DROP INDEX IF EXISTS idx_user_totals_spent;
+CREATE INDEX idx_user_totals_net ON user_totals(spent - refunded);
+""")
+
+
+MIGRATIONS: Tuple[Migration, ...] = (
+    Migration(1, "baseline schema", baseline, (
+        Plan("SELECT id, text FROM projects WHERE user_id = ? AND id > ? ORDER BY id LIMIT ?", (1, 0, 50),
+             "idx_projects_user"),
+        Plan("SELECT user_id FROM user_skills WHERE skill_id = ?", (1,), "idx_user_skills_skill"),
+        Plan("SELECT skill_id FROM user_skills WHERE user_id = ?", (1,), "PRIMARY KEY"),
+        Plan("SELECT charge_id FROM payments WHERE user_id = ?", (1,), "idx_payments_user"),
+        Plan("SELECT key FROM summary_cache ORDER BY last_used_at LIMIT ?", (10,), "idx_summary_cache_last_used"),
+        Plan("SELECT key, state FROM conversations WHERE name = ?", ("find_team",), "sqlite_autoindex_conversations_1"),
+        Plan("SELECT id, data FROM persisted_data WHERE kind = ?", ("user",), "sqlite_autoindex_persisted_data_1"),
+        Plan("SELECT 1 FROM notifications_sent WHERE kind = ? AND user_id = ? AND key = ?", ("x", 1, "k"),
+             "PRIMARY KEY"),
+    )),
+    Migration(2, "drop redundant users indexes, index saved searches by user", index_query_paths, (
+        Plan("SELECT name, username, skills FROM users WHERE id = ?", (1,), "INTEGER PRIMARY KEY"),
+        Plan("SELECT skill_id FROM saved_search_skills WHERE user_id = ?", (1,), "idx_saved_search_skills_user"),
+        Plan("SELECT user_id FROM saved_search_skills WHERE skill_id = ?", (1,), "PRIMARY KEY"),
+    )),
+    Migration(3, "store vip_until as Unix seconds", vip_until_epoch, (
+        Plan("SELECT id, vip_until FROM users WHERE vip_until > ? AND vip_until <= ? AND (vip_until, id) > (?, ?) "
+             "ORDER BY vip_until, id LIMIT ?", (0, 1, 0, 0, 500), "idx_users_vip_until"),
+        Plan("SELECT count(*) FROM users WHERE vip_until > ?", (0,), "idx_users_vip_until"),
+    )),
+    Migration(4, "payment fulfilment queue", fulfilment_jobs, (
+        Plan("SELECT charge_id, user_id, chat_id, item_id, attempts FROM fulfilment_jobs "
+             "WHERE status = 'pending' AND next_attempt_at <= ? ORDER BY next_attempt_at LIMIT ?", (0, 50),
+             "idx_fulfilment_jobs_due"),
+        Plan("UPDATE fulfilment_jobs SET attempts = attempts + 1 WHERE charge_id = ?", ("x",), "PRIMARY KEY"),
+    )),
+    Migration(5, "purchased feature credits", user_credits, (
+        Plan("UPDATE user_credits SET balance = balance - 1 WHERE user_id = ? AND feature = ? AND balance > 0",
+             (1, "find_team"), "PRIMARY KEY"),
+    )),
+    Migration(6, "rank top buyers by net spend", net_spent_index, (
+        Plan("SELECT user_id FROM user_totals ORDER BY spent - refunded DESC LIMIT ?", (5,), "idx_user_totals_net"),
+    )),
+)
+
+LATEST_VERSION = MIGRATIONS[-1].version
+
+
+def current_version(conn: sqlite3.Connection) -> int:
+    return conn.execute("PRAGMA user_version").fetchone()[0]
+
+
+def migrate(conn: sqlite3.Connection) -> int:
+    """Apply every pending migration in order; returns the resulting version."""
+    for migration in MIGRATIONS:
+        if current_version(conn) >= migration.version:
+            continue
+        start = time.perf_counter()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            # Another process may have migrated while we waited for the lock
+            if current_version(conn) >= migration.version:
+                conn.rollback()
+                continue
+            migration.apply(conn)
+            conn.execute(f"PRAGMA user_version = {migration.version}")
+            conn.commit()
+        except BaseException:
+            conn.rollback()
+            raise
+        logger.info(f"Applied migration {migration.version} ({migration.description}) "
+                    f"in {time.perf_counter() - start:.2f} s")
+    for problem in check_plans(conn):
+        logger.warning(problem)
+    return current_version(conn)
+
+
+def check_plans(conn: sqlite3.Connection) -> List[str]:
+    """EXPLAIN every query of the applied migrations; returns the ones missing their index."""
+    version = current_version(conn)
+    # A cached EXPLAIN statement is not re-prepared after the schema changes, so
+    # the schema cookie goes into the SQL text to keep sqlite3's cache from reusing it
+    schema = conn.execute("PRAGMA schema_version").fetchone()[0]
+    problems = []
+    for migration in MIGRATIONS:
+        if migration.version > version:
+            break
+        for plan in migration.plans:
+            details = [row[3] for row in conn.execute(f"EXPLAIN QUERY PLAN /* schema {schema} */ {plan.sql}", plan.params)]
+            if not any(plan.uses in detail for detail in details):
+                problems.append(f"Migration {migration.version}: {plan.sql!r} does not use {plan.uses}: {details}")
+    return problems
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--db", default=None, help="database file (default: TEAMFINDER_DB or teamfinder.db)")
+    args = parser.parse_args()
+    logging.basicConfig(format="%(asctime)s - %(levelname)s - %(message)s", level=logging.INFO)
+
+    import db
+
+    conn = sqlite3.connect(args.db or db.DB_FILE)
+    version = migrate(conn)
+    problems = check_plans(conn)
+    conn.close()
+    print(f"schema version {version} of {LATEST_VERSION}, {len(problems)} plan problems")
+    for problem in problems:
+        print(problem)
+    sys.exit(1 if problems else 0)
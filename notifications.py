@@ -0,0 +1,252 @@
+"""Scheduled notifications: VIP expiry reminders and new-match alerts.
+
+``Notifier.run`` is a JobQueue callback (registered in ``post_init``). Each
+run pages through due recipients with indexed queries, sends at most
+``concurrency`` messages at a time in the flood limiter's bulk lane and
+records each delivery in ``notifications_sent`` as soon as it is sent. A run
+that stops half way (restart, error) resumes where it left off on the next
+run; at most the messages in flight at the time are repeated. A recipient
+whose sends keep failing with transient errors is given up on after
+``max_attempts`` runs, so one bad chat cannot hold back the match alert queue.
+"""
+import asyncio
+import logging
+import os
+import sqlite3
+import time
+from collections import defaultdict
+from datetime import datetime, timedelta
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+from telegram import Bot
+from telegram.error import BadRequest, Forbidden
+from telegram.ext import CallbackContext
+
+import db
+from flood_limiter import BULK
+from vip_cache import parse_vip_until
+
+NOTIFY_INTERVAL = int(os.getenv("NOTIFY_INTERVAL", "300"))
+# Remind VIPs this many days before their subscription ends
+NOTIFY_VIP_DAYS = float(os.getenv("NOTIFY_VIP_DAYS", "3"))
+# Saved /find_team searches older than this get no more alerts
+NOTIFY_SEARCH_DAYS = float(os.getenv("NOTIFY_SEARCH_DAYS", "30"))
+# Recipients loaded per query and messages in flight at once
+NOTIFY_BATCH = int(os.getenv("NOTIFY_BATCH", "500"))
+NOTIFY_CONCURRENCY = int(os.getenv("NOTIFY_CONCURRENCY", "20"))
+# Runs a notification may be deferred by transient errors before it is dropped
+NOTIFY_MAX_ATTEMPTS = int(os.getenv("NOTIFY_MAX_ATTEMPTS", "5"))
+
+VIP_EXPIRY = 'vip_expiry'
+NEW_MATCH = 'new_match'
+
+# notifications_sent statuses
+SENT = 'sent'
+FAILED = 'failed'
+GAVE_UP = 'gave_up'
+
+# New matches listed in one alert
+MATCHES_PER_ALERT = 5
+
+logger = logging.getLogger(__name__)
+
+# (user_id, keys it covers in notifications_sent, text)
+Notification = Tuple[int, Sequence[str], str]
+
+
+def save_search(conn: sqlite3.Connection, user_id: int, skill_ids: Iterable[int]) -> None:
+    """Remember a user's latest /find_team skills; new users with at least half of them trigger an alert."""
+    skill_ids = set(skill_ids)
+    conn.execute("DELETE FROM saved_search_skills WHERE user_id = ?", (user_id,))
+    if not skill_ids:
+        conn.execute("DELETE FROM saved_searches WHERE user_id = ?", (user_id,))
+        return
+    conn.execute(
+        "INSERT INTO saved_searches (user_id, min_match, created_at) VALUES (?, ?, ?) "
+        "ON CONFLICT(user_id) DO UPDATE SET min_match = excluded.min_match, created_at = excluded.created_at",
+        (user_id, (len(skill_ids) + 1) // 2, time.time()),
+    )
+    conn.executemany(
+        "INSERT INTO saved_search_skills (skill_id, user_id) VALUES (?, ?)",
+        ((skill_id, user_id) for skill_id in skill_ids),
+    )
+
+
+def record_profile_change(conn: sqlite3.Connection, user_id: int) -> None:
+    """Queue a user whose skills changed for the next match alert run."""
+    conn.execute("INSERT INTO profile_events (user_id, created_at) VALUES (?, ?)", (user_id, time.time()))
+
+
+def due_vip_reminders(now: datetime, after: Tuple[int, int], limit: int) -> List[Tuple[int, int]]:
+    """VIPs expiring within NOTIFY_VIP_DAYS and not yet reminded, keyset-paged by (vip_until, id)."""
+    return db.fetchall(
+        "SELECT id, vip_until FROM users "
+        "WHERE vip_until > ? AND vip_until <= ? AND (vip_until, id) > (?, ?) "
+        "AND NOT EXISTS (SELECT 1 FROM notifications_sent n WHERE n.kind = ? AND n.user_id = users.id AND n.key = CAST(users.vip_until AS TEXT)) "
+        "ORDER BY vip_until, id LIMIT ?",
+        (int(now.timestamp()), int((now + timedelta(days=NOTIFY_VIP_DAYS)).timestamp()), after[0], after[1], VIP_EXPIRY, limit),
+    )
+
+
+def pending_matches(limit: int) -> Tuple[Optional[int], Dict[int, List[int]]]:
+    """New matches for saved searches from the oldest ``limit`` profile events.
+
+    Returns the last event consumed (None when there are none) and, per
+    searcher, the users they have not been alerted about yet.
+    """
+    last = db.fetchone("SELECT max(seq) FROM (SELECT seq FROM profile_events ORDER BY seq LIMIT ?)", (limit,))[0]
+    if last is None:
+        return None, {}
+    rows = db.fetchall(
+        "SELECT s.user_id, e.user_id FROM (SELECT DISTINCT user_id FROM profile_events WHERE seq <= ?) e "
+        "JOIN user_skills us ON us.user_id = e.user_id "
+        "JOIN saved_search_skills ss ON ss.skill_id = us.skill_id "
+        "JOIN saved_searches s ON s.user_id = ss.user_id "
+        "WHERE s.user_id != e.user_id AND s.created_at >= ? "
+        "AND NOT EXISTS (SELECT 1 FROM notifications_sent n WHERE n.kind = ? AND n.user_id = s.user_id AND n.key = CAST(e.user_id AS TEXT)) "
+        "GROUP BY s.user_id, e.user_id HAVING count(*) >= s.min_match "
+        "ORDER BY s.user_id, e.user_id",
+        (last, time.time() - NOTIFY_SEARCH_DAYS * 86400, NEW_MATCH),
+    )
+    matches: Dict[int, List[int]] = defaultdict(list)
+    for searcher_id, other_id in rows:
+        matches[searcher_id].append(other_id)
+    return last, matches
+
+
+def record_sent(kind: str, rows: Iterable[Tuple[int, str, str]]) -> None:
+    """Log (user_id, key, status) deliveries so they are never repeated."""
+    now = time.time()
+    with db.transaction() as conn:
+        conn.executemany(
+            "INSERT OR IGNORE INTO notifications_sent (kind, user_id, key, status, sent_at) VALUES (?, ?, ?, ?, ?)",
+            ((kind, user_id, key, status, now) for user_id, key, status in rows),
+        )
+
+
+def consume_profile_events(last: int) -> None:
+    db.execute("DELETE FROM profile_events WHERE seq <= ?", (last,))
+
+
+class Notifier:
+    """Runs the notification jobs.
+
+    ``describe(user_ids)`` renders the users of a match alert (blocking; it
+    runs on the DB thread pool).
+    """
+
+    def __init__(
+        self,
+        describe: Callable[[List[int]], str],
+        batch: int = NOTIFY_BATCH,
+        concurrency: int = NOTIFY_CONCURRENCY,
+        max_attempts: int = NOTIFY_MAX_ATTEMPTS,
+    ) -> None:
+        self.describe = describe
+        self.batch = batch
+        self.concurrency = concurrency
+        self.max_attempts = max_attempts
+        # (kind, user_id) -> runs that deferred the notification so far
+        self._attempts: Dict[Tuple[str, int], int] = {}
+        self.runs = 0
+        self.sent = 0
+        self.failed = 0
+        self.deferred = 0
+        self.gave_up = 0
+        self.last_run_seconds = 0.0
+
+    def stats(self) -> Dict[str, float]:
+        return {
+            'runs': self.runs,
+            'sent': self.sent,
+            'failed': self.failed,
+            'deferred': self.deferred,
+            'gave_up': self.gave_up,
+            'last_run_seconds': self.last_run_seconds,
+        }
+
+    async def run(self, context: CallbackContext) -> None:
+        """JobQueue callback: send every due notification."""
+        start = time.perf_counter()
+        try:
+            await self.send_vip_reminders(context.bot)
+            await self.send_match_alerts(context.bot)
+        finally:
+            self.runs += 1
+            self.last_run_seconds = time.perf_counter() - start
+
+    async def send_vip_reminders(self, bot: Bot) -> None:
+        now = datetime.now()
+        after: Tuple[int, int] = (0, 0)
+        while True:
+            rows = await db.run(due_vip_reminders, now, after, self.batch)
+            if not rows:
+                return
+            after = rows[-1][1], rows[-1][0]
+            notifications = [
+                (user_id, (str(vip_until),),
+                 f"⏳ Your VIP status ends on {parse_vip_until(vip_until).strftime('%Y-%m-%d')}.\n"
+                 "Renew it in /shop to keep using /about_me and /find_team for free.")
+                for user_id, vip_until in rows
+            ]
+            # Deferred reminders are not recorded, so the next run retries them
+            await self._fan_out(bot, VIP_EXPIRY, notifications)
+
+    async def send_match_alerts(self, bot: Bot) -> None:
+        while True:
+            last, matches = await db.run(pending_matches, self.batch)
+            if last is None:
+                return
+            notifications = []
+            for searcher_id, other_ids in matches.items():
+                listed = await db.run(self.describe, other_ids[:MATCHES_PER_ALERT])
+                who = "new person matches" if len(other_ids) == 1 else "new people match"
+                text = f"🆕 {len(other_ids)} {who} your last /find_team search:\n\n{listed}"
+                if len(other_ids) > MATCHES_PER_ALERT:
+                    text += f"...and {len(other_ids) - MATCHES_PER_ALERT} more. Use /find_team to see them all."
+                notifications.append((searcher_id, [str(other_id) for other_id in other_ids], text))
+            deferred = 0
+            for start in range(0, len(notifications), self.batch):
+                deferred += await self._fan_out(bot, NEW_MATCH, notifications[start:start + self.batch])
+            if deferred:
+                # Keep the events for the next run; delivered alerts are not repeated
+                return
+            await db.run(consume_profile_events, last)
+
+    async def _fan_out(self, bot: Bot, kind: str, notifications: List[Notification]) -> int:
+        """Send ``notifications`` with bounded concurrency; returns how many were deferred."""
+        semaphore = asyncio.Semaphore(self.concurrency)
+
+        async def deliver(notification: Notification) -> Optional[str]:
+            user_id, keys, text = notification
+            async with semaphore:
+                try:
+                    await bot.send_message(user_id, text, rate_limit_args=BULK)
+                    status = SENT
+                except (Forbidden, BadRequest) as e:
+                    # Blocked the bot or chat gone: retrying will not help
+                    logger.info(f"{kind} notification to {user_id} failed: {e}")
+                    status = FAILED
+                except Exception as e:
+                    attempts = self._attempts.get((kind, user_id), 0) + 1
+                    if attempts < self.max_attempts:
+                        logger.warning(f"{kind} notification to {user_id} deferred: {e}")
+                        self._attempts[kind, user_id] = attempts
+                        return None
+                    logger.error(f"Giving up {kind} notification to {user_id} after {attempts} attempts: {e}")
+                    status = GAVE_UP
+                self._attempts.pop((kind, user_id), None)
+                # Recorded right away, so a crash later in the batch does not repeat it
+                try:
+                    await db.run(record_sent, kind, [(user_id, key, status) for key in keys])
+                except Exception as e:
+                    logger.error(f"Could not record {kind} notification to {user_id}: {e}")
+                return status
+
+        statuses = await asyncio.gather(*(deliver(notification) for notification in notifications))
+        deferred = statuses.count(None)
+        self.sent += statuses.count(SENT)
+        self.failed += statuses.count(FAILED)
+        self.gave_up += statuses.count(GAVE_UP)
+        self.deferred += deferred
+        return deferred
@@ -0,0 +1,307 @@
+"""Exactly-once payment processing with a durable fulfilment queue.
+
+``record_payment`` stores a ``telegram_payment_charge_id`` in the ledger, applies
+the entitlement it buys (a VIP extension or a feature credit) and enqueues a
+fulfilment job, all in one transaction. A charge that is already recorded changes nothing, so
+Telegram re-delivering the update (or two copies racing each other) grants
+the benefit once.
+
+``FulfilmentQueue`` then does the slow part (thank-you messages, the AI
+summary) off the update path. Jobs stay in ``fulfilment_jobs`` until they
+succeed, so a restart resumes them; failed attempts are retried with
+exponential backoff; an item in ``credits.FALLBACK_CREDITS`` whose fulfilment
+gives up leaves the buyer a credit instead. Messages are sent at least once: a
+crash between sending and marking the job done repeats the message, never the
+entitlement.
+
+A refund first takes back what the payment granted (``revoke_payment``), so
+it cannot be used while Telegram processes the refund, and gives it back
+(``restore_payment``) if the refund does not go through. A credit that was
+already spent makes the payment non-refundable.
+"""
+import asyncio
+import logging
+import os
+import sqlite3
+import time
+from typing import Awaitable, Callable, Dict, List, NamedTuple, Optional
+
+from telegram import Bot
+from telegram.error import Forbidden
+
+import credits
+import db
+import ledger
+
+FULFIL_CONCURRENCY = int(os.getenv("FULFIL_CONCURRENCY", "50"))
+FULFIL_MAX_ATTEMPTS = int(os.getenv("FULFIL_MAX_ATTEMPTS", "5"))
+# First retry after this many seconds, doubling per attempt
+FULFIL_RETRY_SECONDS = float(os.getenv("FULFIL_RETRY_SECONDS", "30"))
+# Due retries are looked for at least this often
+FULFIL_POLL_SECONDS = 5.0
+
+VIP_ITEM = 'vip'
+VIP_DAYS = 30
+
+PENDING = 'pending'
+DONE = 'done'
+FAILED = 'failed'
+
+logger = logging.getLogger(__name__)
+
+
+class RefundRefused(Exception):
+    """The payment cannot be refunded; the message is meant for the buyer."""
+
+
+class Revocation(NamedTuple):
+    """What ``revoke_payment`` took back: seconds of VIP and/or a feature credit."""
+    item_id: str
+    vip_seconds: int = 0
+    credit: Optional[str] = None
+
+
+class Job(NamedTuple):
+    charge_id: str
+    user_id: int
+    chat_id: int
+    item_id: str
+    attempts: int
+
+
+Handler = Callable[[Bot, Job], Awaitable[None]]
+
+
+def extend_vip(conn: sqlite3.Connection, user_id: int, days: float, now: float) -> None:
+    """Add ``days`` to an active subscription, or start one at ``now``."""
+    conn.execute(
+        "UPDATE users SET vip_until = max(coalesce(vip_until, 0), ?) + ? WHERE id = ?",
+        (int(now), int(days * 86400), user_id),
+    )
+
+
+def record_payment(charge_id: str, user_id: int, chat_id: int, item_id: str, amount: int) -> bool:
+    """Record a payment, grant it and queue its fulfilment; False if the charge was seen before."""
+    now = time.time()
+    with db.transaction() as conn:
+        if not ledger.record_purchase(charge_id, user_id, item_id, amount, conn):
+            return False
+        if item_id == VIP_ITEM:
+            extend_vip(conn, user_id, VIP_DAYS, now)
+        if item_id in credits.CREDIT_ITEMS:
+            credits.grant(conn, user_id, credits.CREDIT_ITEMS[item_id])
+        conn.execute(
+            "INSERT INTO fulfilment_jobs (charge_id, user_id, chat_id, item_id, status, next_attempt_at, created_at) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (charge_id, user_id, chat_id, item_id, PENDING, now, now),
+        )
+    credits.cache.invalidate(user_id)
+    return True
+
+
+def revoke_payment(charge_id: str, user_id: int) -> Revocation:
+    """Take back what a payment granted ahead of refunding it; raises RefundRefused if that is impossible.
+
+    Charges the ledger does not know (paid before it existed) revoke nothing.
+    """
+    with db.transaction() as conn:
+        row = conn.execute(
+            "SELECT p.item_id, p.refunded_at, j.status FROM payments p "
+            "LEFT JOIN fulfilment_jobs j ON j.charge_id = p.charge_id WHERE p.charge_id = ? AND p.user_id = ?",
+            (charge_id, user_id),
+        ).fetchone()
+        if row is None:
+            return Revocation('unknown')
+        item_id, refunded_at, status = row
+        if refunded_at is not None:
+            raise RefundRefused("This payment has already been refunded.")
+        if status == PENDING and item_id in credits.FALLBACK_CREDITS:
+            # Its fulfilment may still deliver the item or leave a credit
+            raise RefundRefused("This payment is still being fulfilled; please try again later.")
+        feature = credits.CREDIT_ITEMS.get(item_id)
+        if feature is None and status == FAILED:
+            # fail_job left a credit in place of the purchase
+            feature = credits.FALLBACK_CREDITS.get(item_id)
+        if feature is not None and credits.spend(conn, user_id, feature) is None:
+            raise RefundRefused("What this payment bought has already been used, so it cannot be refunded.")
+        vip_seconds = 0
+        if item_id == VIP_ITEM:
+            vip_seconds = VIP_DAYS * 86400
+            conn.execute(
+                "UPDATE users SET vip_until = vip_until - ? WHERE id = ? AND vip_until IS NOT NULL",
+                (vip_seconds, user_id),
+            )
+    if feature is not None:
+        credits.cache.invalidate(user_id)
+    return Revocation(item_id, vip_seconds, feature)
+
+
+def restore_payment(user_id: int, revocation: Revocation) -> None:
+    """Give back what ``revoke_payment`` took when the refund did not happen."""
+    with db.transaction() as conn:
+        if revocation.vip_seconds:
+            conn.execute(
+                "UPDATE users SET vip_until = vip_until + ? WHERE id = ? AND vip_until IS NOT NULL",
+                (revocation.vip_seconds, user_id),
+            )
+        if revocation.credit is not None:
+            credits.grant(conn, user_id, revocation.credit)
+    if revocation.credit is not None:
+        credits.cache.invalidate(user_id)
+
+
+def due_jobs(now: float, limit: int) -> List[Job]:
+    rows = db.fetchall(
+        "SELECT charge_id, user_id, chat_id, item_id, attempts FROM fulfilment_jobs "
+        "WHERE status = 'pending' AND next_attempt_at <= ? ORDER BY next_attempt_at LIMIT ?",
+        (now, limit),
+    )
+    return [Job(*row) for row in rows]
+
+
+def finish_job(charge_id: str, status: str) -> None:
+    db.execute(
+        "UPDATE fulfilment_jobs SET status = ?, attempts = attempts + 1, done_at = ? WHERE charge_id = ?",
+        (status, time.time(), charge_id),
+    )
+
+
+def fail_job(job: Job) -> None:
+    """Give up on a job, granting its fallback credit in the same transaction."""
+    feature = credits.FALLBACK_CREDITS.get(job.item_id)
+    with db.transaction() as conn:
+        failed = conn.execute(
+            "UPDATE fulfilment_jobs SET status = ?, attempts = attempts + 1, done_at = ? "
+            "WHERE charge_id = ? AND status = ?",
+            (FAILED, time.time(), job.charge_id, PENDING),
+        ).rowcount
+        if failed and feature is not None:
+            credits.grant(conn, job.user_id, feature)
+    if failed and feature is not None:
+        credits.cache.invalidate(job.user_id)
+        logger.info(f"Granted user {job.user_id} a {feature} credit for unfulfilled {job.charge_id}")
+
+
+def retry_job(charge_id: str, next_attempt_at: float) -> None:
+    db.execute(
+        "UPDATE fulfilment_jobs SET attempts = attempts + 1, next_attempt_at = ? WHERE charge_id = ?",
+        (next_attempt_at, charge_id),
+    )
+
+
+class FulfilmentQueue:
+    """Runs pending fulfilment jobs with bounded concurrency.
+
+    ``handlers`` maps an item id to the coroutine that fulfils it; ``default``
+    handles every other item. A handler that raises is retried later, except
+    for ``Forbidden`` (the user blocked the bot).
+    """
+
+    def __init__(
+        self,
+        handlers: Dict[str, Handler],
+        default: Handler,
+        concurrency: int = FULFIL_CONCURRENCY,
+        max_attempts: int = FULFIL_MAX_ATTEMPTS,
+        retry_seconds: float = FULFIL_RETRY_SECONDS,
+    ) -> None:
+        self.handlers = handlers
+        self.default = default
+        self.concurrency = concurrency
+        self.max_attempts = max_attempts
+        self.retry_seconds = retry_seconds
+        self._running: Dict[str, asyncio.Task] = {}
+        self._wake: Optional[asyncio.Event] = None
+        self._idle: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+        self.fulfilled = 0
+        self.retried = 0
+        self.failed = 0
+
+    def stats(self) -> Dict[str, float]:
+        return {
+            'fulfilled': self.fulfilled,
+            'retried': self.retried,
+            'failed': self.failed,
+            'running': len(self._running),
+        }
+
+    def start(self, bot: Bot) -> asyncio.Task:
+        """Start working through the queue on the running event loop."""
+        if self._task is None or self._task.done():
+            self._wake = asyncio.Event()
+            self._idle = asyncio.Event()
+            self._task = asyncio.get_running_loop().create_task(self._run(bot))
+        return self._task
+
+    def notify(self) -> None:
+        """Wake the queue after a payment was recorded."""
+        if self._wake is not None:
+            self._idle.clear()
+            self._wake.set()
+
+    async def wait_idle(self) -> None:
+        """Wait until no job is due or running (retries scheduled later do not count)."""
+        if self._idle is not None:
+            await self._idle.wait()
+
+    async def close(self) -> None:
+        """Stop; interrupted jobs stay pending and run again after a restart."""
+        if self._task is None:
+            return
+        self._task.cancel()
+        tasks = [self._task, *self._running.values()]
+        for task in self._running.values():
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._task = None
+        self._running.clear()
+
+    async def _run(self, bot: Bot) -> None:
+        while True:
+            self._wake.clear()
+            free = self.concurrency - len(self._running)
+            if free > 0:
+                try:
+                    # Running jobs are still pending, so ask for enough to skip them
+                    jobs = await db.run(due_jobs, time.time(), free + len(self._running))
+                except Exception as e:
+                    logger.error(f"Could not load fulfilment jobs: {e}")
+                    jobs = []
+                for job in jobs:
+                    if job.charge_id not in self._running and len(self._running) < self.concurrency:
+                        self._running[job.charge_id] = asyncio.create_task(self._fulfil(bot, job))
+                if not self._running and len(jobs) < free and not self._wake.is_set():
+                    self._idle.set()
+            try:
+                await asyncio.wait_for(self._wake.wait(), FULFIL_POLL_SECONDS)
+            except asyncio.TimeoutError:
+                pass
+
+    async def _fulfil(self, bot: Bot, job: Job) -> None:
+        try:
+            try:
+                await self.handlers.get(job.item_id, self.default)(bot, job)
+            except Forbidden as e:
+                logger.warning(f"Fulfilment of {job.charge_id} for user {job.user_id} failed: {e}")
+                await db.run(fail_job, job)
+                self.failed += 1
+            except Exception as e:
+                if job.attempts + 1 >= self.max_attempts:
+                    logger.error(f"Giving up fulfilment of {job.charge_id} after {job.attempts + 1} attempts: {e}")
+                    await db.run(fail_job, job)
+                    self.failed += 1
+                else:
+                    delay = self.retry_seconds * 2 ** job.attempts
+                    logger.warning(f"Fulfilment of {job.charge_id} failed, retrying in {delay:.0f} s: {e}")
+                    await db.run(retry_job, job.charge_id, time.time() + delay)
+                    self.retried += 1
+            else:
+                await db.run(finish_job, job.charge_id, DONE)
+                self.fulfilled += 1
+        except Exception as e:
+            # The job stays pending and is picked up again by the next poll
+            logger.error(f"Could not update fulfilment job {job.charge_id}: {e}")
+        finally:
+            self._running.pop(job.charge_id, None)
+            self._wake.set()
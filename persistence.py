@@ -0,0 +1,206 @@
+"""SQLite-backed persistence for conversation states and user/chat/bot data.
+
+Everything is served from an in-memory copy. Changes handed over by the
+Application (every ``update_interval`` seconds, and on shutdown) are buffered
+and written in one transaction per batch. Each conversation key and each
+user/chat row is its own upserted row, so several bot processes can share one
+database without a global lock as long as updates of one chat are routed to
+one process at a time (e.g. by hashing the chat id); a process that takes over
+a chat after a restart or rebalance picks up its last persisted state.
+"""
+import asyncio
+import json
+import logging
+import os
+import threading
+import time
+from copy import deepcopy
+from typing import Any, Dict, Optional, Tuple
+
+from telegram.ext import BasePersistence, PersistenceInput
+from telegram.ext._utils.types import ConversationDict, ConversationKey
+
+import db
+
+PERSISTENCE_UPDATE_INTERVAL = float(os.getenv("PERSISTENCE_UPDATE_INTERVAL", "5"))
+# Wait this long before writing again after a failed batch
+PERSISTENCE_RETRY_SECONDS = 1.0
+
+logger = logging.getLogger(__name__)
+
+BOT_DATA_ID = 0
+
+
+class SQLitePersistence(BasePersistence):
+    """Stores ConversationHandler states and user/chat/bot data in SQLite."""
+
+    def __init__(self, update_interval: float = PERSISTENCE_UPDATE_INTERVAL) -> None:
+        super().__init__(store_data=PersistenceInput(callback_data=False), update_interval=update_interval)
+        self._conversations: Dict[str, ConversationDict] = {}
+        self._user_data: Optional[Dict[int, Dict[Any, Any]]] = None
+        self._chat_data: Optional[Dict[int, Dict[Any, Any]]] = None
+        self._bot_data: Optional[Dict[Any, Any]] = None
+        # Pending writes; a value of None means delete
+        self._dirty_conversations: Dict[Tuple[str, str], Optional[str]] = {}
+        self._dirty_data: Dict[Tuple[str, int], Optional[str]] = {}
+        self._lock = threading.Lock()
+        # Batches must reach the database in the order they were taken
+        self._flush_lock = threading.Lock()
+        self._flush_task: Optional[asyncio.Task] = None
+
+    # Loading
+
+    @staticmethod
+    def _load_data(kind: str) -> Dict[int, Dict[Any, Any]]:
+        rows = db.fetchall("SELECT id, data FROM persisted_data WHERE kind = ?", (kind,))
+        return {row_id: json.loads(data) for row_id, data in rows}
+
+    async def get_user_data(self) -> Dict[int, Dict[Any, Any]]:
+        if self._user_data is None:
+            self._user_data = await db.run(self._load_data, 'user')
+        return deepcopy(self._user_data)
+
+    async def get_chat_data(self) -> Dict[int, Dict[Any, Any]]:
+        if self._chat_data is None:
+            self._chat_data = await db.run(self._load_data, 'chat')
+        return deepcopy(self._chat_data)
+
+    async def get_bot_data(self) -> Dict[Any, Any]:
+        if self._bot_data is None:
+            self._bot_data = (await db.run(self._load_data, 'bot')).get(BOT_DATA_ID, {})
+        return deepcopy(self._bot_data)
+
+    async def get_callback_data(self) -> None:
+        return None
+
+    async def get_conversations(self, name: str) -> ConversationDict:
+        if name not in self._conversations:
+            rows = await db.run(db.fetchall, "SELECT key, state FROM conversations WHERE name = ?", (name,))
+            self._conversations[name] = {tuple(json.loads(key)): json.loads(state) for key, state in rows}
+        return dict(self._conversations[name])
+
+    # Updating
+
+    async def update_conversation(self, name: str, key: ConversationKey, new_state: Optional[object]) -> None:
+        conversations = self._conversations.setdefault(name, {})
+        if conversations.get(key) == new_state:
+            return
+        if new_state is None:
+            conversations.pop(key, None)
+        else:
+            conversations[key] = new_state
+        with self._lock:
+            self._dirty_conversations[(name, json.dumps(list(key)))] = (
+                None if new_state is None else json.dumps(new_state)
+            )
+        self._schedule_flush()
+
+    def _update_data(self, cache: Dict[int, Dict[Any, Any]], kind: str, row_id: int, data: Optional[Dict[Any, Any]]) -> None:
+        if data is None:
+            if cache.pop(row_id, None) is None:
+                return
+        else:
+            # Every user seen gets an empty dict; only store real data
+            if cache.get(row_id, {}) == data:
+                return
+            cache[row_id] = deepcopy(data)
+        with self._lock:
+            self._dirty_data[(kind, row_id)] = None if data is None else json.dumps(data)
+        self._schedule_flush()
+
+    async def update_user_data(self, user_id: int, data: Dict[Any, Any]) -> None:
+        self._update_data(self._user_data if self._user_data is not None else {}, 'user', user_id, data)
+
+    async def update_chat_data(self, chat_id: int, data: Dict[Any, Any]) -> None:
+        self._update_data(self._chat_data if self._chat_data is not None else {}, 'chat', chat_id, data)
+
+    async def update_bot_data(self, data: Dict[Any, Any]) -> None:
+        if self._bot_data == data:
+            return
+        self._bot_data = deepcopy(data)
+        with self._lock:
+            self._dirty_data[('bot', BOT_DATA_ID)] = json.dumps(data)
+        self._schedule_flush()
+
+    async def update_callback_data(self, data: Any) -> None:
+        pass
+
+    async def drop_user_data(self, user_id: int) -> None:
+        self._update_data(self._user_data if self._user_data is not None else {}, 'user', user_id, None)
+
+    async def drop_chat_data(self, chat_id: int) -> None:
+        self._update_data(self._chat_data if self._chat_data is not None else {}, 'chat', chat_id, None)
+
+    async def refresh_user_data(self, user_id: int, user_data: Dict[Any, Any]) -> None:
+        pass
+
+    async def refresh_chat_data(self, chat_id: int, chat_data: Dict[Any, Any]) -> None:
+        pass
+
+    async def refresh_bot_data(self, bot_data: Dict[Any, Any]) -> None:
+        pass
+
+    # Writing
+
+    def _schedule_flush(self) -> None:
+        # All update_* calls of one persistence run land in the same batch
+        if self._flush_task is None or self._flush_task.done():
+            self._flush_task = asyncio.get_running_loop().create_task(self._flush_in_background())
+
+    async def _flush_in_background(self) -> None:
+        # Changes made while a batch was being written (or put back by a failed
+        # one) found this task still running, so it writes them too
+        while True:
+            try:
+                await db.run(self._write_dirty)
+            except Exception as e:
+                logger.error(f"Persisting conversation state failed, will retry: {e}")
+                await asyncio.sleep(PERSISTENCE_RETRY_SECONDS)
+            with self._lock:
+                if not self._dirty_conversations and not self._dirty_data:
+                    return
+
+    def _write_dirty(self) -> None:
+        with self._flush_lock:
+            self._write_batch()
+
+    def _write_batch(self) -> None:
+        with self._lock:
+            conversations, self._dirty_conversations = self._dirty_conversations, {}
+            data, self._dirty_data = self._dirty_data, {}
+        if not conversations and not data:
+            return
+        now = time.time()
+        try:
+            with db.transaction() as conn:
+                conn.executemany(
+                    "INSERT INTO conversations (name, key, state, updated_at) VALUES (?, ?, ?, ?) "
+                    "ON CONFLICT(name, key) DO UPDATE SET state = excluded.state, updated_at = excluded.updated_at",
+                    [(name, key, state, now) for (name, key), state in conversations.items() if state is not None],
+                )
+                conn.executemany(
+                    "DELETE FROM conversations WHERE name = ? AND key = ?",
+                    [(name, key) for (name, key), state in conversations.items() if state is None],
+                )
+                conn.executemany(
+                    "INSERT INTO persisted_data (kind, id, data, updated_at) VALUES (?, ?, ?, ?) "
+                    "ON CONFLICT(kind, id) DO UPDATE SET data = excluded.data, updated_at = excluded.updated_at",
+                    [(kind, row_id, value, now) for (kind, row_id), value in data.items() if value is not None],
+                )
+                conn.executemany(
+                    "DELETE FROM persisted_data WHERE kind = ? AND id = ?",
+                    [(kind, row_id) for (kind, row_id), value in data.items() if value is None],
+                )
+        except Exception:
+            # Keep the batch, newer changes win
+            with self._lock:
+                self._dirty_conversations = {**conversations, **self._dirty_conversations}
+                self._dirty_data = {**data, **self._dirty_data}
+            raise
+
+    async def flush(self) -> None:
+        if self._flush_task is not None:
+            # It may be retrying a failing database; the final write below takes over
+            self._flush_task.cancel()
+            await asyncio.gather(self._flush_task, return_exceptions=True)
+        await db.run(self._write_dirty)
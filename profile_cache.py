@@ -0,0 +1,144 @@
+"""LRU cache of rendered /profile messages with field-level updates."""
+import os
+import sys
+import threading
+from collections import OrderedDict
+from datetime import datetime
+from typing import Any, Callable, Dict, Optional
+
+PROFILE_CACHE_MAX_ENTRIES = int(os.getenv("PROFILE_CACHE_MAX_ENTRIES", "10000"))
+# Changes remembered to reject fills that raced with a write
+PROFILE_CACHE_MAX_CHANGES = 10000
+
+Fields = Dict[str, Any]
+
+
+class _Entry:
+    __slots__ = ("fields", "text", "size")
+
+    def __init__(self, fields: Fields, text: str) -> None:
+        self.fields = fields
+        self.text = text
+        self.size = sys.getsizeof(text) + sum(sys.getsizeof(value) for value in fields.values())
+
+
+class ProfileCache:
+    """Keeps each user's profile fields and the message rendered from them.
+
+    A write to one field patches the cached fields and re-renders the
+    message without reading the database; ``vip_until`` (a datetime or None)
+    is checked on every hit so the VIP line disappears when it expires.
+
+    Fills are made with ``put(user_id, fields, since=version())`` where the
+    version is taken before the fields were read: if the user changed in the
+    meantime the fresh render is returned but not cached.
+    """
+
+    def __init__(
+        self,
+        render: Callable[[Fields], str],
+        clock: Callable[[], datetime] = datetime.now,
+        max_entries: int = PROFILE_CACHE_MAX_ENTRIES,
+    ) -> None:
+        self._render = render
+        self._clock = clock
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[int, _Entry]" = OrderedDict()
+        self._changes: "OrderedDict[int, int]" = OrderedDict()
+        self._version = 0
+        self._forgotten = 0
+        self._lock = threading.Lock()
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.updates = 0
+        self.expired = 0
+
+    def version(self) -> int:
+        with self._lock:
+            return self._version
+
+    def get(self, user_id: int) -> Optional[str]:
+        """The rendered profile, or None if it has to be loaded."""
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is None:
+                self.misses += 1
+                return None
+            until = entry.fields.get('vip_until')
+            if until is not None and self._clock() >= until:
+                self._replace(user_id, dict(entry.fields, vip_until=None))
+                self.expired += 1
+            self._entries.move_to_end(user_id)
+            self.hits += 1
+            return self._entries[user_id].text
+
+    def put(self, user_id: int, fields: Fields, since: int) -> str:
+        """Render ``fields`` and cache the result unless the user changed after ``since``."""
+        if fields.get('vip_until') is not None and self._clock() >= fields['vip_until']:
+            fields = dict(fields, vip_until=None)
+        with self._lock:
+            changed = self._changes.get(user_id, self._forgotten)
+            if changed > since:
+                return self._render(fields)
+            entry = self._replace(user_id, fields)
+            while len(self._entries) > self.max_entries:
+                _, evicted = self._entries.popitem(last=False)
+                self.bytes -= evicted.size
+            return entry.text
+
+    def update(self, user_id: int, field: str, value: Any) -> None:
+        """Write-through after one field changed; only a cached profile is re-rendered."""
+        with self._lock:
+            self._changed(user_id)
+            entry = self._entries.get(user_id)
+            if entry is not None and entry.fields.get(field) != value:
+                self._replace(user_id, dict(entry.fields, **{field: value}))
+                self.updates += 1
+
+    def invalidate(self, user_id: int) -> None:
+        with self._lock:
+            self._changed(user_id)
+            entry = self._entries.pop(user_id, None)
+            if entry is not None:
+                self.bytes -= entry.size
+
+    def clear(self) -> None:
+        with self._lock:
+            self._version += 1
+            self._forgotten = self._version
+            self._changes.clear()
+            self._entries.clear()
+            self.bytes = 0
+
+    def stats(self) -> Dict[str, float]:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'bytes': self.bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+                'updates': self.updates,
+                'expired': self.expired,
+            }
+
+    # Helpers below run with self._lock held
+
+    def _replace(self, user_id: int, fields: Fields) -> _Entry:
+        entry = _Entry(fields, self._render(fields))
+        old = self._entries.get(user_id)
+        if old is not None:
+            self.bytes -= old.size
+        self._entries[user_id] = entry
+        self._entries.move_to_end(user_id)
+        self.bytes += entry.size
+        return entry
+
+    def _changed(self, user_id: int) -> None:
+        self._version += 1
+        self._changes[user_id] = self._version
+        self._changes.move_to_end(user_id)
+        while len(self._changes) > PROFILE_CACHE_MAX_CHANGES:
+            _, self._forgotten = self._changes.popitem(last=False)
@@ -0,0 +1,369 @@
+"""Background team recommendations: a precomputed top-K candidate list per user.
+
+A candidate scores for the skills they would add to the user's team, a few
+shared skills, shared preferences and an active portfolio. Lists are built in
+the background and kept current incrementally: when a profile changes
+(``touch``), that user's own list is recomputed and every list the user could
+appear in is patched with their new score, instead of recomputing everyone.
+Candidates come from the users sharing a skill or preference word, rarest
+terms first and at most ``max_candidates`` of them, so a term nearly everyone
+has does not make each recompute scan the whole user base.
+
+All work runs on a small thread pool off the event loop, in slices of at most
+``budget_ms`` every ``interval_ms``, so refreshing never starves live updates.
+Lists are also written to the ``recommendations`` table so they survive a
+restart.
+"""
+import asyncio
+import heapq
+import itertools
+import json
+import logging
+import os
+import re
+import threading
+import time
+from collections import OrderedDict, defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, DefaultDict, Dict, FrozenSet, Iterable, List, NamedTuple, Optional, Sequence, Set, Tuple
+
+import db
+from skills import STOPWORDS
+
+RECOMMEND_TOP_K = int(os.getenv("RECOMMEND_TOP_K", "10"))
+RECOMMEND_WORKERS = int(os.getenv("RECOMMEND_WORKERS", "1"))
+# At most RECOMMEND_BUDGET_MS of refresh work every RECOMMEND_INTERVAL_MS
+RECOMMEND_BUDGET_MS = int(os.getenv("RECOMMEND_BUDGET_MS", "50"))
+RECOMMEND_INTERVAL_MS = int(os.getenv("RECOMMEND_INTERVAL_MS", "1000"))
+# Users scored per recomputed list, taken from the rarest shared terms first
+RECOMMEND_MAX_CANDIDATES = int(os.getenv("RECOMMEND_MAX_CANDIDATES", "2000"))
+
+NEW_SKILL_WEIGHT = 3.0
+SHARED_SKILL_WEIGHT = 1.0
+PREFERENCE_WEIGHT = 2.0
+PORTFOLIO_WEIGHT = 0.5
+
+logger = logging.getLogger(__name__)
+
+_PREFERENCE_WORD = re.compile(r"[a-z0-9+#]+")
+
+# (user_id, skill ids, preferences text, number of projects)
+ProfileRow = Tuple[int, Iterable[int], Optional[str], int]
+Candidates = List[Tuple[int, float]]
+
+
+class Profile(NamedTuple):
+    skills: FrozenSet[int]
+    preferences: FrozenSet[str]
+    projects: int
+
+
+def preference_words(preferences: Optional[str]) -> FrozenSet[str]:
+    if not preferences:
+        return frozenset()
+    return frozenset(w for w in _PREFERENCE_WORD.findall(preferences.lower()) if len(w) > 2 and w not in STOPWORDS)
+
+
+def score(me: Profile, other: Profile) -> float:
+    """How good a teammate ``other`` is for ``me``; 0 means not a candidate."""
+    if not other.skills:
+        return 0.0
+    shared_preferences = len(me.preferences & other.preferences)
+    shared_skills = len(me.skills & other.skills)
+    if not shared_preferences and not shared_skills:
+        return 0.0
+    return (
+        NEW_SKILL_WEIGHT * len(other.skills - me.skills)
+        + SHARED_SKILL_WEIGHT * min(shared_skills, 2)
+        + PREFERENCE_WEIGHT * shared_preferences
+        + PORTFOLIO_WEIGHT * min(other.projects, 3)
+    )
+
+
+class Recommender:
+    """Keeps a top-K teammate list per user, refreshed in the background.
+
+    ``load_profiles(user_ids)`` returns ProfileRow tuples for the given users,
+    or for every user when ``user_ids`` is None.
+    """
+
+    def __init__(
+        self,
+        load_profiles: Callable[[Optional[Sequence[int]]], Iterable[ProfileRow]],
+        k: int = RECOMMEND_TOP_K,
+        workers: int = RECOMMEND_WORKERS,
+        budget_ms: int = RECOMMEND_BUDGET_MS,
+        interval_ms: int = RECOMMEND_INTERVAL_MS,
+        max_candidates: int = RECOMMEND_MAX_CANDIDATES,
+    ) -> None:
+        self.load_profiles = load_profiles
+        self.k = k
+        self.workers = max(1, workers)
+        self.budget = budget_ms / 1000
+        self.interval = interval_ms / 1000
+        self.max_candidates = max_candidates
+        self._profiles: Dict[int, Profile] = {}
+        self._by_skill: DefaultDict[int, Set[int]] = defaultdict(set)
+        self._by_preference: DefaultDict[str, Set[int]] = defaultdict(set)
+        self._lists: Dict[int, Candidates] = {}
+        # candidate_id -> users whose list contains them, to patch those lists
+        self._listed_in: DefaultDict[int, Set[int]] = defaultdict(set)
+        # user_id -> lists still to patch after a slice ran out of budget
+        self._unpatched: "OrderedDict[int, List[int]]" = OrderedDict()
+        # Users whose own list must be recomputed, front = most urgent
+        self._stale: "OrderedDict[int, None]" = OrderedDict()
+        # Users whose profile changed; their lists and neighbours need work
+        self._touched: "OrderedDict[int, None]" = OrderedDict()
+        self._unsaved: Set[int] = set()
+        # _lock guards profiles and lists (worker side); _queue_lock only the
+        # two queues, so the event loop never waits for a refresh slice
+        self._lock = threading.Lock()
+        self._queue_lock = threading.Lock()
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._task: Optional[asyncio.Task] = None
+        self.ready = False
+        self.refreshed = 0
+        self.patched = 0
+        self.busy_seconds = 0.0
+
+    # Public API, safe to call from the event loop
+
+    def touch(self, user_id: int) -> None:
+        """Note that a user's skills, preferences or portfolio changed."""
+        with self._queue_lock:
+            self._touched[user_id] = None
+
+    def recommendations(self, user_id: int) -> Optional[Candidates]:
+        """The precomputed (candidate_id, score) list, best first, or None.
+
+        A user without a list is moved to the front of the refresh queue so
+        the next slice computes it.
+        """
+        candidates = self._lists.get(user_id)
+        if candidates is None and self.ready:
+            with self._queue_lock:
+                self._stale[user_id] = None
+                self._stale.move_to_end(user_id, last=False)
+        return candidates
+
+    def stats(self) -> Dict[str, float]:
+        with self._queue_lock:
+            return {
+                'lists': len(self._lists),
+                'stale': len(self._stale),
+                'touched': len(self._touched),
+                'unpatched': len(self._unpatched),
+                'refreshed': self.refreshed,
+                'patched': self.patched,
+                'busy_seconds': self.busy_seconds,
+            }
+
+    def start(self) -> asyncio.Task:
+        """Start the background loop on the running event loop."""
+        if self._task is None or self._task.done():
+            self._executor = ThreadPoolExecutor(self.workers, "recommender")
+            self._task = asyncio.get_running_loop().create_task(self._run())
+        return self._task
+
+    async def close(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        if self._executor is not None:
+            await asyncio.get_running_loop().run_in_executor(self._executor, self.save)
+            self._executor.shutdown(wait=True)
+            self._executor = None
+
+    async def _run(self) -> None:
+        loop = asyncio.get_running_loop()
+        try:
+            await loop.run_in_executor(self._executor, self.bootstrap)
+        except Exception as e:
+            logger.error(f"Recommender could not load profiles: {e}")
+            return
+        while True:
+            start = loop.time()
+            # Workers share one budget window; profile updates are serialized
+            deadline = time.monotonic() + self.budget
+            try:
+                await asyncio.gather(*(
+                    loop.run_in_executor(self._executor, self.refresh, deadline) for _ in range(self.workers)
+                ))
+                await loop.run_in_executor(self._executor, self.save)
+            except Exception as e:
+                logger.error(f"Recommendation refresh failed: {e}")
+            await asyncio.sleep(max(0.0, self.interval - (loop.time() - start)))
+
+    # Worker side (blocking)
+
+    def bootstrap(self) -> None:
+        """Load every profile and the stored lists; queue users without one."""
+        rows = self.load_profiles(None)
+        stored = db.fetchall("SELECT user_id, candidates FROM recommendations")
+        with self._lock:
+            for row in rows:
+                self._set_profile(row)
+            for user_id, candidates in stored:
+                if user_id in self._profiles:
+                    self._set_list(user_id, [tuple(candidate) for candidate in json.loads(candidates)])
+            with self._queue_lock:
+                for user_id in self._profiles:
+                    if user_id not in self._lists:
+                        self._stale[user_id] = None
+            self.ready = True
+        logger.info(f"Recommender loaded {len(self._profiles)} profiles and {len(self._lists)} stored lists")
+
+    def refresh(self, deadline: float) -> int:
+        """Work through touched and stale users until ``deadline``; returns users handled."""
+        started = time.perf_counter()
+        handled = 0
+        try:
+            while time.monotonic() < deadline:
+                with self._lock:
+                    unpatched = self._unpatched.popitem(last=False) if self._unpatched else None
+                    if unpatched is not None:
+                        self._patch(unpatched[0], unpatched[1], deadline)
+                if unpatched is not None:
+                    continue
+                with self._queue_lock:
+                    touched = self._touched.popitem(last=False)[0] if self._touched else None
+                if touched is not None:
+                    rows = list(self.load_profiles([touched]))
+                    with self._lock:
+                        self._apply_change(touched, rows[0] if rows else None, deadline)
+                    handled += 1
+                    continue
+                with self._queue_lock:
+                    if not self._stale:
+                        break
+                    user_id = self._stale.popitem(last=False)[0]
+                with self._lock:
+                    self._recompute(user_id)
+                handled += 1
+        finally:
+            with self._queue_lock:
+                self.busy_seconds += time.perf_counter() - started
+        return handled
+
+    def save(self) -> None:
+        """Write lists changed since the last save in one transaction."""
+        with self._lock:
+            changed, self._unsaved = self._unsaved, set()
+            rows = [(user_id, json.dumps(self._lists.get(user_id, [])), time.time()) for user_id in changed]
+        if not rows:
+            return
+        try:
+            with db.transaction() as conn:
+                conn.executemany(
+                    "INSERT INTO recommendations (user_id, candidates, computed_at) VALUES (?, ?, ?) "
+                    "ON CONFLICT(user_id) DO UPDATE SET candidates = excluded.candidates, computed_at = excluded.computed_at",
+                    rows,
+                )
+        except Exception:
+            with self._lock:
+                self._unsaved |= changed
+            raise
+
+    # Helpers below run with self._lock held
+
+    def _set_profile(self, row: ProfileRow) -> Optional[Profile]:
+        user_id, skill_ids, preferences, projects = row
+        old = self._profiles.get(user_id)
+        if old is not None:
+            for skill_id in old.skills:
+                self._by_skill[skill_id].discard(user_id)
+            for word in old.preferences:
+                self._by_preference[word].discard(user_id)
+        profile = Profile(frozenset(skill_ids), preference_words(preferences), projects)
+        self._profiles[user_id] = profile
+        for skill_id in profile.skills:
+            self._by_skill[skill_id].add(user_id)
+        for word in profile.preferences:
+            self._by_preference[word].add(user_id)
+        return old
+
+    def _neighbours(self, profile: Profile) -> Set[int]:
+        """Up to ``max_candidates`` users sharing a skill or a preference word with ``profile``.
+
+        Rare terms are expanded first; a common term only fills the room left.
+        """
+        postings = [self._by_skill.get(skill_id, ()) for skill_id in profile.skills]
+        postings += [self._by_preference.get(word, ()) for word in profile.preferences]
+        postings.sort(key=len)
+        users: Set[int] = set()
+        for posting in postings:
+            room = self.max_candidates - len(users)
+            if room <= 0:
+                break
+            if len(posting) <= room:
+                users |= posting
+            else:
+                users.update(itertools.islice(posting, room))
+        return users
+
+    def _set_list(self, user_id: int, candidates: Candidates) -> None:
+        for other_id, _ in self._lists.get(user_id, ()):
+            self._listed_in[other_id].discard(user_id)
+        for other_id, _ in candidates:
+            self._listed_in[other_id].add(user_id)
+        self._lists[user_id] = candidates
+
+    def _recompute(self, user_id: int) -> None:
+        me = self._profiles.get(user_id)
+        candidates: Candidates = []
+        if me is not None:
+            profiles = self._profiles
+            scored = ((other_id, score(me, profiles[other_id])) for other_id in self._neighbours(me) if other_id != user_id)
+            candidates = heapq.nlargest(self.k, (c for c in scored if c[1] > 0), key=lambda c: (c[1], -c[0]))
+        self._set_list(user_id, candidates)
+        self._unsaved.add(user_id)
+        self.refreshed += 1
+
+    def _apply_change(self, user_id: int, row: Optional[ProfileRow], deadline: Optional[float] = None) -> None:
+        old = self._set_profile(row) if row is not None else self._profiles.get(user_id)
+        new = self._profiles.get(user_id)
+        if new is None:
+            return
+        self._recompute(user_id)
+        # Patch every list the user is in or could now enter
+        affected = self._neighbours(new) | self._listed_in.get(user_id, set())
+        if old is not None:
+            affected |= self._neighbours(old)
+        affected.update(self._unpatched.pop(user_id, ()))
+        affected.discard(user_id)
+        self._patch(user_id, list(affected), deadline)
+
+    def _patch(self, user_id: int, others: List[int], deadline: Optional[float]) -> None:
+        """Patch the user's current score into the lists of ``others``.
+
+        Lists left when ``deadline`` passes are patched by the next slice.
+        """
+        new = self._profiles.get(user_id)
+        if new is None:
+            return
+        for done, other_id in enumerate(others):
+            if deadline is not None and done and done % 64 == 0 and time.monotonic() >= deadline:
+                self._unpatched[user_id] = others[done:]
+                return
+            candidates = self._lists.get(other_id)
+            if candidates is None:
+                continue
+            was_listed = any(c[0] == user_id for c in candidates)
+            kept = [c for c in candidates if c[0] != user_id]
+            new_score = score(self._profiles[other_id], new)
+            if new_score > 0 and (len(kept) < self.k or (new_score, -user_id) > (kept[-1][1], -kept[-1][0])):
+                kept.append((user_id, new_score))
+                kept.sort(key=lambda c: (-c[1], c[0]))
+                kept = kept[:self.k]
+            elif was_listed and len(kept) < self.k:
+                # Someone outside the list may deserve the free slot
+                with self._queue_lock:
+                    self._stale[other_id] = None
+            if kept != candidates:
+                self._set_list(other_id, kept)
+                self._unsaved.add(other_id)
+                self.patched += 1
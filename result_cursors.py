@@ -0,0 +1,60 @@
+"""Short-lived server-side cursors for paginated results.
+
+A cursor is an opaque token that fits in Telegram callback data and points
+at state kept in memory (e.g. a team search and its ranked results), so
+paging never repeats the query. Cursors expire ``ttl`` seconds after their
+last use and the least recently used ones are dropped beyond ``max_entries``.
+"""
+import os
+import secrets
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Optional, Tuple
+
+CURSOR_TTL = float(os.getenv("CURSOR_TTL", "900"))
+CURSOR_MAX_ENTRIES = int(os.getenv("CURSOR_MAX_ENTRIES", "10000"))
+
+
+class CursorStore:
+    def __init__(
+        self,
+        ttl: float = CURSOR_TTL,
+        max_entries: int = CURSOR_MAX_ENTRIES,
+        clock: Callable[[], float] = time.monotonic,
+    ) -> None:
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._clock = clock
+        self._entries: "OrderedDict[str, Tuple[float, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def put(self, value: Any) -> str:
+        """Store ``value`` and return its token (8 URL-safe characters)."""
+        now = self._clock()
+        with self._lock:
+            token = secrets.token_urlsafe(6)
+            while token in self._entries:
+                token = secrets.token_urlsafe(6)
+            self._entries[token] = (now + self.ttl, value)
+            # Entries are kept in expiry order, so expired ones are at the front
+            while self._entries and (len(self._entries) > self.max_entries or next(iter(self._entries.values()))[0] <= now):
+                self._entries.popitem(last=False)
+        return token
+
+    def get(self, token: str) -> Optional[Any]:
+        """The value behind ``token``, or None once it expired; renews the TTL."""
+        now = self._clock()
+        with self._lock:
+            entry = self._entries.get(token)
+            if entry is None:
+                return None
+            if entry[0] <= now:
+                del self._entries[token]
+                return None
+            self._entries[token] = (now + self.ttl, entry[1])
+            self._entries.move_to_end(token)
+            return entry[1]
+
+    def __len__(self) -> int:
+        return len(self._entries)
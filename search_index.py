@@ -0,0 +1,60 @@
+"""BM25 full-text search over user profiles.
+
+``profile_search`` (an FTS5 table created by ``migrations.py`` and kept in sync
+by triggers) holds each user's skills, preferences, AI summary and portfolio
+projects as separate columns, so a match in the skills column can count for
+more than the same word somewhere in free text.
+"""
+import os
+from typing import Iterable, List, Optional, Sequence, Tuple
+
+import db
+import migrations
+
+COLUMNS = ('skills', 'preferences', 'about_user', 'portfolio')
+# BM25 weight per column, in COLUMNS order
+SEARCH_WEIGHTS = tuple(float(w) for w in os.getenv("SEARCH_WEIGHTS", "10,2,1,1").split(","))
+SEARCH_LIMIT = int(os.getenv("SEARCH_LIMIT", "200"))
+
+
+def build_query(tokens: Iterable[str], columns: Optional[Sequence[str]] = None) -> str:
+    """Turn search tokens into an FTS5 query matching any of them as a prefix."""
+    terms = ['"%s"*' % token.replace('"', '""') for token in dict.fromkeys(tokens)]
+    if not terms:
+        return ""
+    query = " OR ".join(terms)
+    if columns:
+        unknown = set(columns) - set(COLUMNS)
+        if unknown:
+            raise ValueError(f"Unknown search columns: {', '.join(sorted(unknown))}")
+        query = "{%s} : (%s)" % (" ".join(columns), query)
+    return query
+
+
+def search(
+    tokens: Iterable[str],
+    exclude_id: Optional[int] = None,
+    limit: int = SEARCH_LIMIT,
+    columns: Optional[Sequence[str]] = None,
+    weights: Sequence[float] = SEARCH_WEIGHTS,
+) -> List[Tuple[int, float]]:
+    """Return up to ``limit`` (user_id, score) pairs, best first.
+
+    Scores are SQLite's ``bm25()`` values, so lower is better. ``columns``
+    restricts matching to some of COLUMNS, e.g. ``('skills',)``.
+    """
+    query = build_query(tokens, columns)
+    if not query:
+        return []
+    placeholders = ", ".join("?" * len(COLUMNS))
+    return db.fetchall(
+        f"SELECT rowid, bm25(profile_search, {placeholders}) AS score FROM profile_search "
+        "WHERE profile_search MATCH ? AND rowid != ? ORDER BY score LIMIT ?",
+        (*weights, query, -1 if exclude_id is None else exclude_id, limit),
+    )
+
+
+def rebuild() -> None:
+    """Re-index every profile, e.g. after a bulk load that skipped the triggers."""
+    with db.transaction() as conn:
+        migrations.build_search_index(conn, force=True)
@@ -0,0 +1,229 @@
+"""In-process inverted index from canonical skill ids to the users that have them.
+
+With NumPy installed (it is in the Pipfile) each skill's users are kept as an array of
+dense row numbers, so scoring a query is a handful of vectorized additions
+over one counts array and the best candidates are picked with
+``argpartition`` instead of sorting every match. Profile edits do not
+rebuild those arrays: rows a skill gained or lost since its array was built
+are kept aside and scored on their own, and merged into the array once there
+are enough of them. Without NumPy the same results come from plain sets and
+``heapq``.
+"""
+import heapq
+import threading
+from collections import Counter, defaultdict
+from typing import DefaultDict, Dict, Iterable, List, Optional, Sequence, Set, Tuple
+
+try:
+    import numpy as np
+except ImportError:  # pragma: no cover - falls back to sets
+    np = None
+
+# A skill's pending row changes are merged into its array once they exceed
+# this many plus a 1/SKILL_INDEX_MERGE_RATIO share of the array
+SKILL_INDEX_MERGE_MIN = 64
+SKILL_INDEX_MERGE_RATIO = 8
+
+# (matching users, best k as (user_id, score), scores of the included ids)
+TopResult = Tuple[int, List[Tuple[int, int]], Dict[int, int]]
+
+
+class SkillIndex:
+    """Maps each skill id (see ``skills.py``) to the ids of the users that have it.
+
+    Team search only has to look at the users behind the skills asked for;
+    matching is exact on canonical ids, so no string work happens per query.
+    """
+
+    def __init__(self, vectorized: Optional[bool] = None) -> None:
+        self.vectorized = np is not None if vectorized is None else vectorized
+        if self.vectorized and np is None:
+            raise RuntimeError("NumPy is required for the vectorized skill index")
+        self._users_by_skill: DefaultDict[int, Set[int]] = defaultdict(set)
+        self._skills_by_user: Dict[int, Set[int]] = {}
+        # Vectorized mode: users get dense row numbers, skills get row arrays
+        self._row_of_user: Dict[int, int] = {}
+        self._user_of_row = np.empty(0, dtype=np.int64) if self.vectorized else None
+        self._rows_by_skill: Dict[int, "np.ndarray"] = {}
+        # Rows added to / removed from a skill since its array was built
+        self._added_rows: Dict[int, Set[int]] = {}
+        self._removed_rows: Dict[int, Set[int]] = {}
+        self._lock = threading.Lock()
+        self.loaded = False
+
+    def load(self, rows: Iterable[Tuple[int, int]]) -> None:
+        """Rebuild the index from (user_id, skill_id) rows."""
+        with self._lock:
+            self.loaded = False
+            self._users_by_skill.clear()
+            self._skills_by_user.clear()
+            self._row_of_user.clear()
+            self._rows_by_skill.clear()
+            self._added_rows.clear()
+            self._removed_rows.clear()
+            for user_id, skill_id in rows:
+                self._users_by_skill[skill_id].add(user_id)
+                self._skills_by_user.setdefault(user_id, set()).add(skill_id)
+                if self.vectorized and user_id not in self._row_of_user:
+                    self._row_of_user[user_id] = len(self._row_of_user)
+            if self.vectorized:
+                self._user_of_row = np.fromiter(self._row_of_user, dtype=np.int64, count=len(self._row_of_user))
+                for skill_id in self._users_by_skill:
+                    self._rows(skill_id)
+            self.loaded = True
+
+    def update(self, user_id: int, skill_ids: Iterable[int]) -> None:
+        """Replace the indexed skills of one user."""
+        skills = set(skill_ids)
+        with self._lock:
+            if skills and self.vectorized and user_id not in self._row_of_user:
+                self._add_row(user_id)
+            old = self._skills_by_user.pop(user_id, set())
+            for skill_id in old - skills:
+                users = self._users_by_skill[skill_id]
+                users.discard(user_id)
+                if users:
+                    self._change_row(skill_id, user_id, self._removed_rows, self._added_rows)
+                else:
+                    del self._users_by_skill[skill_id]
+                    self._rows_by_skill.pop(skill_id, None)
+                    self._added_rows.pop(skill_id, None)
+                    self._removed_rows.pop(skill_id, None)
+            if skills:
+                self._skills_by_user[user_id] = skills
+                for skill_id in skills - old:
+                    self._users_by_skill[skill_id].add(user_id)
+                    self._change_row(skill_id, user_id, self._added_rows, self._removed_rows)
+
+    def _change_row(
+        self, skill_id: int, user_id: int, changes: Dict[int, Set[int]], undone: Dict[int, Set[int]]
+    ) -> None:
+        # Skills without an array yet build it from the current set when first scored
+        if skill_id not in self._rows_by_skill:
+            return
+        row = self._row_of_user[user_id]
+        pending = undone.get(skill_id)
+        if pending is not None and row in pending:
+            pending.discard(row)
+        else:
+            changes.setdefault(skill_id, set()).add(row)
+
+    def _add_row(self, user_id: int) -> None:
+        row = len(self._row_of_user)
+        self._row_of_user[user_id] = row
+        if row >= len(self._user_of_row):
+            grown = np.empty(max(16, 2 * len(self._user_of_row)), dtype=np.int64)
+            grown[:row] = self._user_of_row[:row]
+            self._user_of_row = grown
+        self._user_of_row[row] = user_id
+
+    def _rows(self, skill_id: int) -> "np.ndarray":
+        """The skill's row array, without the pending changes unless they were due to be merged."""
+        rows = self._rows_by_skill.get(skill_id)
+        if rows is None:
+            row_of_user = self._row_of_user
+            users = self._users_by_skill[skill_id]
+            rows = self._rows_by_skill[skill_id] = np.fromiter(
+                (row_of_user[user_id] for user_id in users), dtype=np.int64, count=len(users)
+            )
+            return rows
+        added = self._added_rows.get(skill_id, ())
+        removed = self._removed_rows.get(skill_id, ())
+        if len(added) + len(removed) > SKILL_INDEX_MERGE_MIN + len(rows) // SKILL_INDEX_MERGE_RATIO:
+            if removed:
+                rows = rows[~np.isin(rows, _array(removed))]
+            if added:
+                rows = np.concatenate((rows, _array(added)))
+            self._rows_by_skill[skill_id] = rows
+            self._added_rows.pop(skill_id, None)
+            self._removed_rows.pop(skill_id, None)
+        return rows
+
+    def _add_counts(self, counts: "np.ndarray", skill_id: int, times: int) -> None:
+        counts[self._rows(skill_id)] += times
+        added = self._added_rows.get(skill_id)
+        if added:
+            counts[_array(added)] += times
+        removed = self._removed_rows.get(skill_id)
+        if removed:
+            counts[_array(removed)] -= times
+
+    def match(self, skill_ids: List[int], exclude_id: Optional[int] = None) -> List[Tuple[int, int]]:
+        """Return (user_id, score) pairs, best first.
+
+        The score is how many of ``skill_ids`` a user has; a skill asked for
+        twice counts twice. Ties keep id order.
+        """
+        with self._lock:
+            scores = self._scores(skill_ids)
+        scores.pop(exclude_id, None)
+        return sorted(scores.items(), key=lambda m: (-m[1], m[0]))
+
+    def _scores(self, skill_ids: List[int]) -> DefaultDict[int, int]:
+        scores: DefaultDict[int, int] = defaultdict(int)
+        for skill_id, times in Counter(skill_ids).items():
+            for user_id in self._users_by_skill.get(skill_id, ()):
+                scores[user_id] += times
+        return scores
+
+    def top(
+        self,
+        skill_ids: List[int],
+        k: int,
+        exclude_id: Optional[int] = None,
+        include: Sequence[int] = (),
+    ) -> TopResult:
+        """Score like ``match`` but only rank the best ``k`` users.
+
+        Returns the number of matching users, the first ``k`` entries of what
+        ``match`` would return, and the scores of the ``include`` user ids
+        (0 when they do not match), e.g. to re-rank them with another signal.
+        """
+        with self._lock:
+            if self.vectorized:
+                return self._top_vectorized(skill_ids, k, exclude_id, include)
+            return self._top_sets(skill_ids, k, exclude_id, include)
+
+    def _top_sets(
+        self, skill_ids: List[int], k: int, exclude_id: Optional[int], include: Sequence[int]
+    ) -> TopResult:
+        scores = self._scores(skill_ids)
+        scores.pop(exclude_id, None)
+        best = heapq.nsmallest(k, scores.items(), key=lambda m: (-m[1], m[0]))
+        return len(scores), best, {user_id: scores.get(user_id, 0) for user_id in include}
+
+    def _top_vectorized(
+        self, skill_ids: List[int], k: int, exclude_id: Optional[int], include: Sequence[int]
+    ) -> TopResult:
+        counts = np.zeros(len(self._row_of_user), dtype=np.int32)
+        for skill_id, times in Counter(skill_ids).items():
+            if skill_id in self._users_by_skill:
+                self._add_counts(counts, skill_id, times)
+        excluded_row = self._row_of_user.get(exclude_id)
+        if excluded_row is not None:
+            counts[excluded_row] = 0
+        included = {user_id: int(counts[self._row_of_user[user_id]]) if user_id in self._row_of_user else 0
+                    for user_id in include}
+
+        rows = np.flatnonzero(counts)
+        total = len(rows)
+        if total > k > 0:
+            scores = counts[rows]
+            threshold = np.partition(scores, total - k)[total - k]
+            above = rows[scores > threshold]
+            # Fill the rest with the lowest user ids among the tied scores
+            tied_ids = self._user_of_row[rows[scores == threshold]]
+            needed = k - len(above)
+            tied_ids = np.partition(tied_ids, needed - 1)[:needed]
+            candidates = [(int(user_id), int(counts[row])) for user_id, row in zip(self._user_of_row[above], above)]
+            candidates += [(int(user_id), int(threshold)) for user_id in tied_ids]
+        elif k > 0:
+            candidates = [(int(user_id), int(counts[row])) for user_id, row in zip(self._user_of_row[rows], rows)]
+        else:
+            candidates = []
+        candidates.sort(key=lambda m: (-m[1], m[0]))
+        return total, candidates, included
+
+
+def _array(rows: Set[int]) -> "np.ndarray":
+    return np.fromiter(rows, dtype=np.int64, count=len(rows))
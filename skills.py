@@ -0,0 +1,226 @@
+"""Skill canonicalization: aliases, normalized names and stable skill ids.
+
+Skills are parsed once, when a user saves them: every comma separated entry
+is normalized ("  Node.JS " -> "node.js"), mapped through the alias table to
+a canonical name ("nodejs" -> "node.js") and extended with the skills it
+implies (Node.js -> JavaScript). Canonical names get integer ids from the
+``skills`` table and each user's ids are stored in ``user_skills`` next to the
+raw text, so team search compares sets of integers.
+"""
+import re
+import sqlite3
+import threading
+from typing import Dict, Iterable, List, Optional, Tuple
+
+# canonical name -> other spellings people use for it
+ALIASES: Dict[str, Tuple[str, ...]] = {
+    'javascript': ('js', 'ecmascript', 'es6', 'vanilla js'),
+    'typescript': ('ts',),
+    'node.js': ('node', 'nodejs', 'node js'),
+    'react': ('reactjs', 'react.js', 'react js'),
+    'react native': ('react-native', 'rn'),
+    'vue': ('vuejs', 'vue.js', 'vue js'),
+    'angular': ('angularjs', 'angular.js'),
+    'python': ('py', 'python3', 'python 3'),
+    'django': ('django rest framework', 'drf'),
+    'fastapi': ('fast api',),
+    'c++': ('cpp', 'cplusplus'),
+    'c#': ('csharp', 'c sharp', '.net', 'dotnet'),
+    'go': ('golang',),
+    'java': ('java se', 'java ee'),
+    'kotlin': ('kt',),
+    'postgresql': ('postgres', 'psql', 'pg'),
+    'mysql': ('mariadb',),
+    'mongodb': ('mongo',),
+    'kubernetes': ('k8s', 'kube'),
+    'aws': ('amazon web services',),
+    'gcp': ('google cloud', 'google cloud platform'),
+    'machine learning': ('ml',),
+    'deep learning': ('dl',),
+    'artificial intelligence': ('ai',),
+    'pytorch': ('torch',),
+    'tensorflow': ('tf',),
+    'data analysis': ('data analytics', 'analytics'),
+    'ui/ux': ('ui', 'ux', 'ui/ux design', 'ux/ui', 'ui design', 'ux design'),
+    'figma': (),
+    'sql': (),
+}
+
+# A skill also counts as the skills it implies
+IMPLIES: Dict[str, Tuple[str, ...]] = {
+    'node.js': ('javascript',),
+    'react': ('javascript',),
+    'react native': ('react',),
+    'vue': ('javascript',),
+    'angular': ('typescript',),
+    'typescript': ('javascript',),
+    'django': ('python',),
+    'flask': ('python',),
+    'fastapi': ('python',),
+    'pytorch': ('python', 'machine learning'),
+    'tensorflow': ('machine learning',),
+    'deep learning': ('machine learning',),
+    'postgresql': ('sql',),
+    'mysql': ('sql',),
+    'sqlite': ('sql',),
+}
+
+# Words in a team request that never name a skill on their own
+STOPWORDS = frozenset((
+    'a', 'an', 'and', 'or', 'the', 'with', 'for', 'who', 'that', 'need', 'needs', 'want', 'looking',
+    'someone', 'people', 'person', 'team', 'teammate', 'teammates', 'member', 'members', 'developer',
+    'developers', 'dev', 'devs', 'engineer', 'engineers', 'good', 'experienced', 'senior', 'junior',
+    'knows', 'know', 'skills', 'skill', 'also', 'some', 'any', 'our', 'project', 'in', 'of', 'to',
+    'plus', 'please', 'like', 'can', 'should', 'will', 'help', 'build', 'building', 'join', 'more',
+))
+
+_WORD = re.compile(r"[a-z0-9+#./-]+")
+_EDGE = " \t\r\n.,;:!?()[]{}'\"*"
+
+
+def _compile() -> Tuple[Dict[str, str], Dict[str, Tuple[str, ...]], int]:
+    canonical_of: Dict[str, str] = {}
+    for name, aliases in ALIASES.items():
+        for alias in (name,) + aliases:
+            canonical_of[normalize(alias)] = name
+
+    def closure(name: str, seen: Tuple[str, ...] = ()) -> Tuple[str, ...]:
+        implied: List[str] = []
+        for parent in IMPLIES.get(name, ()):
+            if parent not in seen and parent not in implied:
+                implied.append(parent)
+                implied.extend(p for p in closure(parent, seen + (name,)) if p not in implied and p != name)
+        return tuple(implied)
+
+    implied_by = {name: closure(name) for name in IMPLIES}
+    longest = max(len(alias.split()) for alias in canonical_of)
+    return canonical_of, implied_by, longest
+
+
+def normalize(entry: str) -> str:
+    """Lowercase, trim punctuation around the entry and collapse whitespace."""
+    return " ".join(entry.lower().strip(_EDGE).split())
+
+
+def canonical(entry: str) -> str:
+    """The canonical name of one skill entry; unknown skills stay as normalized."""
+    name = normalize(entry)
+    return _CANONICAL.get(name, name)
+
+
+def with_implied(names: Iterable[str]) -> List[str]:
+    """``names`` followed by every skill they imply, without duplicates."""
+    result = list(dict.fromkeys(names))
+    for name in list(result):
+        result.extend(parent for parent in _IMPLIED.get(name, ()) if parent not in result)
+    return result
+
+
+def parse_skills(skills_text: Optional[str]) -> List[str]:
+    """Canonical skills of a comma separated skills string, implied ones included."""
+    if not skills_text:
+        return []
+    return with_implied(canonical(entry) for entry in skills_text.split(',') if normalize(entry))
+
+
+def find_skills(text: str, known: "SkillCatalog") -> Tuple[List[str], List[str]]:
+    """Read the skills asked for in free text, e.g. a team request.
+
+    Returns the canonical names of known skills (repeats kept, so asking for
+    a skill twice weighs it twice) and the leftover words that may still be
+    worth a full-text search. Phrases up to the longest alias are tried
+    before single words, so "machine learning" is one skill.
+    """
+    words = _WORD.findall(text.lower())
+    found: List[str] = []
+    leftover: List[str] = []
+    i = 0
+    while i < len(words):
+        for size in range(min(_LONGEST, len(words) - i), 0, -1):
+            phrase = normalize(" ".join(words[i:i + size]))
+            if size == 1 and phrase in STOPWORDS:
+                continue
+            name = _CANONICAL.get(phrase, phrase)
+            if name in _CANONICAL_NAMES or known.lookup(name) is not None:
+                found.append(name)
+                i += size
+                break
+        else:
+            word = normalize(words[i])
+            if len(word) > 2 and word not in STOPWORDS:
+                leftover.append(word)
+            i += 1
+    return found, leftover
+
+
+class SkillCatalog:
+    """Process-wide cache of the ``skills`` table (canonical name <-> id).
+
+    Ids are allocated with ``INSERT OR IGNORE`` so several processes sharing
+    one database agree on them.
+    """
+
+    def __init__(self) -> None:
+        self._ids: Dict[str, int] = {}
+        self._lock = threading.Lock()
+        self.loaded = False
+
+    def load(self, conn: sqlite3.Connection) -> None:
+        rows = conn.execute("SELECT name, id FROM skills").fetchall()
+        with self._lock:
+            self._ids = dict(rows)
+            self.loaded = True
+
+    def invalidate(self) -> None:
+        """Forget cached ids, e.g. after a transaction that added some rolled back."""
+        with self._lock:
+            self._ids = {}
+            self.loaded = False
+
+    def lookup(self, name: str) -> Optional[int]:
+        return self._ids.get(name)
+
+    def ids(self, names: Iterable[str], conn: sqlite3.Connection) -> List[int]:
+        """Ids of ``names``, adding the ones the table does not have yet."""
+        names = list(names)
+        missing = [name for name in dict.fromkeys(names) if name not in self._ids]
+        if missing:
+            conn.executemany("INSERT OR IGNORE INTO skills (name) VALUES (?)", ((name,) for name in missing))
+            placeholders = ", ".join("?" * len(missing))
+            rows = conn.execute(f"SELECT name, id FROM skills WHERE name IN ({placeholders})", missing).fetchall()
+            with self._lock:
+                self._ids.update(rows)
+        return [self._ids[name] for name in names]
+
+
+def store_user_skills(conn: sqlite3.Connection, catalog: SkillCatalog, user_id: int, skills_text: Optional[str]) -> List[int]:
+    """Replace the canonical skill ids of one user; returns them."""
+    skill_ids = catalog.ids(parse_skills(skills_text), conn)
+    conn.execute("DELETE FROM user_skills WHERE user_id = ?", (user_id,))
+    conn.executemany("INSERT INTO user_skills (user_id, skill_id) VALUES (?, ?)", ((user_id, skill_id) for skill_id in skill_ids))
+    return skill_ids
+
+
+def rebuild_user_skills(conn: sqlite3.Connection, catalog: Optional[SkillCatalog] = None) -> int:
+    """Re-derive ``user_skills`` from every user's raw skills text, in the caller's transaction."""
+    catalog = catalog or SkillCatalog()
+    indexed = 0
+    try:
+        conn.execute("DELETE FROM user_skills")
+        # Streamed rather than fetched, so memory stays flat however many users there are
+        for user_id, skills_text in conn.execute("SELECT id, skills FROM users WHERE skills IS NOT NULL AND skills != ''"):
+            conn.executemany(
+                "INSERT INTO user_skills (user_id, skill_id) VALUES (?, ?)",
+                ((user_id, skill_id) for skill_id in catalog.ids(parse_skills(skills_text), conn)),
+            )
+            indexed += 1
+    except Exception:
+        catalog.invalidate()
+        raise
+    return indexed
+
+
+_CANONICAL, _IMPLIED, _LONGEST = _compile()
+_CANONICAL_NAMES = frozenset(_CANONICAL.values())
+
+catalog = SkillCatalog()
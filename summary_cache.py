@@ -0,0 +1,49 @@
+"""Persistent cache of AI profile summaries keyed by their exact input."""
+import hashlib
+import json
+import os
+import time
+from typing import Any, Optional, Sequence
+
+import db
+
+# Entries older than this are treated as misses and removed
+SUMMARY_CACHE_TTL = int(os.getenv("SUMMARY_CACHE_TTL", str(30 * 24 * 3600)))
+# Least recently used entries beyond this size are evicted
+SUMMARY_CACHE_MAX_ENTRIES = int(os.getenv("SUMMARY_CACHE_MAX_ENTRIES", "10000"))
+
+
+def make_key(summary_input: Sequence[Any]) -> str:
+    """Hash the exact tuple that is passed to generate_summary."""
+    payload = json.dumps(list(summary_input), ensure_ascii=False, separators=(",", ":"))
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def get(key: str) -> Optional[str]:
+    """Return the cached summary for ``key`` or None on a miss."""
+    now = time.time()
+    with db.transaction() as conn:
+        row = conn.execute("SELECT summary, created_at FROM summary_cache WHERE key = ?", (key,)).fetchone()
+        if not row:
+            return None
+        if now - row[1] > SUMMARY_CACHE_TTL:
+            conn.execute("DELETE FROM summary_cache WHERE key = ?", (key,))
+            return None
+        conn.execute("UPDATE summary_cache SET last_used_at = ? WHERE key = ?", (now, key))
+        return row[0]
+
+
+def put(key: str, summary: str) -> None:
+    """Store a summary and evict the least recently used overflow."""
+    now = time.time()
+    with db.transaction() as conn:
+        conn.execute(
+            "INSERT OR REPLACE INTO summary_cache (key, summary, created_at, last_used_at) VALUES (?, ?, ?, ?)",
+            (key, summary, now, now),
+        )
+        conn.execute(
+            "DELETE FROM summary_cache WHERE key IN ("
+            " SELECT key FROM summary_cache ORDER BY last_used_at"
+            " LIMIT max(0, (SELECT COUNT(*) FROM summary_cache) - ?))",
+            (SUMMARY_CACHE_MAX_ENTRIES,),
+        )
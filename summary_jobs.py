@@ -0,0 +1,89 @@
+"""Bounded background pool for AI profile summary generation."""
+import asyncio
+import functools
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, Optional, TypeVar
+
+SUMMARY_WORKERS = int(os.getenv("SUMMARY_WORKERS", "4"))
+SUMMARY_QUEUE_LIMIT = int(os.getenv("SUMMARY_QUEUE_LIMIT", "100"))
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+
+class QueueFull(Exception):
+    """Raised when too many summary jobs are already waiting."""
+
+
+class SummaryJobs:
+    """Runs summary jobs on a fixed number of worker threads.
+
+    At most ``max_workers`` jobs execute at once and at most ``queue_limit``
+    jobs may be waiting or running; further submissions raise ``QueueFull``
+    so a burst of requests cannot build an unbounded backlog.
+    """
+
+    def __init__(self, max_workers: int = SUMMARY_WORKERS, queue_limit: int = SUMMARY_QUEUE_LIMIT) -> None:
+        self.max_workers = max_workers
+        self.queue_limit = queue_limit
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="summary")
+        self._lock = threading.Lock()
+        self.pending = 0
+        self.completed = 0
+        self.failed = 0
+        self.busy_seconds = 0.0
+        self._first_submit: Optional[float] = None
+        self._last_done: Optional[float] = None
+
+    async def run(self, func: Callable[..., T], *args: Any) -> T:
+        """Run ``func(*args)`` on the pool and await its result."""
+        with self._lock:
+            if self.pending >= self.queue_limit:
+                raise QueueFull()
+            self.pending += 1
+            if self._first_submit is None:
+                self._first_submit = time.perf_counter()
+        loop = asyncio.get_running_loop()
+        try:
+            result = await loop.run_in_executor(self._executor, functools.partial(self._timed, func, *args))
+        except Exception:
+            with self._lock:
+                self.failed += 1
+            raise
+        finally:
+            with self._lock:
+                self.pending -= 1
+                self._last_done = time.perf_counter()
+        with self._lock:
+            self.completed += 1
+        return result
+
+    def _timed(self, func: Callable[..., T], *args: Any) -> T:
+        start = time.perf_counter()
+        try:
+            return func(*args)
+        finally:
+            with self._lock:
+                self.busy_seconds += time.perf_counter() - start
+
+    def stats(self) -> Dict[str, float]:
+        """Counters plus throughput in jobs per second since the first job."""
+        with self._lock:
+            elapsed = 0.0
+            if self._first_submit is not None and self._last_done is not None:
+                elapsed = self._last_done - self._first_submit
+            return {
+                'pending': self.pending,
+                'completed': self.completed,
+                'failed': self.failed,
+                'jobs_per_second': self.completed / elapsed if elapsed > 0 else 0.0,
+                'avg_job_seconds': self.busy_seconds / self.completed if self.completed else 0.0,
+            }
+
+    def shutdown(self) -> None:
+        self._executor.shutdown(wait=True)
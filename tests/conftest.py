@@ -0,0 +1,20 @@
+import os
+import sys
+
+import pytest
+
+# The modules live in the repository root, next to main.py
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import db  # noqa: E402
+
+
+@pytest.fixture
+def database(tmp_path, monkeypatch):
+    """Point the connection pool at a fresh, migrated database file."""
+    monkeypatch.setattr(db, "DB_FILE", db.DB_FILE)
+    path = str(tmp_path / "teamfinder.db")
+    db.configure(path)
+    db.schema_version()
+    yield path
+    db.close()
@@ -0,0 +1,64 @@
+import io
+
+import pytest
+
+import bulk
+import credits
+import db
+import ledger
+
+
+def export(fmt):
+    out = io.StringIO()
+    with db.transaction() as conn:
+        conn.execute("BEGIN")
+        bulk.write_records(bulk.export_records(conn), out, fmt)
+    return out.getvalue()
+
+
+@pytest.mark.parametrize("fmt", ["jsonl", "csv"])
+def test_round_trip_keeps_profiles_payments_and_credits(database, tmp_path, fmt):
+    with db.transaction() as conn:
+        conn.execute(
+            "INSERT INTO users (id, name, username, skills, vip_until) VALUES (1, 'Ann', 'ann', 'Python', 1790000000)"
+        )
+        conn.execute("INSERT INTO users (id, name) VALUES (2, 'Bob')")
+        conn.execute("INSERT INTO projects (user_id, created_at, text) VALUES (1, 1700000000.0, 'A game')")
+        ledger.record_purchase("charge-1", 1, "find_team", 3, conn, 1700000000.0)
+        credits.grant(conn, 1, credits.FIND_TEAM, 2)
+        credits.grant(conn, 2, credits.ABOUT_ME)
+    exported = export(fmt)
+    record = next(bulk.read_records(io.StringIO(exported), fmt))
+    assert record['credits'] == {credits.FIND_TEAM: 2}
+
+    db.configure(str(tmp_path / "imported.db"))
+    users, payments = bulk.import_records(bulk.read_records(io.StringIO(exported), fmt))
+    assert (users, payments) == (2, 1)
+    assert export(fmt) == exported
+    with db.transaction() as conn:
+        assert credits.balance(conn, 1, credits.FIND_TEAM) == 2
+        assert credits.balance(conn, 2, credits.ABOUT_ME) == 1
+
+
+def test_import_replaces_credits_of_records_that_have_them(database):
+    with db.transaction() as conn:
+        conn.executemany("INSERT INTO users (id, name) VALUES (?, ?)", [(1, "Ann"), (2, "Bob")])
+        credits.grant(conn, 1, credits.FIND_TEAM, 5)
+        credits.grant(conn, 2, credits.FIND_TEAM, 5)
+    bulk.import_records([{'id': 1, 'name': 'Ann', 'credits': {credits.ABOUT_ME: 1}}, {'id': 2, 'name': 'Bob'}])
+    with db.transaction() as conn:
+        assert credits.balance(conn, 1, credits.FIND_TEAM) == 0
+        assert credits.balance(conn, 1, credits.ABOUT_ME) == 1
+        # A record without credits leaves them alone
+        assert credits.balance(conn, 2, credits.FIND_TEAM) == 5
+
+
+def test_import_drops_stored_recommendations(database):
+    with db.transaction() as conn:
+        conn.executemany("INSERT INTO users (id, name) VALUES (?, ?)", [(1, "Ann"), (2, "Bob")])
+        conn.executemany(
+            "INSERT INTO recommendations (user_id, candidates, computed_at) VALUES (?, ?, 0)",
+            [(1, "[[2, 1.0]]"), (2, "[[1, 1.0]]")],
+        )
+    bulk.import_records([{'id': 2, 'name': 'Bob', 'skills': 'Python'}])
+    assert db.fetchall("SELECT user_id FROM recommendations") == []
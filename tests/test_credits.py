@@ -0,0 +1,100 @@
+import asyncio
+
+import pytest
+
+import credits
+import db
+from credits import CreditCache
+from skill_index import SkillIndex
+from summary_jobs import QueueFull
+
+
+@pytest.fixture
+def main(database, monkeypatch):
+    import main
+
+    # Module-level caches must not carry state between databases
+    main.skill_catalog.invalidate()
+    monkeypatch.setattr(main, "skill_index", SkillIndex())
+    main.vip_cache.clear()
+    credits.cache.clear()
+    with db.transaction() as conn:
+        conn.executemany("INSERT INTO users (id, name, username) VALUES (?, ?, ?)", [(1, "Ann", "ann"), (2, "Bob", "bob")])
+        credits.grant(conn, 1, credits.FIND_TEAM)
+        credits.grant(conn, 1, credits.ABOUT_ME)
+    main.set_skills(2, "Python")
+    return main
+
+
+def balance(feature):
+    with db.transaction() as conn:
+        return credits.balance(conn, 1, feature)
+
+
+def test_find_team_spends_the_credit_only_when_someone_is_found(main):
+    result, _ = main.find_team_members(1, "python", credits.FIND_TEAM)
+    assert "set your skills first" in result
+    main.set_skills(1, "SQL")
+    result, _ = main.find_team_members(1, "", credits.FIND_TEAM)
+    assert "Please specify some skills" in result
+    result, _ = main.find_team_members(1, "cobol", credits.FIND_TEAM)
+    assert "No team members found" in result
+    assert balance(credits.FIND_TEAM) == 1
+
+    result, _ = main.find_team_members(1, "python", credits.FIND_TEAM)
+    assert "Bob" in result
+    assert balance(credits.FIND_TEAM) == 0
+    result, _ = main.find_team_members(1, "python", credits.FIND_TEAM)
+    assert "already been used" in result
+
+
+def test_checking_access_does_not_spend(main):
+    assert asyncio.run(main.check_access(1, credits.FIND_TEAM, spend=False)) == credits.CREDIT
+    assert balance(credits.FIND_TEAM) == 1
+    assert asyncio.run(main.check_access(2, credits.FIND_TEAM, spend=False)) is None
+
+
+class Bot:
+    def __init__(self):
+        self.messages = []
+
+    async def send_message(self, chat_id, text, **kwargs):
+        self.messages.append(text)
+
+
+class Context:
+    def __init__(self):
+        self.bot = Bot()
+
+
+@pytest.mark.parametrize("error", [QueueFull(), RuntimeError("model unavailable")])
+def test_failed_summary_gives_the_credit_back(main, monkeypatch, error):
+    async def run(func, *args):
+        raise error
+
+    monkeypatch.setattr(main.summary_jobs, "run", run)
+    assert main.use_feature(1, credits.ABOUT_ME) == credits.CREDIT
+    assert balance(credits.ABOUT_ME) == 0
+    context = Context()
+    asyncio.run(main.generate_about_user(context, 1, 1, credits.ABOUT_ME))
+    assert balance(credits.ABOUT_ME) == 1
+    assert context.bot.messages
+
+
+def test_cache_refuses_a_balance_read_before_a_purchase():
+    cache = CreditCache()
+    since = cache.version()
+    # A purchase commits and invalidates while the spend that read 0 is returning
+    cache.invalidate(1)
+    cache.set(1, credits.FIND_TEAM, 0, since)
+    assert cache.balance(1, credits.FIND_TEAM) is None
+    cache.set(1, credits.FIND_TEAM, 0, cache.version())
+    assert cache.balance(1, credits.FIND_TEAM) == 0
+
+
+def test_cache_refuses_balances_older_than_a_clear():
+    cache = CreditCache()
+    since = cache.version()
+    cache.clear()
+    cache.set(1, credits.FIND_TEAM, 0, since)
+    assert cache.balance(1, credits.FIND_TEAM) is None
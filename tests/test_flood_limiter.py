@@ -0,0 +1,33 @@
+import asyncio
+import warnings
+
+import pytest
+from telegram.error import RetryAfter
+
+from flood_limiter import FloodLimiter
+
+
+@pytest.mark.parametrize("timedelta_values", [False, True])
+def test_retry_after_pauses_for_the_requested_time(monkeypatch, timedelta_values):
+    if timedelta_values:
+        monkeypatch.setenv("PTB_TIMEDELTA", "true")
+    else:
+        monkeypatch.delenv("PTB_TIMEDELTA", raising=False)
+    limiter = FloodLimiter()
+    pauses = []
+    monkeypatch.setattr(limiter.global_bucket, "pause", pauses.append)
+    calls = []
+
+    async def send():
+        calls.append(1)
+        if len(calls) == 1:
+            raise RetryAfter(3)
+        return "sent"
+
+    with warnings.catch_warnings():
+        # Reading retry_after as an int is deprecated in favour of PTB_TIMEDELTA
+        warnings.simplefilter("ignore", DeprecationWarning)
+        result = asyncio.run(limiter.process_request(send, (), {}, "sendMessage", {"chat_id": 1}, None))
+    assert result == "sent"
+    assert pauses == [pytest.approx(3.1)]
+    assert limiter.retries == 1
@@ -0,0 +1,11 @@
+import db
+import ledger
+
+
+def test_top_buyers_are_ranked_by_net_spend(database):
+    with db.transaction() as conn:
+        ledger.record_purchase("a1", 1, "vip", 100, conn)
+        ledger.record_purchase("a2", 1, "vip", 100, conn)
+        ledger.record_purchase("b1", 2, "vip", 150, conn)
+        ledger.record_refund("a2", 1, conn)
+    assert [(buyer['user_id'], buyer['spent']) for buyer in ledger.top_buyers(2)] == [(2, 150), (1, 100)]
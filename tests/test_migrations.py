@@ -0,0 +1,109 @@
+import sqlite3
+from datetime import datetime
+
+import pytest
+
+import migrations
+from migrations import LATEST_VERSION, MIGRATIONS, check_plans, current_version, migrate
+
+# The database the bot shipped with before migrations existed
+LEGACY_SCHEMA = """
+CREATE TABLE users (
+    id INTEGER PRIMARY KEY,
+    name TEXT,
+    username TEXT,
+    phone_number TEXT,
+    email TEXT,
+    skills TEXT,
+    preferences TEXT,
+    portfolio TEXT,
+    about_user TEXT,
+    vip_until TEXT
+);
+CREATE INDEX idx_users_id ON users(id);
+CREATE INDEX idx_users_username ON users(username);
+CREATE INDEX idx_users_skills ON users(skills);
+"""
+
+VIP_UNTIL = datetime(2026, 11, 1, 12, 30)
+
+
+def connect(path):
+    conn = sqlite3.connect(path, isolation_level=None)
+    yield conn
+    conn.close()
+
+
+@pytest.fixture
+def fresh(tmp_path):
+    yield from connect(str(tmp_path / "fresh.db"))
+
+
+@pytest.fixture
+def legacy(tmp_path):
+    for conn in connect(str(tmp_path / "legacy.db")):
+        conn.executescript(LEGACY_SCHEMA)
+        conn.executemany(
+            "INSERT INTO users (id, name, skills, portfolio, vip_until) VALUES (?, ?, ?, ?, ?)",
+            [
+                (1, "Ann", "Python, SQL", "Bot for a shop\n\nA game", VIP_UNTIL.isoformat()),
+                (2, "Bob", "go", None, None),
+                (3, "Eve", None, None, "not a date"),
+            ],
+        )
+        yield conn
+
+
+def indexes(conn):
+    return {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'index'")}
+
+
+def assert_plans(conn, version):
+    for migration in MIGRATIONS[:version]:
+        for plan in migration.plans:
+            details = " | ".join(row[3] for row in conn.execute(f"EXPLAIN QUERY PLAN {plan.sql}", plan.params))
+            assert plan.uses in details, f"migration {migration.version}: {plan.sql}"
+
+
+@pytest.mark.parametrize("version", range(1, LATEST_VERSION + 1))
+@pytest.mark.parametrize("database", ["fresh", "legacy"])
+def test_each_version_uses_its_indexes(request, monkeypatch, database, version):
+    conn = request.getfixturevalue(database)
+    monkeypatch.setattr(migrations, "MIGRATIONS", MIGRATIONS[:version])
+    assert migrate(conn) == version
+    assert_plans(conn, version)
+    assert check_plans(conn) == []
+
+
+def test_fresh_database(fresh):
+    assert migrate(fresh) == LATEST_VERSION
+    assert not {"idx_users_id", "idx_users_skills", "idx_users_username"} & indexes(fresh)
+    assert fresh.execute("SELECT count(*) FROM users").fetchone()[0] == 0
+    # Migrating again is a no-op
+    assert migrate(fresh) == LATEST_VERSION
+
+
+def test_legacy_database(legacy):
+    assert current_version(legacy) == 0
+    assert migrate(legacy) == LATEST_VERSION
+    assert not {"idx_users_id", "idx_users_skills", "idx_users_username"} & indexes(legacy)
+
+    rows = legacy.execute("SELECT id, vip_until, typeof(vip_until) FROM users ORDER BY id").fetchall()
+    assert rows == [(1, int(VIP_UNTIL.timestamp()), "integer"), (2, None, "null"), (3, None, "null")]
+    projects = legacy.execute("SELECT text FROM projects WHERE user_id = 1 ORDER BY id").fetchall()
+    assert projects == [("Bot for a shop",), ("A game",)]
+    skills = legacy.execute(
+        "SELECT s.name FROM user_skills us JOIN skills s ON s.id = us.skill_id WHERE us.user_id = 1"
+    ).fetchall()
+    assert {"python", "sql"} <= {name for name, in skills}
+    # The rebuilt users table kept its search triggers
+    legacy.execute("UPDATE users SET about_user = 'rust wizard' WHERE id = 2")
+    assert legacy.execute("SELECT rowid FROM profile_search WHERE profile_search MATCH 'wizard'").fetchall() == [(2,)]
+
+
+def test_check_plans_reports_a_missing_index(fresh):
+    migrate(fresh)
+    fresh.execute("DROP INDEX idx_saved_search_skills_user")
+    problems = check_plans(fresh)
+    assert len(problems) == 1
+    assert "idx_saved_search_skills_user" in problems[0]
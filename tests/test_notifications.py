@@ -0,0 +1,75 @@
+import asyncio
+
+import pytest
+from telegram.error import TimedOut
+
+import db
+import notifications
+from notifications import NEW_MATCH, Notifier
+from skills import SkillCatalog, store_user_skills
+
+
+class Crash(BaseException):
+    """The process dying mid-run."""
+
+
+class Bot:
+    """Records sends; raises ``errors[chat_id]`` for the chats listed there."""
+
+    def __init__(self, errors=None, crash_after=None):
+        self.errors = errors or {}
+        self.crash_after = crash_after
+        self.sent = []
+
+    async def send_message(self, chat_id, text, **kwargs):
+        if self.crash_after is not None and len(self.sent) >= self.crash_after:
+            raise Crash()
+        if chat_id in self.errors:
+            raise self.errors[chat_id]
+        self.sent.append(chat_id)
+
+
+def sent_rows():
+    return db.fetchall("SELECT user_id, key, status FROM notifications_sent WHERE kind = ? ORDER BY user_id", (NEW_MATCH,))
+
+
+@pytest.fixture
+def alerts(database):
+    """Searchers 1-10 each saved a search for python; user 100 just added it."""
+    catalog = SkillCatalog()
+    with db.transaction() as conn:
+        for user_id in (*range(1, 11), 100):
+            conn.execute("INSERT INTO users (id, name) VALUES (?, ?)", (user_id, f"user{user_id}"))
+        store_user_skills(conn, catalog, 100, "python")
+        for searcher_id in range(1, 11):
+            notifications.save_search(conn, searcher_id, catalog.ids(["python"], conn))
+        notifications.record_profile_change(conn, 100)
+
+
+def test_each_alert_is_recorded_as_it_is_sent(alerts):
+    bot = Bot(crash_after=3)
+    notifier = Notifier(lambda user_ids: "someone", concurrency=1)
+    with pytest.raises(Crash):
+        asyncio.run(notifier.send_match_alerts(bot))
+    assert [row[0] for row in sent_rows()] == bot.sent
+
+    # The next run only alerts the searchers that were not reached
+    bot = Bot()
+    asyncio.run(notifier.send_match_alerts(bot))
+    assert len(bot.sent) == 7
+    assert [row[0] for row in sent_rows()] == list(range(1, 11))
+    assert db.fetchone("SELECT count(*) FROM profile_events")[0] == 0
+
+
+def test_deferred_alert_is_given_up_after_max_attempts(alerts):
+    bot = Bot(errors={4: TimedOut()})
+    notifier = Notifier(lambda user_ids: "someone", max_attempts=3)
+    for run in range(2):
+        asyncio.run(notifier.send_match_alerts(bot))
+        # The events stay queued while the alert to user 4 is retried
+        assert db.fetchone("SELECT count(*) FROM profile_events")[0] == 1
+    asyncio.run(notifier.send_match_alerts(bot))
+    assert db.fetchone("SELECT count(*) FROM profile_events")[0] == 0
+    assert (4, "100", notifications.GAVE_UP) in sent_rows()
+    assert sorted(bot.sent) == [user_id for user_id in range(1, 11) if user_id != 4]
+    assert notifier.stats()['gave_up'] == 1
@@ -0,0 +1,204 @@
+import asyncio
+import time
+
+import pytest
+from telegram.error import Forbidden
+
+import credits
+import db
+import ledger
+import payments
+
+
+@pytest.fixture
+def buyer(database):
+    with db.transaction() as conn:
+        conn.execute("INSERT INTO users (id, name, username) VALUES (1, 'Ann', 'ann')")
+    credits.cache.clear()
+    return 1
+
+
+def balance(feature):
+    with db.transaction() as conn:
+        return credits.balance(conn, 1, feature)
+
+
+def vip_until():
+    return db.fetchone("SELECT vip_until FROM users WHERE id = 1")[0]
+
+
+def jobs():
+    return db.fetchall("SELECT status, attempts, next_attempt_at FROM fulfilment_jobs")
+
+
+def test_repeated_charge_is_granted_once(buyer):
+    assert payments.record_payment("v1", buyer, buyer, "vip", 100)
+    until = vip_until()
+    assert not payments.record_payment("v1", buyer, buyer, "vip", 100)
+    assert vip_until() == until
+    assert db.fetchone("SELECT count(*) FROM payments")[0] == 1
+    assert len(jobs()) == 1
+
+
+def test_vip_purchase_stacks_on_an_active_subscription(buyer):
+    active_until = int(time.time()) + 10 * 86400
+    db.execute("UPDATE users SET vip_until = ? WHERE id = 1", (active_until,))
+    payments.record_payment("v1", buyer, buyer, "vip", 100)
+    assert vip_until() == active_until + payments.VIP_DAYS * 86400
+
+
+async def fulfil_pending(queue):
+    """Make every pending job due, as if its backoff had passed, and run them once."""
+    db.execute("UPDATE fulfilment_jobs SET next_attempt_at = 0 WHERE status = 'pending'")
+    queue.start(None)
+    try:
+        queue.notify()
+        await queue.wait_idle()
+    finally:
+        await queue.close()
+
+
+def test_failing_fulfilment_backs_off_then_grants_the_fallback_credit(buyer):
+    async def broken(bot, job):
+        raise RuntimeError("model unavailable")
+
+    payments.record_payment("a1", buyer, buyer, "about_user_dict", 20)
+    queue = payments.FulfilmentQueue({}, broken, max_attempts=3, retry_seconds=100)
+    before = time.time()
+    asyncio.run(fulfil_pending(queue))
+    status, attempts, next_attempt_at = jobs()[0]
+    assert (status, attempts) == (payments.PENDING, 1)
+    assert before + 100 <= next_attempt_at <= time.time() + 100
+
+    before = time.time()
+    asyncio.run(fulfil_pending(queue))
+    status, attempts, next_attempt_at = jobs()[0]
+    assert (status, attempts) == (payments.PENDING, 2)
+    assert before + 200 <= next_attempt_at <= time.time() + 200
+    assert balance(credits.ABOUT_ME) == 0
+
+    asyncio.run(fulfil_pending(queue))
+    assert jobs()[0][:2] == (payments.FAILED, 3)
+    assert (queue.retried, queue.failed) == (2, 1)
+    assert balance(credits.ABOUT_ME) == 1
+
+
+def test_blocked_buyer_gets_the_fallback_credit_without_retries(buyer):
+    async def blocked(bot, job):
+        raise Forbidden("bot was blocked by the user")
+
+    payments.record_payment("a1", buyer, buyer, "about_user_dict", 20)
+    queue = payments.FulfilmentQueue({}, blocked)
+    asyncio.run(fulfil_pending(queue))
+    assert jobs()[0][:2] == (payments.FAILED, 1)
+    assert balance(credits.ABOUT_ME) == 1
+    # A second give-up (e.g. a racing worker) does not grant again
+    payments.fail_job(payments.Job("a1", buyer, buyer, "about_user_dict", 1))
+    assert balance(credits.ABOUT_ME) == 1
+
+
+def test_successful_fulfilment_grants_no_credit(buyer):
+    async def deliver(bot, job):
+        pass
+
+    payments.record_payment("a1", buyer, buyer, "about_user_dict", 20)
+    queue = payments.FulfilmentQueue({}, deliver)
+    asyncio.run(fulfil_pending(queue))
+    assert jobs()[0][:2] == (payments.DONE, 1)
+    assert balance(credits.ABOUT_ME) == 0
+
+
+def test_refund_takes_back_an_unspent_credit(buyer):
+    assert payments.record_payment("c1", buyer, buyer, "find_team", 50)
+    assert balance(credits.FIND_TEAM) == 1
+    revocation = payments.revoke_payment("c1", buyer)
+    assert revocation.credit == credits.FIND_TEAM
+    assert balance(credits.FIND_TEAM) == 0
+
+
+def test_refund_is_refused_once_the_credit_is_spent(buyer):
+    payments.record_payment("c1", buyer, buyer, "find_team", 50)
+    with db.transaction() as conn:
+        credits.spend(conn, buyer, credits.FIND_TEAM)
+    with pytest.raises(payments.RefundRefused):
+        payments.revoke_payment("c1", buyer)
+
+
+def test_refund_rolls_back_the_vip_extension(buyer):
+    payments.record_payment("v1", buyer, buyer, "vip", 100)
+    first = vip_until()
+    payments.record_payment("v2", buyer, buyer, "vip", 100)
+    revocation = payments.revoke_payment("v2", buyer)
+    assert revocation.vip_seconds == payments.VIP_DAYS * 86400
+    assert vip_until() == first
+
+
+def test_failed_refund_restores_the_entitlement(buyer):
+    payments.record_payment("c1", buyer, buyer, "find_team", 50)
+    payments.record_payment("v1", buyer, buyer, "vip", 100)
+    until = vip_until()
+    for charge_id in ("c1", "v1"):
+        payments.restore_payment(buyer, payments.revoke_payment(charge_id, buyer))
+    assert balance(credits.FIND_TEAM) == 1
+    assert vip_until() == until
+
+
+def test_refunded_payment_cannot_be_revoked_again(buyer):
+    payments.record_payment("v1", buyer, buyer, "vip", 100)
+    payments.revoke_payment("v1", buyer)
+    ledger.record_refund("v1", buyer)
+    with pytest.raises(payments.RefundRefused):
+        payments.revoke_payment("v1", buyer)
+
+
+def test_refund_waits_for_a_pending_fulfilment(buyer):
+    payments.record_payment("a1", buyer, buyer, "about_user_dict", 20)
+    with pytest.raises(payments.RefundRefused):
+        payments.revoke_payment("a1", buyer)
+
+
+class Message:
+    def __init__(self):
+        self.replies = []
+
+    async def reply_text(self, text, **kwargs):
+        self.replies.append(text)
+
+
+class User:
+    id = 1
+
+
+class Update:
+    def __init__(self):
+        self.message = Message()
+        self.effective_user = User()
+
+
+class Bot:
+    def __init__(self, success):
+        self.success = success
+
+    async def refund_star_payment(self, user_id, telegram_payment_charge_id):
+        return self.success
+
+
+class Context:
+    def __init__(self, charge_id, success):
+        self.args = [charge_id]
+        self.bot = Bot(success)
+
+
+@pytest.mark.parametrize("success", [True, False])
+def test_refund_command_revokes_vip_only_when_refunded(buyer, success):
+    import main
+
+    main.vip_cache.clear()
+    payments.record_payment("v1", buyer, buyer, "vip", 100)
+    assert main.vip_cache.is_vip(buyer)
+    update = Update()
+    asyncio.run(main.refund_command(update, Context("v1", success)))
+    refunded = db.fetchone("SELECT refunded_at FROM payments WHERE charge_id = 'v1'")[0]
+    assert (refunded is not None) == success
+    assert (vip_until() <= time.time()) == success
+    assert main.vip_cache.is_vip(buyer) != success
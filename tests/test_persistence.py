@@ -0,0 +1,86 @@
+import asyncio
+import json
+import threading
+
+import db
+import persistence
+from persistence import SQLitePersistence
+
+
+def state_of(name, key):
+    row = db.fetchone(
+        "SELECT state FROM conversations WHERE name = ? AND key = ?", (name, json.dumps(list(key)))
+    )
+    return None if row is None else json.loads(row[0])
+
+
+async def wait_for(check, timeout=5.0):
+    deadline = asyncio.get_running_loop().time() + timeout
+    while not await db.run(check):
+        assert asyncio.get_running_loop().time() < deadline, "change was not persisted"
+        await asyncio.sleep(0.01)
+
+
+def test_change_made_during_a_flush_is_written(database, monkeypatch):
+    store = SQLitePersistence()
+    writing = threading.Event()
+    release = threading.Event()
+    transaction = db.transaction
+
+    def slow_transaction():
+        # Called once the batch has been taken from the dirty dicts
+        writing.set()
+        release.wait(5)
+        return transaction()
+
+    monkeypatch.setattr(db, "transaction", slow_transaction)
+
+    async def go():
+        await store.update_conversation("team", (1, 1), 1)
+        await asyncio.to_thread(writing.wait, 5)
+        # The first batch is already taken; this change must not wait for another update
+        await store.update_conversation("team", (1, 1), 2)
+        release.set()
+        await wait_for(lambda: state_of("team", (1, 1)) == 2)
+
+    asyncio.run(go())
+
+
+def test_failed_write_is_retried_without_new_changes(database, monkeypatch):
+    monkeypatch.setattr(persistence, "PERSISTENCE_RETRY_SECONDS", 0.01)
+    store = SQLitePersistence()
+    transaction = db.transaction
+    failures = []
+
+    def flaky_transaction():
+        if not failures:
+            failures.append(1)
+            raise RuntimeError("database is locked")
+        return transaction()
+
+    monkeypatch.setattr(db, "transaction", flaky_transaction)
+
+    async def go():
+        await store.update_user_data(1, {"lang": "en"})
+        await wait_for(lambda: db.fetchone("SELECT data FROM persisted_data WHERE kind = 'user' AND id = 1"))
+
+    asyncio.run(go())
+    assert failures == [1]
+
+
+def test_flushed_state_is_loaded_by_a_new_instance(database):
+    async def write():
+        store = SQLitePersistence()
+        await store.get_user_data()
+        await store.update_conversation("team", (1, 1), 3)
+        await store.update_conversation("team", (2, 2), 1)
+        await store.update_conversation("team", (2, 2), None)
+        await store.update_user_data(1, {"lang": "en"})
+        await store.flush()
+
+    async def read():
+        store = SQLitePersistence()
+        return await store.get_conversations("team"), await store.get_user_data()
+
+    asyncio.run(write())
+    assert asyncio.run(read()) == ({(1, 1): 3}, {1: {"lang": "en"}})
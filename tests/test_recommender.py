@@ -0,0 +1,50 @@
+import time
+
+from recommender import Recommender
+
+
+def recommender(rows, **kwargs):
+    rec = Recommender(lambda user_ids: [rows[user_id] for user_id in (rows if user_ids is None else user_ids)], **kwargs)
+    with rec._lock:
+        for row in rows.values():
+            rec._set_profile(row)
+    return rec
+
+
+def test_neighbours_prefer_rare_terms_and_are_capped():
+    # Everyone knows skill 1; only users 0-4 share skill 2
+    rows = {user_id: (user_id, [1, 2] if user_id < 5 else [1], None, 0) for user_id in range(1000)}
+    rec = recommender(rows, max_candidates=50)
+    neighbours = rec._neighbours(rec._profiles[0])
+    assert len(neighbours) <= 50
+    assert set(range(5)) <= neighbours
+
+
+def test_lists_containing_a_user_are_patched_beyond_the_cap():
+    rows = {user_id: (user_id, [1, 100 + user_id], None, 0) for user_id in range(200)}
+    rec = recommender(rows, k=3, max_candidates=10)
+    with rec._lock:
+        for user_id in rows:
+            rec._recompute(user_id)
+        listed_in = set(rec._listed_in[1])
+        assert len(listed_in) > rec.max_candidates
+        # User 1 no longer shares anything with anyone
+        rows[1] = (1, [999], None, 0)
+        rec._apply_change(1, rows[1])
+    for owner in listed_in:
+        assert all(candidate != 1 for candidate, _ in rec._lists[owner])
+    assert not rec._listed_in[1]
+
+
+def test_patching_resumes_after_the_deadline():
+    rows = {user_id: (user_id, [1, 2], None, 0) for user_id in range(500)}
+    rec = recommender(rows, k=5, max_candidates=1000)
+    with rec._lock:
+        for user_id in rows:
+            rec._recompute(user_id)
+        rows[0] = (0, [1, 2, 3, 4, 5], None, 3)
+        rec._apply_change(0, rows[0], deadline=time.monotonic() - 1)
+    assert len(rec._unpatched[0]) < 499
+    rec.refresh(time.monotonic() + 10)
+    assert not rec._unpatched
+    assert all(rec._lists[owner][0][0] == 0 for owner in range(1, 500))
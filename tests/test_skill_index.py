@@ -0,0 +1,52 @@
+import random
+
+import pytest
+
+import skill_index
+from skill_index import SkillIndex
+
+pytest.importorskip("numpy")
+
+
+def test_updates_do_not_rebuild_skill_arrays():
+    index = SkillIndex(vectorized=True)
+    index.load((user_id, user_id % 3) for user_id in range(1000))
+    arrays = dict(index._rows_by_skill)
+    index.update(5000, [0, 1])
+    index.update(3, [])
+    index.top([0, 1, 2], 10)
+    # The same arrays are scored; the changes are kept aside until merged
+    assert all(index._rows_by_skill[skill_id] is rows for skill_id, rows in arrays.items())
+    assert index._added_rows[0] == {index._row_of_user[5000]}
+    assert index._removed_rows[0] == {index._row_of_user[3]}
+
+
+def test_pending_changes_are_merged(monkeypatch):
+    monkeypatch.setattr(skill_index, "SKILL_INDEX_MERGE_MIN", 4)
+    index = SkillIndex(vectorized=True)
+    index.load((user_id, 1) for user_id in range(10))
+    for user_id in range(100, 110):
+        index.update(user_id, [1])
+    index.top([1], 5)
+    assert 1 not in index._added_rows
+    assert len(index._rows_by_skill[1]) == 20
+
+
+@pytest.mark.parametrize("merge_min", [0, 3, 64])
+def test_vectorized_matches_sets_after_updates(monkeypatch, merge_min):
+    monkeypatch.setattr(skill_index, "SKILL_INDEX_MERGE_MIN", merge_min)
+    rng = random.Random(merge_min)
+    rows = [(user_id, skill_id) for user_id in range(300) for skill_id in rng.sample(range(20), 3)]
+    vectorized, sets = SkillIndex(vectorized=True), SkillIndex(vectorized=False)
+    vectorized.load(rows)
+    sets.load(rows)
+    for step in range(2000):
+        user_id = rng.randrange(400)
+        skills = rng.sample(range(22), rng.randrange(4))
+        vectorized.update(user_id, skills)
+        sets.update(user_id, skills)
+        if step % 50 == 0:
+            query = [rng.randrange(22) for _ in range(rng.randrange(1, 5))]
+            include = [rng.randrange(400) for _ in range(3)]
+            assert vectorized.top(query, 10, user_id, include) == sets.top(query, 10, user_id, include)
+            assert vectorized.top(query, 0) == sets.top(query, 0)
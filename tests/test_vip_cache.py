@@ -0,0 +1,114 @@
+import threading
+from datetime import datetime, timedelta
+
+from vip_cache import VipCache
+
+
+class Clock:
+    def __init__(self) -> None:
+        self.now = datetime(2026, 1, 1, 12, 0)
+
+    def __call__(self) -> datetime:
+        return self.now
+
+
+def epoch(when: datetime) -> int:
+    return int(when.timestamp())
+
+
+def test_active_entry_expires_at_vip_until():
+    clock = Clock()
+    rows = {1: epoch(clock.now + timedelta(hours=1))}
+    loads = []
+    cache = VipCache(lambda user_id: loads.append(user_id) or rows.get(user_id), clock)
+
+    assert cache.is_vip(1)
+    assert cache.is_vip(1)
+    assert loads == [1]
+
+    clock.now += timedelta(hours=1)
+    rows[1] = None
+    assert cache.cached(1) is None
+    assert not cache.is_vip(1)
+    assert loads == [1, 1]
+
+
+def test_negative_entry_expires_after_ttl():
+    clock = Clock()
+    rows = {}
+    loads = []
+    cache = VipCache(lambda user_id: loads.append(user_id) or rows.get(user_id), clock, negative_ttl=timedelta(minutes=5))
+
+    assert not cache.is_vip(1)
+    assert cache.cached(1) is False
+
+    # Another process sold a subscription; it shows up once the entry expires
+    rows[1] = epoch(clock.now + timedelta(days=30))
+    clock.now += timedelta(minutes=4)
+    assert not cache.is_vip(1)
+    clock.now += timedelta(minutes=1)
+    assert cache.is_vip(1)
+    assert loads == [1, 1]
+
+
+def test_expired_vip_until_is_cached_as_not_vip():
+    clock = Clock()
+    cache = VipCache(lambda user_id: epoch(clock.now - timedelta(days=1)), clock)
+    assert cache.active_until(1) is None
+    assert cache.cached(1) is False
+
+
+def test_purchase_during_lookup_is_not_overwritten():
+    clock = Clock()
+    until = clock.now + timedelta(days=30)
+    loading = threading.Event()
+    purchased = threading.Event()
+
+    def loader(user_id):
+        # The lookup read the row before the purchase committed
+        loading.set()
+        purchased.wait(5)
+        return None
+
+    cache = VipCache(loader, clock)
+    lookup = threading.Thread(target=cache.active_until, args=(1,))
+    lookup.start()
+    assert loading.wait(5)
+    cache.set(1, until)
+    purchased.set()
+    lookup.join(5)
+
+    assert cache.cached(1) is True
+    assert cache.active_until(1) == until
+
+
+def test_invalidate_during_lookup_drops_stale_fill():
+    clock = Clock()
+    cache = VipCache(lambda user_id: None, clock)
+    since = cache.version()
+    cache.invalidate(1)
+    # A value read before the invalidation is returned but not cached
+    assert cache.remember(1, None, since) is None
+    assert cache.cached(1) is None
+    assert cache.remember(1, None, cache.version()) is None
+    assert cache.cached(1) is False
+
+
+def test_stale_fill_after_changes_forgotten():
+    clock = Clock()
+    cache = VipCache(lambda user_id: None, clock)
+    since = cache.version()
+    cache.clear()
+    assert cache.remember(1, None, since) is None
+    assert cache.cached(1) is None
+
+
+def test_max_entries_evicts_least_recent():
+    clock = Clock()
+    cache = VipCache(lambda user_id: None, clock, max_entries=2)
+    cache.is_vip(1)
+    cache.is_vip(2)
+    cache.is_vip(1)
+    cache.is_vip(3)
+    assert cache.cached(1) is False
+    assert cache.cached(2) is None
@@ -0,0 +1,104 @@
+import asyncio
+import functools
+import json
+
+from telegram.ext import Application, CommandHandler
+
+import metrics
+from loadtest import FAKE_TOKEN, RecordingRequest
+from webhook import SECRET_HEADER, WebhookServer, run_webhook
+
+SECRET = "s3cret"
+
+# A /ping message as Telegram delivers it to a webhook
+UPDATE = {
+    "update_id": 1,
+    "message": {
+        "message_id": 7,
+        "date": 1700000000,
+        "chat": {"id": 42, "type": "private"},
+        "from": {"id": 42, "is_bot": False, "first_name": "Ann"},
+        "text": "/ping",
+        "entities": [{"type": "bot_command", "offset": 0, "length": 5}],
+    },
+}
+
+
+async def post(port, body, secret):
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    writer.write(
+        f"POST /telegram HTTP/1.1\r\nHost: localhost\r\nContent-Type: application/json\r\n"
+        f"Content-Length: {len(body)}\r\n{SECRET_HEADER}: {secret}\r\nConnection: close\r\n\r\n".encode() + body
+    )
+    await writer.drain()
+    status = int((await reader.readline()).split()[1])
+    writer.close()
+    return status
+
+
+async def serve_and_post(secret):
+    request = RecordingRequest()
+    application = Application.builder().token(FAKE_TOKEN).request(request).get_updates_request(request).build()
+    dispatched = asyncio.Event()
+
+    async def ping(update, context):
+        await update.message.reply_text("pong")
+        dispatched.set()
+
+    application.add_handler(CommandHandler("ping", ping))
+    server = WebhookServer(application, listen="127.0.0.1", port=0, path="/telegram", secret_token=SECRET)
+    stop = asyncio.Event()
+    running = asyncio.create_task(run_webhook(application, server, stop))
+    while server.port == 0:
+        await asyncio.sleep(0.01)
+    try:
+        status = await post(server.port, json.dumps(UPDATE).encode(), secret)
+        if status == 200:
+            await asyncio.wait_for(dispatched.wait(), 5)
+    finally:
+        stop.set()
+        await running
+    return status, server.received, request.calls_to("sendMessage")
+
+
+def test_posted_update_is_dispatched():
+    status, received, sent = asyncio.run(serve_and_post(SECRET))
+    assert status == 200
+    assert received == 1
+    assert [call["text"] for call in sent] == ["pong"]
+
+
+def test_wrong_secret_is_rejected():
+    status, received, sent = asyncio.run(serve_and_post("wrong"))
+    assert status == 403
+    assert received == 0
+    assert sent == []
+
+
+def test_bot_stops_its_metrics_server_and_lag_sampler(database, monkeypatch, recwarn):
+    import main
+
+    # Port 0, so a bot already running on this host does not get in the way
+    monkeypatch.setattr(metrics, "start_server", functools.partial(metrics.start_server, port="0"))
+    request = RecordingRequest()
+    application = main.build_application(
+        Application.builder().token(FAKE_TOKEN).request(request).get_updates_request(request)
+    )
+    server = WebhookServer(application, listen="127.0.0.1", port=0, path="/telegram", secret_token=SECRET)
+
+    async def go():
+        stop = asyncio.Event()
+        running = asyncio.create_task(run_webhook(application, server, stop))
+        while server.port == 0:
+            await asyncio.sleep(0.01)
+        metrics_server, lag_task = main.metrics_server, main.loop_lag_task
+        assert metrics_server.is_serving() and not lag_task.done()
+        stop.set()
+        await running
+        return metrics_server, lag_task
+
+    metrics_server, lag_task = asyncio.run(go())
+    assert not metrics_server.is_serving()
+    assert lag_task.cancelled()
+    assert (main.metrics_server, main.loop_lag_task) == (None, None)
+    assert not [w for w in recwarn if "create_task" in str(w.message)]
@@ -0,0 +1,62 @@
+import asyncio
+
+import db
+from write_behind import WriteBehind
+
+
+def add_user(user_id):
+    db.execute("INSERT INTO users (id, name) VALUES (?, ?)", (user_id, f"user{user_id}"))
+
+
+def skills_of(user_id):
+    return db.fetchone("SELECT skills FROM users WHERE id = ?", (user_id,))[0]
+
+
+async def wait_for(check, timeout=5.0):
+    deadline = asyncio.get_running_loop().time() + timeout
+    while not await db.run(check):
+        assert asyncio.get_running_loop().time() < deadline, "write was not flushed"
+        await asyncio.sleep(0.01)
+
+
+def test_put_from_db_worker_thread_is_flushed(database):
+    add_user(1)
+
+    async def go():
+        writes = WriteBehind(interval_ms=10)
+        writes.start()
+        # set_skills runs on a db.run worker thread and queues its write from there
+        await db.run(writes.put, 1, 'skills', 'python, sql')
+        await wait_for(lambda: skills_of(1) == 'python, sql')
+        assert writes.flushes == 1
+        await writes.close()
+
+    asyncio.run(go())
+
+
+def test_full_batch_from_worker_thread_wakes_flusher(database):
+    for user_id in (1, 2):
+        add_user(user_id)
+
+    async def go():
+        writes = WriteBehind(interval_ms=60000, max_batch=2)
+        writes.start()
+        await db.run(writes.put, 1, 'skills', 'go')
+        await db.run(writes.put, 2, 'skills', 'rust')
+        await wait_for(lambda: skills_of(1) == 'go' and skills_of(2) == 'rust')
+        await writes.close()
+
+    asyncio.run(go())
+
+
+def test_put_on_loop_starts_flusher(database):
+    add_user(1)
+
+    async def go():
+        writes = WriteBehind(interval_ms=10)
+        writes.put(1, 'skills', 'c++')
+        assert writes.pending(1) == {'skills': 'c++'}
+        await wait_for(lambda: skills_of(1) == 'c++')
+        await writes.close()
+
+    asyncio.run(go())
@@ -0,0 +1,132 @@
+"""In-memory cache of VIP entitlements with expiry-aware eviction."""
+import threading
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from typing import Callable, Optional, Tuple, Union
+
+VIP_CACHE_MAX_ENTRIES = 100000
+# Non-VIP entries are re-checked after this long, in case another process sold a subscription
+VIP_CACHE_NEGATIVE_TTL = timedelta(minutes=5)
+# Changes remembered to reject fills that raced with a write
+VIP_CACHE_MAX_CHANGES = 10000
+
+_MISSING = object()
+
+
+def parse_vip_until(value: Optional[int]) -> Optional[datetime]:
+    """The stored ``vip_until`` (Unix seconds) as a local datetime."""
+    return datetime.fromtimestamp(value) if value is not None else None
+
+
+class VipCache:
+    """Holds each user's active ``vip_until`` (or None when not VIP).
+
+    An entry is dropped as soon as its ``vip_until`` has passed, so the next
+    check reloads it from the database; non-VIP entries are dropped after
+    ``negative_ttl``. Writes go through ``set`` or ``invalidate`` so a
+    purchase is visible immediately.
+
+    Like ``ProfileCache``, every write bumps a version: a value loaded from
+    the database is only cached if the user did not change since the version
+    taken before the load, so a lookup racing a purchase cannot put the old
+    status back.
+    """
+
+    def __init__(
+        self,
+        loader: Callable[[int], Optional[int]],
+        clock: Callable[[], datetime] = datetime.now,
+        max_entries: int = VIP_CACHE_MAX_ENTRIES,
+        negative_ttl: timedelta = VIP_CACHE_NEGATIVE_TTL,
+    ) -> None:
+        self._loader = loader
+        self._clock = clock
+        self.max_entries = max_entries
+        self.negative_ttl = negative_ttl
+        # user_id -> (vip_until or None, when the entry expires)
+        self._entries: "OrderedDict[int, Tuple[Optional[datetime], datetime]]" = OrderedDict()
+        self._changes: "OrderedDict[int, int]" = OrderedDict()
+        self._version = 0
+        self._forgotten = 0
+        self._lock = threading.Lock()
+
+    def version(self) -> int:
+        with self._lock:
+            return self._version
+
+    def _lookup(self, user_id: int) -> Union[Optional[datetime], object]:
+        with self._lock:
+            entry = self._entries.get(user_id, _MISSING)
+            if entry is _MISSING:
+                return _MISSING
+            until, expires = entry
+            if self._clock() >= expires:
+                del self._entries[user_id]
+                return _MISSING
+            self._entries.move_to_end(user_id)
+            return until
+
+    def _store(self, user_id: int, until: Optional[datetime], since: Optional[int] = None) -> Optional[datetime]:
+        """Cache ``until``; with ``since`` only if the user did not change after that version."""
+        now = self._clock()
+        if until is not None and now >= until:
+            until = None
+        with self._lock:
+            if since is not None and self._changes.get(user_id, self._forgotten) > since:
+                return until
+            self._entries[user_id] = (until, until if until is not None else now + self.negative_ttl)
+            self._entries.move_to_end(user_id)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return until
+
+    def _changed(self, user_id: int) -> None:
+        # Called with self._lock held
+        self._version += 1
+        self._changes[user_id] = self._version
+        self._changes.move_to_end(user_id)
+        while len(self._changes) > VIP_CACHE_MAX_CHANGES:
+            _, self._forgotten = self._changes.popitem(last=False)
+
+    def cached(self, user_id: int) -> Optional[bool]:
+        """VIP status if it is cached, None if a database lookup is needed."""
+        until = self._lookup(user_id)
+        if until is _MISSING:
+            return None
+        return until is not None
+
+    def active_until(self, user_id: int) -> Optional[datetime]:
+        """Return the active ``vip_until``, loading it on a miss."""
+        until = self._lookup(user_id)
+        if until is _MISSING:
+            since = self.version()
+            until = self._store(user_id, parse_vip_until(self._loader(user_id)), since)
+        return until
+
+    def remember(self, user_id: int, vip_until: Optional[int], since: int) -> Optional[datetime]:
+        """Like ``active_until`` but fills a miss from a value loaded after ``version()`` returned ``since``."""
+        until = self._lookup(user_id)
+        if until is _MISSING:
+            until = self._store(user_id, parse_vip_until(vip_until), since)
+        return until
+
+    def is_vip(self, user_id: int) -> bool:
+        return self.active_until(user_id) is not None
+
+    def set(self, user_id: int, until: Optional[datetime]) -> None:
+        """Write-through after ``vip_until`` changed in the database."""
+        with self._lock:
+            self._changed(user_id)
+        self._store(user_id, until)
+
+    def invalidate(self, user_id: int) -> None:
+        with self._lock:
+            self._changed(user_id)
+            self._entries.pop(user_id, None)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._version += 1
+            self._forgotten = self._version
+            self._changes.clear()
+            self._entries.clear()
@@ -0,0 +1,170 @@
+"""Minimal asyncio HTTP server that feeds Telegram webhook updates to an Application.
+
+The server only understands what Telegram sends: ``POST <path>`` with a JSON
+body and an optional ``X-Telegram-Bot-Api-Secret-Token`` header. Updates are
+put on ``application.update_queue`` exactly like the built-in updater does, so
+handlers behave the same as with polling. Nothing here talks to Telegram
+unless a public ``WEBHOOK_URL`` is configured, which makes it possible to POST
+recorded update JSON to a local server while offline.
+"""
+import asyncio
+import json
+import logging
+import os
+import signal
+from typing import Optional, Tuple
+
+from telegram import Update
+from telegram.ext import Application
+
+WEBHOOK_LISTEN = os.getenv("WEBHOOK_LISTEN", "127.0.0.1")
+WEBHOOK_PORT = int(os.getenv("WEBHOOK_PORT", "8443"))
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/telegram")
+# Public URL registered with Telegram; leave unset to only serve locally
+WEBHOOK_URL = os.getenv("WEBHOOK_URL")
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET")
+
+MAX_BODY_BYTES = 1 << 20
+SECRET_HEADER = "x-telegram-bot-api-secret-token"
+
+logger = logging.getLogger(__name__)
+
+STATUS_TEXT = {200: "OK", 400: "Bad Request", 403: "Forbidden", 404: "Not Found",
+               405: "Method Not Allowed", 413: "Payload Too Large"}
+
+
+class WebhookServer:
+    """Accepts webhook POSTs and queues the decoded updates."""
+
+    def __init__(
+        self,
+        application: Application,
+        listen: str = WEBHOOK_LISTEN,
+        port: int = WEBHOOK_PORT,
+        path: str = WEBHOOK_PATH,
+        secret_token: Optional[str] = WEBHOOK_SECRET,
+    ) -> None:
+        self.application = application
+        self.listen = listen
+        self.port = port
+        self.path = path if path.startswith("/") else f"/{path}"
+        self.secret_token = secret_token
+        self._server: Optional[asyncio.AbstractServer] = None
+        self.received = 0
+
+    async def start(self) -> None:
+        self._server = await asyncio.start_server(self._handle_connection, self.listen, self.port)
+        # Port 0 picks a free port; report the real one
+        self.port = self._server.sockets[0].getsockname()[1]
+        logger.info(f"Webhook server listening on http://{self.listen}:{self.port}{self.path}")
+
+    async def stop(self) -> None:
+        """Stop accepting connections; requests already read are kept."""
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+
+    async def _handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        try:
+            while True:
+                request = await self._read_request(reader)
+                if request is None:
+                    break
+                status, keep_alive = await self._process(*request)
+                writer.write(
+                    f"HTTP/1.1 {status} {STATUS_TEXT[status]}\r\n"
+                    f"Content-Length: 0\r\n"
+                    f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n".encode()
+                )
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError, ValueError):
+            pass
+        finally:
+            writer.close()
+
+    async def _read_request(self, reader: asyncio.StreamReader) -> Optional[Tuple[str, str, dict, bytes]]:
+        request_line = await reader.readline()
+        if not request_line:
+            return None
+        method, target, _ = request_line.decode("latin-1").split(" ", 2)
+        headers = {}
+        while True:
+            line = await reader.readline()
+            if line in (b"\r\n", b"\n", b""):
+                break
+            name, _, value = line.decode("latin-1").partition(":")
+            headers[name.strip().lower()] = value.strip()
+        length = int(headers.get("content-length", "0"))
+        if length > MAX_BODY_BYTES:
+            return method, target, headers, b""
+        body = await reader.readexactly(length) if length else b""
+        return method, target, headers, body
+
+    async def _process(self, method: str, target: str, headers: dict, body: bytes) -> Tuple[int, bool]:
+        keep_alive = headers.get("connection", "").lower() != "close"
+        if target.split("?", 1)[0] != self.path:
+            return 404, keep_alive
+        if method != "POST":
+            return 405, keep_alive
+        if self.secret_token and headers.get(SECRET_HEADER) != self.secret_token:
+            return 403, keep_alive
+        if int(headers.get("content-length", "0")) > MAX_BODY_BYTES:
+            return 413, False
+        try:
+            update = Update.de_json(json.loads(body), self.application.bot)
+        except Exception as e:
+            logger.warning(f"Rejected webhook body: {e}")
+            return 400, keep_alive
+        self.received += 1
+        await self.application.update_queue.put(update)
+        return 200, keep_alive
+
+
+async def run_webhook(
+    application: Application,
+    server: Optional[WebhookServer] = None,
+    stop: Optional[asyncio.Event] = None,
+) -> None:
+    """Run the bot from webhook updates until SIGINT/SIGTERM or ``stop`` is set.
+
+    Mirrors ``Application.run_webhook``: post_init, post_stop and
+    post_shutdown callbacks are called, and updates that were already queued
+    are processed before the application stops.
+    """
+    server = server or WebhookServer(application)
+    stop = stop or asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(sig, stop.set)
+        except (NotImplementedError, RuntimeError):
+            pass
+
+    await application.initialize()
+    if application.post_init:
+        await application.post_init(application)
+    await application.start()
+    await server.start()
+    try:
+        if WEBHOOK_URL:
+            await application.bot.set_webhook(
+                url=WEBHOOK_URL, secret_token=server.secret_token, allowed_updates=Update.ALL_TYPES
+            )
+        await stop.wait()
+    finally:
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            try:
+                loop.remove_signal_handler(sig)
+            except (NotImplementedError, RuntimeError):
+                pass
+        logger.info("Shutting down webhook server")
+        await server.stop()
+        await application.stop()
+        if application.post_stop:
+            await application.post_stop(application)
+        await application.shutdown()
+        if application.post_shutdown:
+            await application.post_shutdown(application)
@@ -0,0 +1,147 @@
+"""Write-behind queue that batches profile field updates into one transaction."""
+import asyncio
+import logging
+import os
+import threading
+from collections import defaultdict
+from typing import Any, DefaultDict, Dict, List, Optional, Tuple
+
+import db
+
+WRITE_BEHIND_INTERVAL_MS = int(os.getenv("WRITE_BEHIND_INTERVAL_MS", "50"))
+WRITE_BEHIND_MAX_BATCH = int(os.getenv("WRITE_BEHIND_MAX_BATCH", "200"))
+
+# Only these users columns may be written through the queue
+FIELDS = ('phone_number', 'email', 'skills', 'preferences')
+
+logger = logging.getLogger(__name__)
+
+
+class WriteBehind:
+    """Collects ``users`` field updates and flushes them in batches.
+
+    Updates are flushed in one transaction every ``interval_ms`` or as soon as
+    ``max_batch`` writes are queued, whichever comes first. Values that are
+    queued or being flushed are visible through ``pending`` so readers can see
+    their own writes before they reach the database.
+
+    ``put`` may be called from the event loop or from a ``db.run`` worker
+    thread; off the loop it hands the wake-up to the loop the flusher was
+    started on (see ``start``) with ``call_soon_threadsafe``.
+    """
+
+    def __init__(self, interval_ms: int = WRITE_BEHIND_INTERVAL_MS, max_batch: int = WRITE_BEHIND_MAX_BATCH) -> None:
+        self.interval = interval_ms / 1000
+        self.max_batch = max_batch
+        self._queued: Dict[int, Dict[str, Any]] = {}
+        self._inflight: Dict[int, Dict[str, Any]] = {}
+        self._writes = 0
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wake: Optional[asyncio.Event] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._task: Optional[asyncio.Task] = None
+        self._closing = False
+        self.flushes = 0
+        self.flushed_writes = 0
+
+    def put(self, user_id: int, field: str, value: Any) -> None:
+        """Queue ``UPDATE users SET <field> = value WHERE id = user_id``."""
+        if field not in FIELDS:
+            raise ValueError(f"{field} cannot be written behind")
+        with self._lock:
+            self._queued.setdefault(user_id, {})[field] = value
+            self._writes += 1
+            full = self._writes >= self.max_batch
+        try:
+            asyncio.get_running_loop()
+        except RuntimeError:
+            # A worker thread: asyncio objects may only be touched on their loop
+            loop = self._loop
+            if loop is not None and not loop.is_closed():
+                loop.call_soon_threadsafe(self._wake_up, full)
+            return
+        self._wake_up(full)
+
+    def pending(self, user_id: int) -> Dict[str, Any]:
+        """Field values for ``user_id`` that may not be in the database yet."""
+        with self._lock:
+            values = dict(self._inflight.get(user_id, {}))
+            values.update(self._queued.get(user_id, {}))
+        return values
+
+    def flush(self) -> int:
+        """Write everything queued so far in one transaction (blocking)."""
+        with self._flush_lock:
+            with self._lock:
+                batch, self._queued = self._queued, {}
+                writes, self._writes = self._writes, 0
+                self._inflight = batch
+            if not batch:
+                return 0
+            statements: DefaultDict[Tuple[str, ...], List[tuple]] = defaultdict(list)
+            for user_id, values in batch.items():
+                fields = tuple(sorted(values))
+                statements[fields].append(tuple(values[f] for f in fields) + (user_id,))
+            try:
+                with db.transaction() as conn:
+                    for fields, rows in statements.items():
+                        assignments = ", ".join(f"{f} = ?" for f in fields)
+                        conn.executemany(f"UPDATE users SET {assignments} WHERE id = ?", rows)
+            except Exception:
+                # Put the batch back underneath anything queued meanwhile
+                with self._lock:
+                    for user_id, values in batch.items():
+                        merged = dict(values)
+                        merged.update(self._queued.get(user_id, {}))
+                        self._queued[user_id] = merged
+                    self._writes += writes
+                    self._inflight = {}
+                raise
+            with self._lock:
+                self._inflight = {}
+            self.flushes += 1
+            self.flushed_writes += writes
+            return writes
+
+    def start(self) -> None:
+        """Start the background flusher on the running event loop.
+
+        Writes queued from other threads before this are flushed with the first batch.
+        """
+        loop = asyncio.get_running_loop()
+        if self._task is not None and not self._task.done() and self._loop is loop:
+            return
+        self._loop = loop
+        self._wake = asyncio.Event()
+        self._task = loop.create_task(self._run())
+
+    def _wake_up(self, full: bool) -> None:
+        # Runs on the event loop
+        self.start()
+        if full:
+            self._wake.set()
+
+    async def _run(self) -> None:
+        while not self._closing:
+            try:
+                await asyncio.wait_for(self._wake.wait(), timeout=self.interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wake.clear()
+            try:
+                await db.run(self.flush)
+            except Exception as e:
+                logger.error(f"Write-behind flush failed, will retry: {e}")
+
+    async def close(self) -> None:
+        """Stop the background flusher and durably write what is left."""
+        self._closing = True
+        try:
+            if self._task is not None:
+                self._wake.set()
+                await self._task
+                self._task = None
+            await db.run(self.flush)
+        finally:
+            self._closing = False